@@ -0,0 +1,114 @@
+"""
+Measures search latency over a synthetic corpus stored in the sqlite sink
+(and postgres, if configured), compared with a plain LIKE scan.
+
+Usage:
+    python -m benchmarks.bench_search --animes 200 --episodes 12 --rows-per-episode 300
+"""
+import argparse
+import os
+
+import pandas as pd
+from dotenv import load_dotenv
+from prefect import flow
+
+from utils.connectors import postgres_connector, sqlite_connector
+from utils.search import search_quotes
+from utils.writers import write_postgres, write_sqlite
+
+from .common import report, synthetic_quotes, timed
+
+SCHEMA = "bench_search"
+QUERIES = [
+    ("words", "demon king", {}),
+    ("phrase", "the magic", {}),
+    ("prefix", "rememb flow", {}),
+    ("words", "spell", {"mal_id": 3, "episode": 2}),
+    ("words", "hero", {"name": "Himmel"}),
+]
+
+
+def load_corpus(con, writer, animes: int, episodes: int, rows_per_episode: int) -> int:
+    rows = 0
+    for mal_id in range(1, animes + 1):
+        df = synthetic_quotes(
+            episodes=episodes, lines_per_episode=rows_per_episode, seed=mal_id
+        )
+        df["mal_id"] = mal_id
+        writer(
+            df=df,
+            con=con,
+            schema=SCHEMA,
+            table_name=f"anime_{mal_id}",
+            clear_songs=False,
+            cleanup=False,
+            index_quotes=True,
+        )
+        rows += len(df)
+
+    return rows
+
+
+def run_queries(con, backend: str, animes: int, repeat: int) -> None:
+    for mode, text, filters in QUERIES:
+        seconds = timed(
+            search_quotes, con, text, mode=mode, schema=SCHEMA, repeat=repeat, **filters
+        )
+        report(f"{backend} {mode} '{text}' {filters or ''}", seconds)
+
+    # what finding a line costs without the index: a scan over every anime table
+    like = " UNION ALL ".join(
+        f"SELECT * FROM {SCHEMA}.anime_{mal_id} WHERE quote LIKE '%%demon king%%'"
+        for mal_id in range(1, animes + 1)
+    )
+    report(f"{backend} LIKE scan (every table)", timed(pd.read_sql, like, con, repeat=repeat))
+
+
+@flow
+def bench_search(animes: int, episodes: int, rows_per_episode: int, repeat: int) -> None:
+    if os.path.exists(f"database/{SCHEMA}.db"):
+        os.remove(f"database/{SCHEMA}.db")
+
+    con = sqlite_connector(db_name=SCHEMA, schema=SCHEMA)
+    seconds = timed(
+        load_corpus, con, write_sqlite, animes, episodes, rows_per_episode, repeat=1
+    )
+    report("sqlite corpus load", seconds, animes * episodes * rows_per_episode)
+    run_queries(con, "sqlite", animes, repeat)
+    con.close()
+
+    load_dotenv()
+    if not os.getenv("HOST"):
+        print("Postgres connection not configured, skipping postgres search.")
+        return
+
+    con = postgres_connector(
+        user=os.getenv("USER"),
+        password=os.getenv("PASSWORD"),
+        host=os.getenv("HOST"),
+        database=os.getenv("DATABASE"),
+        port=os.getenv("PORT"),
+    )
+    con.cursor().execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA};")
+    seconds = timed(
+        load_corpus, con, write_postgres, animes, episodes, rows_per_episode, repeat=1
+    )
+    report("postgres corpus load", seconds, animes * episodes * rows_per_episode)
+    run_queries(con, "postgres", animes, repeat)
+    con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--animes", type=int, default=200)
+    parser.add_argument("--episodes", type=int, default=12)
+    parser.add_argument("--rows-per-episode", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    bench_search(
+        animes=args.animes,
+        episodes=args.episodes,
+        rows_per_episode=args.rows_per_episode,
+        repeat=args.repeat,
+    )
@@ -0,0 +1,72 @@
+"""
+Compares the write throughput of the available sinks.
+
+Usage:
+    python -m benchmarks.bench_sinks --rows-per-episode 300 --episodes 24
+
+The postgres path only runs if the connection variables (HOST, PORT, DATABASE,
+USER, PASSWORD) are set, same as main.py.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+from prefect import flow
+
+from utils.connectors import postgres_connector, sqlite_connector
+from utils.writers import write_data, write_postgres, write_sqlite
+
+from .common import report, synthetic_quotes, timed
+
+SCHEMA = "bench_quotes"
+TABLE = "bench_sink"
+
+
+@flow
+def bench_sinks(episodes: int, rows_per_episode: int, repeat: int) -> None:
+    df = synthetic_quotes(episodes=episodes, lines_per_episode=rows_per_episode)
+    rows = len(df)
+
+    def sqlite_to_sql() -> None:
+        con = sqlite_connector(db_name=SCHEMA)
+        write_data(df=df, con=con, table_name=TABLE, if_exists="replace", clear_songs=False)
+        con.close()
+
+    def sqlite_tuned() -> None:
+        con = sqlite_connector(db_name=SCHEMA, schema=SCHEMA)
+        write_sqlite(df=df, con=con, schema=SCHEMA, table_name=TABLE, clear_songs=False)
+
+    report("sqlite (df.to_sql)", timed(sqlite_to_sql, repeat=repeat), rows)
+    report("sqlite (write_sqlite)", timed(sqlite_tuned, repeat=repeat), rows)
+
+    load_dotenv()
+    if not os.getenv("HOST"):
+        print("Postgres connection not configured, skipping write_postgres.")
+        return
+
+    def postgres() -> None:
+        con = postgres_connector(
+            user=os.getenv("USER"),
+            password=os.getenv("PASSWORD"),
+            host=os.getenv("HOST"),
+            database=os.getenv("DATABASE"),
+            port=os.getenv("PORT"),
+        )
+        con.cursor().execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA};")
+        write_postgres(df=df, con=con, schema=SCHEMA, table_name=TABLE, clear_songs=False)
+
+    report("postgres (write_postgres)", timed(postgres, repeat=repeat), rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--episodes", type=int, default=24)
+    parser.add_argument("--rows-per-episode", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    bench_sinks(
+        episodes=args.episodes,
+        rows_per_episode=args.rows_per_episode,
+        repeat=args.repeat,
+    )
@@ -0,0 +1,99 @@
+"""
+Measures the startup time of the cli for lightweight commands (no prefect, no
+crawler) and compares it with their targets. verify and export run for real, on
+an empty data folder and a small sqlite table. Importing main.py (the full stack)
+is shown for reference.
+
+Usage:
+    python -m benchmarks.bench_startup --repeat 10
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli.py")
+
+# lightweight commands must answer within this time (interpreter startup included)
+STARTUP_TARGET_SECONDS = 0.25
+# export loads pandas and pyarrow, but neither prefect nor the crawler
+EXPORT_TARGET_SECONDS = 2.0
+
+COMMANDS = {
+    "cli.py --help": ([sys.executable, CLI, "--help"], STARTUP_TARGET_SECONDS),
+    "cli.py download --help": (
+        [sys.executable, CLI, "download", "--help"],
+        STARTUP_TARGET_SECONDS,
+    ),
+    "cli.py verify": ([sys.executable, CLI, "verify"], STARTUP_TARGET_SECONDS),
+    "cli.py export (sqlite, 1 table)": (
+        [sys.executable, CLI, "export", "anime", "--sink", "sqlite", "--root", "exports"],
+        EXPORT_TARGET_SECONDS,
+    ),
+}
+REFERENCE = {
+    "python -c pass": [sys.executable, "-c", "pass"],
+    "import main (full stack)": [sys.executable, "-c", "import main"],
+}
+
+
+def create_workspace(folder: str) -> None:
+    """
+    Empty data folder (for verify) and a sqlite quote table (for export), laid out
+    as the cli expects them on its working directory.
+    """
+    os.makedirs(os.path.join(folder, "data"))
+    os.makedirs(os.path.join(folder, "database"))
+    con = sqlite3.connect(os.path.join(folder, "database", "quotes.db"))
+    con.execute(
+        "create table anime (mal_id INTEGER, episode INTEGER, name TEXT, "
+        "quote TEXT, start_time TEXT, end_time TEXT);"
+    )
+    con.executemany(
+        "insert into anime values (?, ?, ?, ?, ?, ?);",
+        [
+            (1, episode, "Frieren", "quote", "0:00:01.000", "0:00:02.000")
+            for episode in range(1, 13)
+        ],
+    )
+    con.commit()
+    con.close()
+
+
+def measure(command: list[str], repeat: int, cwd: Optional[str] = None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True, cwd=cwd)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    failed = []
+    with tempfile.TemporaryDirectory() as folder:
+        create_workspace(folder)
+        for name, (command, target) in COMMANDS.items():
+            seconds = measure(command, args.repeat, cwd=folder)
+            status = "ok" if seconds <= target else "ABOVE TARGET"
+            print(
+                f"{name:<40} {seconds * 1000:>8.1f} ms  "
+                f"[{status}, target {target * 1000:.0f} ms]"
+            )
+            if seconds > target:
+                failed.append(name)
+
+    for name, command in REFERENCE.items():
+        seconds = measure(command, min(args.repeat, 3))
+        print(f"{name:<40} {seconds * 1000:>8.1f} ms  (reference)")
+
+    if failed:
+        sys.exit(1)
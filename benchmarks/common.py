@@ -0,0 +1,66 @@
+import datetime
+import gc
+import random
+import time
+from typing import Any, Callable
+
+import pandas as pd
+
+NAMES = ["Unknown", "Frieren", "Fern", "Stark", "Himmel", "Heiter", "Eisen"]
+WORDS = (
+    "the a of to and magic demon king journey time years human elf "
+    "remember flower spell village sword hero party long short why"
+).split()
+
+
+def synthetic_quotes(
+    mal_ids: int = 1,
+    episodes: int = 12,
+    lines_per_episode: int = 300,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """
+    Builds a quotes dataframe shaped like the output of build_df_from_ass_files.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for mal_id in range(1, mal_ids + 1):
+        for episode in range(1, episodes + 1):
+            start = datetime.timedelta(seconds=5)
+            for _ in range(lines_per_episode):
+                end = start + datetime.timedelta(milliseconds=rng.randint(800, 4000))
+                quote = " ".join(rng.choices(WORDS, k=rng.randint(3, 14)))
+                rows.append([mal_id, episode, rng.choice(NAMES), quote, start, end])
+                start = end
+
+    df = pd.DataFrame(
+        rows, columns=["mal_id", "episode", "name", "quote", "start_time", "end_time"]
+    )
+    return df.astype({"mal_id": "int32", "episode": "int32"})
+
+
+def timed(
+    fn: Callable[..., Any], *args: Any, repeat: int = 3, warmup: int = 1, **kwargs: Any
+) -> float:
+    """
+    Returns the best wall time (in seconds) of repeat calls of fn, after warmup
+    untimed calls (lazy imports, first connection, file cache), so even a single
+    repeat measures the steady state. Garbage left by earlier benchmarks is
+    collected first, so it is not charged to fn.
+    """
+    gc.collect()
+    for _ in range(warmup):
+        fn(*args, **kwargs)
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def report(name: str, seconds: float, rows: int = 0) -> None:
+    rate = f" ({rows / seconds:,.0f} rows/s)" if rows and seconds else ""
+    print(f"{name:<40} {seconds * 1000:>10.1f} ms{rate}")
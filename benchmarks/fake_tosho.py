@@ -0,0 +1,266 @@
+"""
+Local stand-in for animetosho.org, serving the synthetic pages from
+benchmarks/fixtures.py, so the crawler can be load tested without hitting the site.
+
+Usage:
+    python -m benchmarks.fake_tosho --port 8000 --latency 0.05 --error-rate-429 0.02
+
+Then point the crawl to it, e.g. populate_db(base_url="http://127.0.0.1:8000", ...).
+Counters of served requests are available at /_stats.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from utils.constants import LISTING_PATH
+
+from .fixtures import ass_file, batch_page, episode_page, listing_page, series_page
+
+SERIES_REGEX = re.compile(r"synthetic-anime-(\d+)\.")
+EPISODE_REGEX = re.compile(r"synthetic-anime-(\d+)\.\d+-(\d+)\.")
+BATCH_REGEX = re.compile(r"synthetic-anime-(\d+)\.\d+-batch\.")
+
+
+@dataclass
+class ServerConfig:
+    host: str = "127.0.0.1"
+    port: int = 8000
+    # listing shape
+    listing_pages: int = 5
+    animes_per_page: int = 20
+    episode_count: int = 24
+    # latency added to every response: latency + uniform(0, jitter) seconds
+    latency: float = 0.0
+    jitter: float = 0.0
+    # probability of answering with 429/503 instead of the page
+    error_rate_429: float = 0.0
+    error_rate_5xx: float = 0.0
+    # max requests per second accepted (token bucket), the excess gets a 429
+    max_rps: Optional[float] = None
+    seed: int = 0
+    # bump to serve different subtitle files (e.g. to test revalidation)
+    subtitle_version: int = 0
+    # probability of sending a truncated subtitle file (as an interrupted transfer)
+    truncate_rate: float = 0.0
+    # send ETag/Last-Modified with subtitle files and answer conditional requests
+    validators: bool = True
+    # list a batch release on series pages, with subtitles for every episode
+    # (but every batch_missing_every-th episode, to exercise the fallback)
+    batches: bool = False
+    batch_missing_every: int = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+
+@dataclass
+class TokenBucket:
+    rate: float
+    capacity: float = 0.0
+    tokens: float = 0.0
+    updated_at: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self) -> None:
+        self.capacity = self.capacity or max(self.rate, 1.0)
+        self.tokens = self.capacity
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+@lru_cache(maxsize=4096)
+def _subtitle(index: int, episode: int, version: int = 0) -> bytes:
+    return ass_file(episode, seed=index + version * 100003)
+
+
+def make_handler(config: ServerConfig) -> type[BaseHTTPRequestHandler]:
+    rng = random.Random(config.seed)
+    bucket = TokenBucket(rate=config.max_rps) if config.max_rps else None
+    stats: dict[str, int] = {}
+    stats_lock = threading.Lock()
+
+    class FakeToshoHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args) -> None:
+            # keep the console quiet under load
+            return
+
+        def _count(self, key: str) -> None:
+            with stats_lock:
+                stats[key] = stats.get(key, 0) + 1
+
+        def _send(
+            self,
+            status: int,
+            body: bytes,
+            content_type: str,
+            headers: Optional[dict[str, str]] = None,
+        ) -> None:
+            if status == 200 and headers and (
+                self.headers.get("If-None-Match") == headers.get("ETag")
+                or self.headers.get("If-Modified-Since") == headers.get("Last-Modified")
+            ):
+                status, body = 304, b""
+
+            self._count(str(status))
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def _route(self) -> tuple:
+            parts = urlsplit(self.path)
+            query = parse_qs(parts.query)
+            page = int(query.get("page", ["1"])[0])
+            html = "text/html; charset=utf-8"
+
+            if parts.path == LISTING_PATH:
+                if page > config.listing_pages:
+                    return 200, listing_page(page, 0, config.base_url).encode(), html
+                body = listing_page(page, config.animes_per_page, config.base_url)
+                return 200, body.encode(), html
+
+            if parts.path.startswith("/series/"):
+                matched = SERIES_REGEX.search(parts.path)
+                if matched:
+                    body = series_page(
+                        int(matched.group(1)),
+                        page,
+                        config.episode_count,
+                        config.base_url,
+                        config.batches,
+                    )
+                    return 200, body.encode(), html
+
+            if parts.path.startswith("/view/"):
+                matched = BATCH_REGEX.search(parts.path)
+                if matched:
+                    body = batch_page(
+                        int(matched.group(1)),
+                        config.episode_count,
+                        config.base_url,
+                        config.batch_missing_every,
+                    )
+                    return 200, body.encode(), html
+
+                matched = EPISODE_REGEX.search(parts.path)
+                if matched:
+                    index, episode = int(matched.group(1)), int(matched.group(2))
+                    body = episode_page(index, episode, config.base_url)
+                    return 200, body.encode(), html
+
+            if parts.path.startswith("/attach/"):
+                key = parts.path.split("/")[2]
+                index, episode = int(key[:5], 16), int(key[5:8], 16)
+                body = _subtitle(index, episode, config.subtitle_version)
+                if rng.random() < config.truncate_rate:
+                    self._count("truncated")
+                    body = body[: len(body) // 2]
+                headers = None
+                if config.validators:
+                    headers = {
+                        "ETag": f'"{hashlib.sha1(body).hexdigest()}"',
+                        # changes with the version, so If-Modified-Since works as well
+                        "Last-Modified": LAST_MODIFIED.replace(
+                            "00:00:00", f"00:00:{config.subtitle_version % 60:02}"
+                        ),
+                    }
+                return 200, body, "application/x-xz", headers
+
+            if parts.path == "/_stats":
+                with stats_lock:
+                    body = json.dumps(stats, indent=4)
+                return 200, body.encode(), "application/json"
+
+            return 404, b"Not Found", "text/plain"
+
+        def do_GET(self) -> None:
+            if not self.path.startswith("/_stats"):
+                self._count("requests")
+
+                delay = config.latency + rng.uniform(0, config.jitter)
+                if delay:
+                    time.sleep(delay)
+
+                if bucket is not None and not bucket.take():
+                    return self._send(429, b"Too Many Requests", "text/plain")
+
+                roll = rng.random()
+                if roll < config.error_rate_429:
+                    return self._send(429, b"Too Many Requests", "text/plain")
+                if roll < config.error_rate_429 + config.error_rate_5xx:
+                    return self._send(503, b"Service Unavailable", "text/plain")
+
+            self._send(*self._route())
+
+        do_HEAD = do_GET
+
+    return FakeToshoHandler
+
+
+def start_server(config: ServerConfig) -> ThreadingHTTPServer:
+    """
+    Starts the server on a background thread. Call .shutdown() when done.
+    Use port 0 to get a free port (config.port is updated accordingly).
+    """
+    server = ThreadingHTTPServer((config.host, config.port), make_handler(config))
+    config.port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--listing-pages", type=int, default=5)
+    parser.add_argument("--animes-per-page", type=int, default=20)
+    parser.add_argument("--episode-count", type=int, default=24)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=float, default=None)
+    parser.add_argument("--subtitle-version", type=int, default=0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--batches", action="store_true")
+    parser.add_argument("--batch-missing-every", type=int, default=0)
+    parser.add_argument("--no-validators", dest="validators", action="store_false")
+    args = parser.parse_args()
+
+    config = ServerConfig(**vars(args))
+    server = ThreadingHTTPServer((config.host, config.port), make_handler(config))
+    print(f"Serving fake animetosho on {config.base_url} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,367 @@
+"""
+Fixtures that emulate the animetosho.org pages parsed by utils.parsers.
+
+Synthetic fixtures are generated on the fly (deterministic for a given seed).
+Real responses can be recorded once and are then preferred over the synthetic ones:
+
+    python -m benchmarks.fixtures record https://animetosho.org/animes?page=1 ...
+"""
+import json
+import lzma
+import os
+import random
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Optional
+from unittest import mock
+
+import requests
+
+from utils.constants import (
+    BASE_URL,
+    LISTING_PATH,
+    MEMBER_CUT,
+    PATH_ID_MEMBER_MAP,
+    REMOVE_REPACK,
+)
+
+from .common import NAMES, WORDS
+
+RECORDED_FOLDER = os.path.join(os.path.dirname(__file__), "fixtures", "recorded")
+RECORDED_INDEX = "index.json"
+STORAGE_URL = "https://storage.animetosho.org"
+PROVIDER = "[SubsPlease]"
+# number of release entries per series page, like the real site
+ENTRIES_PER_PAGE = 50
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, \
+BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, \
+BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,70,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,\
+0,0,1,3,0,2,60,60,50,1
+Style: Sign,Arial,50,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,\
+0,0,1,3,0,8,60,60,50,1
+Style: OP,Arial,60,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,\
+0,0,1,3,0,8,60,60,50,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def _ass_time(seconds: float) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    return f"{int(hours)}:{int(minutes):02}:{secs:05.2f}"
+
+
+@lru_cache(maxsize=1)
+def _relevant_mal_ids() -> list[int]:
+    # the crawler ignores animes below MEMBER_CUT, so only use ids above it
+    with open(PATH_ID_MEMBER_MAP, "r", encoding="utf-8") as f:
+        members = json.load(f)
+    return sorted(int(mal_id) for mal_id, count in members.items() if count > MEMBER_CUT)
+
+
+def mal_id_for(index: int) -> int:
+    ids = _relevant_mal_ids()
+    return ids[(index - 1) % len(ids)]
+
+
+def series_slug(index: int) -> str:
+    return f"synthetic-anime-{index}.{17000 + index}"
+
+
+def series_link(index: int, base_url: str = BASE_URL) -> str:
+    return f"{base_url}/series/{series_slug(index)}"
+
+
+def episode_link(index: int, episode: int, base_url: str = BASE_URL) -> str:
+    return f"{base_url}/view/{series_slug(index)}-{episode:02}.n{index}{episode:03}"
+
+
+def subtitle_link(index: int, episode: int, base_url: str = STORAGE_URL) -> str:
+    return f"{base_url}/attach/{index:05x}{episode:03x}/episode_{episode:02}_eng.ass.xz"
+
+
+def release_title(index: int, episode: int, provider: str = PROVIDER) -> str:
+    return f"{provider} Synthetic Anime {index} - {episode:02} (1080p) [ABCD{episode:04}].mkv"
+
+
+def batch_link(index: int, base_url: str = BASE_URL) -> str:
+    return f"{base_url}/view/{series_slug(index)}-batch.n{index}000"
+
+
+def batch_title(index: int, episode_count: int, provider: str = PROVIDER) -> str:
+    return f"{provider} Synthetic Anime {index} (01-{episode_count:02}) (1080p) [Batch]"
+
+
+def listing_page(
+    page: int, entries: int = 20, base_url: str = BASE_URL
+) -> str:
+    divs = []
+    for position in range(entries):
+        index = (page - 1) * entries + position + 1
+        status = "(finished)" if index % 4 else "(ongoing)"
+        divs.append(
+            f'<div class="home_list_entry"><a href="{series_link(index, base_url)}">'
+            f"<strong>Synthetic Anime {index}</strong></a> {status}</div>"
+        )
+
+    return f"<html><body><div id=\"content\">{''.join(divs)}</div></body></html>"
+
+
+def series_page(
+    index: int,
+    page: int = 1,
+    episode_count: int = 24,
+    base_url: str = BASE_URL,
+    batch: bool = False,
+) -> str:
+    first = (page - 1) * ENTRIES_PER_PAGE + 1
+    last = min(episode_count, page * ENTRIES_PER_PAGE)
+
+    entries = []
+    if batch and page == 1:
+        size = 30_000_000_000
+        entries.append(
+            '<div class="home_list_entry">'
+            f'<div class="link"><a href="{batch_link(index, base_url)}">'
+            f"{batch_title(index, episode_count)}</a></div>"
+            f'<div class="size" title="Total file size: {size:,} bytes">27.9 GB</div>'
+            '<div class="links"><a href="#">Torrent</a> <em>Batch</em></div>'
+            "</div>"
+        )
+    for episode in range(first, last + 1):
+        size = 1_400_000_000 + episode * 1_000
+        entries.append(
+            '<div class="home_list_entry">'
+            f'<div class="link"><a href="{episode_link(index, episode, base_url)}">'
+            f"{release_title(index, episode)}</a></div>"
+            f'<div class="size" title="Total file size: {size:,} bytes">1.3 GB</div>'
+            '<div class="links"><a href="#">Torrent</a></div>'
+            "</div>"
+        )
+
+    return (
+        "<html><body><div><div><div><div><h2>"
+        f"Synthetic Anime {index}</h2></div></div></div></div>"
+        "<table><tbody><tr><td>"
+        f"<div><div>TV, {episode_count} episode(s), finished</div></div>"
+        f'<div><a href="https://myanimelist.net/anime/{mal_id_for(index)}">MAL</a></div>'
+        "</td></tr></tbody></table>"
+        f"{''.join(entries)}</body></html>"
+    )
+
+
+def episode_page(index: int, episode: int, storage_url: str = STORAGE_URL) -> str:
+    return (
+        '<html><body><div id="content"><table>'
+        f"<tr><th>Files</th><td>{release_title(index, episode)}</td></tr>"
+        "<tr><th>Subtitles</th><td>"
+        f'<a href="{subtitle_link(index, episode, storage_url).replace("_eng", "_por")}">'
+        "Portuguese [por, ASS]</a> "
+        f'<a href="{subtitle_link(index, episode, storage_url)}">English [eng, ASS]</a>'
+        "</td></tr></table></div></body></html>"
+    )
+
+
+def batch_page(
+    index: int,
+    episode_count: int = 24,
+    storage_url: str = STORAGE_URL,
+    missing_every: int = 0,
+) -> str:
+    """
+    Page of a batch release: one table per file, each with its own subtitles.
+    With missing_every=N, every Nth episode has no subtitle attachment.
+    """
+    tables = []
+    for episode in range(1, episode_count + 1):
+        subs = ""
+        if not missing_every or episode % missing_every:
+            link = subtitle_link(index, episode, storage_url)
+            subs = (
+                f'<a href="{link.replace("_eng", "_por")}">Portuguese [por, ASS]</a> '
+                f'<a href="{link}">English [eng, ASS]</a>'
+            )
+        tables.append(
+            "<table>"
+            f"<tr><th>File</th><td>{release_title(index, episode)}</td></tr>"
+            f"<tr><th>Subtitles</th><td>{subs}</td></tr>"
+            "</table>"
+        )
+
+    return (
+        '<html><body><div id="content">'
+        f"<h2>{batch_title(index, episode_count)}</h2>"
+        f"{''.join(tables)}</div></body></html>"
+    )
+
+
+def ass_file(episode: int, lines: int = 400, seed: int = 0) -> bytes:
+    """
+    Builds a .ass subtitle (compressed with xz, like the attachments served by the site),
+    with named lines, signs, override tags, line breaks, an opening, an ending and
+    an insert song.
+    """
+    rng = random.Random(seed * 1000 + episode)
+    events = []
+    start = 1.0
+
+    for position in range(lines):
+        end = start + rng.uniform(0.8, 4.0)
+        text = " ".join(rng.choices(WORDS, k=rng.randint(3, 14)))
+        style, name = "Default", rng.choice(NAMES[1:] + ["", "NTP"])
+
+        if position % 25 == 0:
+            style, name = "Sign", ""
+        elif position < 10:
+            # opening, same lyrics every episode
+            style, name, text = "OP", "OP", f"{{\\an8}}{WORDS[position]} la la la"
+        elif position >= lines - 8:
+            # ending, only the style tells it is a song
+            style, name = "ED_Romaji", ""
+            text, end = f"{WORDS[lines - position]} na na na", start + 2.5
+        elif 200 < position <= 206:
+            # insert song with a plain style, same lines and timing every episode
+            style, name = "Default", ""
+            text, end = f"{WORDS[position - 200]} oh oh oh", start + 3.0
+        elif position % 7 == 0:
+            text = "{\\i1}" + text.replace(" ", "\\N", 1) + "{\\i0}"
+
+        events.append(
+            f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},{style},{name},"
+            f"0,0,0,,{text}"
+        )
+        start = end if position % 5 else end + 2.0
+
+    content = ASS_HEADER + "\n".join(events) + "\n"
+    return lzma.compress(content.encode("utf-8-sig"))
+
+
+def build_fixtures(
+    animes: int = 20,
+    episode_count: int = 24,
+    base_url: str = BASE_URL,
+    storage_url: str = STORAGE_URL,
+    batches: bool = False,
+) -> dict[str, bytes]:
+    """
+    Returns a mapping of url -> response body covering one listing page with
+    every page/file needed to crawl it. With batches=True, series pages also
+    list a batch release (with the subtitles of every episode).
+    """
+    main_url = base_url + LISTING_PATH
+    fixtures = {main_url + "?page=1": listing_page(1, animes, base_url).encode()}
+
+    for index in range(1, animes + 1):
+        link = series_link(index, base_url)
+        fixtures[link + REMOVE_REPACK] = series_page(
+            index, 1, episode_count, base_url, batches
+        ).encode()
+        pages = -(-episode_count // ENTRIES_PER_PAGE) + 1
+        for page in range(1, pages + 1):
+            fixtures[link + REMOVE_REPACK + f"&page={page}"] = series_page(
+                index, page, episode_count, base_url, batches
+            ).encode()
+
+        if batches:
+            fixtures[batch_link(index, base_url)] = batch_page(
+                index, episode_count, storage_url
+            ).encode()
+
+        for episode in range(1, episode_count + 1):
+            fixtures[episode_link(index, episode, base_url)] = episode_page(
+                index, episode, storage_url
+            ).encode()
+            fixtures[subtitle_link(index, episode, storage_url)] = ass_file(
+                episode, seed=index
+            )
+
+    return fixtures
+
+
+def load_recorded(folder: str = RECORDED_FOLDER) -> dict[str, bytes]:
+    index_path = os.path.join(folder, RECORDED_INDEX)
+    if not os.path.exists(index_path):
+        return {}
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+
+    recorded = {}
+    for url, file_name in index.items():
+        with open(os.path.join(folder, file_name), "rb") as f:
+            recorded[url] = f.read()
+
+    return recorded
+
+
+def load_fixtures(**kwargs) -> dict[str, bytes]:
+    """
+    Synthetic fixtures, overridden by the recorded ones (if any).
+    """
+    fixtures = build_fixtures(**kwargs)
+    fixtures.update(load_recorded())
+    return fixtures
+
+
+def record(urls: list[str], folder: str = RECORDED_FOLDER) -> None:
+    os.makedirs(folder, exist_ok=True)
+    index_path = os.path.join(folder, RECORDED_INDEX)
+    index: dict[str, str] = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+
+    for url in urls:
+        res = requests.get(url=url, timeout=30)
+        res.raise_for_status()
+        file_name = f"{len(index):05}" + (".ass.xz" if url.endswith(".xz") else ".html")
+        with open(os.path.join(folder, file_name), "wb") as f:
+            f.write(res.content)
+        index[url] = file_name
+        print(f"Recorded {url} -> {file_name}")
+
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=4)
+
+
+def fixture_response(fixtures: dict[str, bytes], url: str) -> requests.Response:
+    res = requests.Response()
+    res.url = url
+    body: Optional[bytes] = fixtures.get(url)
+    res.status_code = 200 if body is not None else 404
+    res.reason = "OK" if body is not None else "Not Found"
+    res._content = body if body is not None else b""
+    res._content_consumed = True
+    res.encoding = "utf-8"
+    return res
+
+
+@contextmanager
+def offline(fixtures: dict[str, bytes]) -> Iterator[None]:
+    """
+    Serves every request made through utils.readers.read_url from the fixtures.
+    """
+    def get(url: str, *args, **kwargs) -> requests.Response:
+        return fixture_response(fixtures, url)
+
+    with mock.patch.object(requests, "get", side_effect=get):
+        yield
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "record":
+        print(__doc__)
+        sys.exit(1)
+
+    record(sys.argv[2:])
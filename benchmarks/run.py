@@ -0,0 +1,414 @@
+"""
+Offline benchmark of the crawl/ingestion hot paths, using the fixtures from
+benchmarks/fixtures.py (no network access is needed).
+
+Usage:
+    python -m benchmarks.run                    # compare against the stored baseline
+    python -m benchmarks.run --save-baseline    # store the current results as baseline
+
+Timings are stored relative to a reference kernel (a fixed python/regex/json/pandas
+workload) measured in the same round, so the baseline holds on faster or slower
+machines. The pipeline runs for several rounds and each hot path keeps the median
+of its relative times, so a burst of load on the machine during one round does
+not count as a slowdown (BASELINE_ROUNDS by default, and at least that many to
+record the baseline). Hot paths whose relative time is above
+baseline * (1 + tolerance) are reported as regressions; with --strict, the run
+exits with status 1.
+"""
+import argparse
+import json
+import lzma
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+from typing import Any
+
+os.environ.setdefault("PREFECT_LOGGING_LEVEL", "WARNING")
+
+import pandas as pd  # noqa: E402
+from dotenv import load_dotenv  # noqa: E402
+from prefect import flow  # noqa: E402
+
+from utils.connectors import postgres_connector, sqlite_connector  # noqa: E402
+from utils.helpers import (  # noqa: E402
+    build_df_from_ass_files,
+    clean_events,
+    collapse_songs,
+    filter_links_from_provider,
+    prepare_text_for_insertion,
+    process_episode_data,
+    read_anime_input,
+    read_ass_events,
+)
+from utils.manifest import _cached_entry, _cached_manifest, _cached_offsets  # noqa: E402
+from utils.manifest import write_manifest  # noqa: E402
+from utils.parsers import (  # noqa: E402
+    get_all_links_from_provider,
+    get_animes_finished_from_page,
+    get_batch_options_and_episode_count,
+    get_batch_subtitle_links,
+    get_subtitle_links,
+)
+from utils.titles import parse_release_title, parse_release_titles  # noqa: E402
+from utils.writers import merge_quotes, write_postgres, write_sqlite  # noqa: E402
+
+from .common import WORDS, timed  # noqa: E402
+from .fixtures import (  # noqa: E402
+    PROVIDER,
+    batch_link,
+    batch_page,
+    episode_link,
+    load_fixtures,
+    offline,
+    series_link,
+    subtitle_link,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+SCHEMA = "bench_pipeline"
+ANIMES = 20
+EPISODES = 24
+REFERENCE_REPEAT = 5
+BASELINE_ROUNDS = 5
+
+
+def _reference_kernel() -> None:
+    """
+    Fixed workload with the same mix as the hot paths (interpreter loops, regex,
+    json, pandas), to tell how fast the machine is.
+    """
+    words = random.Random(0).choices(WORDS, k=50000)
+    text = " ".join(words)
+    json.loads(json.dumps(words))
+    re.findall(r"\b\w*e\w*\b", text)
+    sum(len(word) for word in words if word != "the")
+    pd.DataFrame({"word": words}).groupby("word").size()
+
+
+def _reference_samples(repeat: int) -> list[float]:
+    return [timed(_reference_kernel, repeat=1) for _ in range(repeat)]
+
+
+def _clean_events_per_row(events: list) -> pd.DataFrame:
+    """
+    Reference: the per-event loop (+ dataframe from rows) that clean_events replaced,
+    to compare the per-line cost.
+    """
+    data = []
+    for name, style, text, start, end in events:
+        if "sign" in style.lower() or name.lower() == "sign":
+            continue
+        if start == end:
+            continue
+        cleaned_text = prepare_text_for_insertion(text)
+        if not cleaned_text:
+            continue
+        if not name or name == "NTP":
+            name = "Unknown"
+        data.append([name, cleaned_text, start, end])
+
+    return pd.DataFrame(data, columns=["name", "quote", "start_time", "end_time"])
+
+
+def _bench_write(df, repeat: int) -> dict[str, float]:
+    results = {}
+
+    def sqlite() -> None:
+        con = sqlite_connector(db_name=SCHEMA, schema=SCHEMA)
+        write_sqlite(df=df, con=con, schema=SCHEMA, table_name="anime", clear_songs=False)
+
+    results["write_sqlite"] = timed(sqlite, repeat=repeat)
+
+    load_dotenv()
+    if os.getenv("HOST"):
+        def postgres() -> None:
+            con = postgres_connector(
+                user=os.getenv("USER"),
+                password=os.getenv("PASSWORD"),
+                host=os.getenv("HOST"),
+                database=os.getenv("DATABASE"),
+                port=os.getenv("PORT"),
+            )
+            con.cursor().execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA};")
+            write_postgres(
+                df=df, con=con, schema=SCHEMA, table_name="anime", clear_songs=False
+            )
+
+        results["write_postgres"] = timed(postgres, repeat=repeat)
+
+    return results
+
+
+@flow
+def bench_pipeline(repeat: int = 5) -> dict[str, float]:
+    fixtures = load_fixtures(animes=ANIMES, episode_count=EPISODES)
+    # only the batch page itself, series pages stay as in the baseline
+    fixtures[batch_link(1)] = batch_page(1, EPISODES).encode()
+    results = {}
+
+    with offline(fixtures):
+        results["get_animes_finished_from_page"] = timed(
+            get_animes_finished_from_page, page=1, repeat=repeat
+        )
+
+        link = series_link(1)
+        results["get_batch_options_and_episode_count"] = timed(
+            get_batch_options_and_episode_count, "Synthetic Anime 1", link, repeat=repeat
+        )
+        results["get_all_links_from_provider"] = timed(
+            get_all_links_from_provider, PROVIDER, 1, link, repeat=repeat
+        )
+
+        # every release from the listing, so the filter has some real work to do
+        entries = []
+        for index in range(1, ANIMES + 1):
+            entries += get_all_links_from_provider(PROVIDER, 1, series_link(index))[0]
+        titles = [entry["link_title"] for entry in entries]
+
+        def parse_cold() -> None:
+            # the parser is memoized, measure it without the cache
+            parse_release_title.cache_clear()
+            parse_release_titles(titles, PROVIDER)
+
+        results["parse_release_titles"] = timed(parse_cold, repeat=repeat)
+
+        def filter_cold() -> None:
+            # first look at a listing, no title parsed yet
+            parse_release_title.cache_clear()
+            filter_links_from_provider(entries, PROVIDER, len(entries))
+
+        results["filter_links_from_provider"] = timed(filter_cold, repeat=repeat)
+        # titles already parsed (e.g. by the provider selection), only cache hits
+        results["filter_links_from_provider (warm)"] = timed(
+            filter_links_from_provider, entries, PROVIDER, len(entries), repeat=repeat
+        )
+
+        results["get_subtitle_links"] = timed(
+            get_subtitle_links, episode_link(1, 1), repeat=repeat
+        )
+
+        # subtitles of a whole season: one page per episode vs one batch page
+        results["get_subtitle_links (all episodes)"] = timed(
+            lambda: [
+                get_subtitle_links(episode_link(1, episode))
+                for episode in range(1, EPISODES + 1)
+            ],
+            repeat=repeat,
+        )
+        results["get_batch_subtitle_links"] = timed(
+            get_batch_subtitle_links, [batch_link(1)], repeat=repeat
+        )
+
+    with tempfile.TemporaryDirectory() as folder:
+        # same layout as data/<anime>/processed, for build_df_from_ass_files
+        processed = os.path.join(folder, "data", "anime", "processed")
+        os.makedirs(processed)
+        paths = []
+        for episode in range(1, EPISODES + 1):
+            path = os.path.join(processed, f"ep_{episode:02}.ass")
+            with open(path, "wb") as f:
+                f.write(lzma.decompress(fixtures[subtitle_link(1, episode)]))
+            paths.append((path, episode))
+
+        def parse_all() -> list:
+            table = []
+            for path, episode in paths:
+                table += process_episode_data(path, episode, 50001)[0]
+            return table
+
+        results["process_episode_data"] = timed(parse_all, repeat=repeat)
+        table = parse_all()
+
+        anime_info = {
+            "anime": {
+                "metadata": {"mal_id": 50001, "episode_count": EPISODES},
+                "data": [
+                    {"episode_number": episode, "sub_link": subtitle_link(1, episode)}
+                    for _, episode in paths
+                ],
+            }
+        }
+        info_path = os.path.join(folder, "anime.json")
+        with open(info_path, "w", encoding="utf-8") as f:
+            json.dump(anime_info, f)
+
+        cwd = os.getcwd()
+        os.chdir(folder)
+        try:
+            results["build_df_from_ass_files"] = timed(
+                build_df_from_ass_files, info_path, "anime", 10**6, repeat=repeat
+            )
+            # an early return (e.g. the fixture lost its links) would be timed as well
+            built = build_df_from_ass_files(info_path, "anime", 10**6)
+            if built is None or built.empty:
+                raise RuntimeError("build_df_from_ass_files returned no quotes.")
+        finally:
+            os.chdir(cwd)
+
+        # links of a whole listing run, read once per anime (as the ingestion does):
+        # a json file parsed for every anime vs a manifest line per anime
+        links = {
+            f"anime_{index}": {
+                "metadata": {"mal_id": index, "episode_count": EPISODES},
+                "data": [
+                    {"episode_number": episode, "link_url": episode_link(index, episode)}
+                    for episode in range(1, EPISODES + 1)
+                ],
+            }
+            for index in range(1, 10 * ANIMES + 1)
+        }
+        links_path = os.path.join(folder, "links.json")
+        with open(links_path, "w", encoding="utf-8") as f:
+            json.dump(links, f, indent=4)
+        manifest = os.path.join(folder, "links.ndjson")
+        write_manifest(manifest, links)
+
+        def read_per_anime(path: str) -> None:
+            # caches only live for a run, start cold
+            for cache in (_cached_entry, _cached_manifest, _cached_offsets):
+                cache.cache_clear()
+            for anime in links:
+                if path.endswith(".json"):
+                    with open(path, "r", encoding="utf-8") as f:
+                        json.load(f)[anime]
+                else:
+                    read_anime_input(path, anime)
+
+        results["read links (json, per anime)"] = timed(
+            read_per_anime, links_path, repeat=repeat
+        )
+        results["read links (manifest, per anime)"] = timed(
+            read_per_anime, manifest, repeat=repeat
+        )
+
+        # cleaning/filtering stage alone, row by row vs column operations
+        events = [event for path, _ in paths for event in read_ass_events(path)]
+        results["clean_events_per_row"] = timed(
+            _clean_events_per_row, events, repeat=repeat
+        )
+        results["clean_events"] = timed(
+            lambda: clean_events(events)[0].to_pandas(), repeat=repeat
+        )
+
+        # cost per kept line
+        for name in [
+            "process_episode_data",
+            "build_df_from_ass_files",
+            "clean_events_per_row",
+            "clean_events",
+        ]:
+            results[f"{name} (per line)"] = results[name] / len(table)
+
+    df = pd.DataFrame(
+        table, columns=["mal_id", "episode", "name", "quote", "start_time", "end_time"]
+    )
+    # song detection over every episode (name and repetition, no styles here)
+    results["collapse_songs"] = timed(collapse_songs, df, repeat=repeat)
+    results["merge_quotes"] = timed(
+        merge_quotes, None, SCHEMA, "anime", df, repeat=repeat
+    )
+    results.update(_bench_write(df, repeat))
+
+    return results
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} us"
+    return f"{seconds * 1000:.2f} ms"
+
+
+def relative(results: dict[str, float], reference: float) -> dict[str, float]:
+    return {name: seconds / reference for name, seconds in results.items()}
+
+
+def measure(rounds: int, repeat: int) -> tuple[float, dict[str, float]]:
+    """
+    Runs the pipeline rounds times, each with its own reference (sampled before and
+    after the hot paths, median of both).
+
+    Returns:
+    - tuple[float, dict[str, float]]: The median reference and the median time of
+        each hot path relative to the reference of its round.
+    """
+    references = []
+    ratios: dict[str, list[float]] = {}
+    for _ in range(rounds):
+        samples = _reference_samples(REFERENCE_REPEAT)
+        results = bench_pipeline(repeat=repeat)
+        reference = statistics.median(samples + _reference_samples(REFERENCE_REPEAT))
+        references.append(reference)
+        for name, ratio in relative(results, reference).items():
+            ratios.setdefault(name, []).append(ratio)
+
+    medians = {name: statistics.median(values) for name, values in ratios.items()}
+    return statistics.median(references), medians
+
+
+def compare(
+    current: dict[str, float],
+    reference: float,
+    baseline: dict[str, Any],
+    tolerance: float,
+) -> list[str]:
+    """
+    Compares the current relative times with the relative times of the baseline
+    ({"reference": seconds, "relative": {hot path: ratio}}). Both are shown
+    scaled to this machine (by reference).
+    """
+    regressions = []
+    expected = baseline.get("relative", {})
+    print(f"Reference kernel: {_format_seconds(reference)}")
+    print(f"{'hot path':<40} {'current':>12} {'baseline':>12} {'ratio':>8}")
+    for name, value in current.items():
+        seconds = value * reference
+        base = expected.get(name)
+        ratio = value / base if base else float("nan")
+        flag = ""
+        if base and ratio > 1 + tolerance:
+            flag = "  <-- REGRESSION"
+            regressions.append(name)
+        base_str = _format_seconds(base * reference) if base else "-"
+        print(
+            f"{name:<40} {_format_seconds(seconds):>12} {base_str:>12} {ratio:>8.2f}{flag}"
+        )
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=BASELINE_ROUNDS)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="exit with status 1 on regressions (on a quiet, dedicated machine)",
+    )
+    args = parser.parse_args()
+
+    rounds = max(args.rounds, BASELINE_ROUNDS) if args.save_baseline else args.rounds
+    reference, current = measure(rounds, args.repeat)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    regressions = compare(current, reference, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline = {"reference": reference, "relative": current}
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=4)
+        print(f"Baseline saved to {BASELINE_PATH}.")
+
+    elif regressions:
+        print(f"{len(regressions)} hot path(s) regressed: {', '.join(regressions)}")
+        if args.strict:
+            sys.exit(1)
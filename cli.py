@@ -0,0 +1,291 @@
+"""
+Command line entry point.
+
+    python cli.py crawl --page-start 1 --page-count 2 --page-limit 99
+    python cli.py download 52991
+    python cli.py ingest --download-limit 5 --sink sqlite
+    python cli.py ingest --language eng --language por
+    python cli.py export sousou_no_frieren --root exports/quotes
+    python cli.py populate --page-limit 99
+    python cli.py verify sousou_no_frieren
+    python cli.py enqueue --page-start 1 --page-count 5 --page-limit 99
+    python cli.py worker --idle-timeout 120
+
+Heavy dependencies (pandas, prefect, bs4, pyarrow...) are only imported once a
+subcommand actually runs, so `--help` and argument errors return right away.
+Each subcommand imports only the modules that define its work: verify needs
+the storage modules alone and export skips prefect and the crawler, the
+prefect flows (crawl, ingest, populate...) come from main.
+"""
+import argparse
+import logging
+import sys
+from typing import Callable, Optional
+
+# keep in sync with utils.constants (not imported here to keep startup cheap)
+SINKS = ["postgres", "sqlite"]
+JOB_TYPES = ["listing", "anime", "episode", "subtitle"]
+DEFAULT_SCHEMA = "raw_quotes"
+DEFAULT_BASE_URL = "https://animetosho.org"
+
+
+def _configure_logging() -> None:
+    from utils.constants import FORMAT
+
+    logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+
+def run_crawl(args: argparse.Namespace) -> None:
+    from main import crawl_links
+
+    crawl_links(
+        page_start=args.page_start,
+        page_count=args.page_count,
+        page_limit=args.page_limit,
+        filter_links=args.filter_link,
+        save_links_on_db=not args.no_save_links,
+        sink=args.sink,
+        base_url=args.base_url,
+        incremental=not args.full,
+    )
+
+
+def run_download(args: argparse.Namespace) -> None:
+    from main import download_files_from_anime
+
+    download_files_from_anime(
+        mal_id=args.mal_id,
+        sink=args.sink,
+        packed=args.packed,
+        revalidate=args.revalidate,
+        languages=args.language,
+    )
+
+
+def run_ingest(args: argparse.Namespace) -> None:
+    from main import ingest_subtitles
+
+    ingest_subtitles(
+        download_limit=args.download_limit,
+        schema=args.schema,
+        export_parquet=args.export_parquet,
+        sink=args.sink,
+        base_url=args.base_url,
+        packed=args.packed,
+        revalidate=args.revalidate,
+        languages=args.language,
+    )
+
+
+def run_export(args: argparse.Namespace) -> None:
+    from utils.connectors import get_connection
+    from utils.parquet import export_tables
+
+    con = get_connection(sink=args.sink, schema=args.schema)
+    try:
+        export_tables(con, args.tables, schema=args.schema, root=args.root)
+    finally:
+        con.close()
+
+
+def run_populate(args: argparse.Namespace) -> None:
+    from main import populate_db
+
+    populate_db(
+        get_links=not args.skip_links,
+        download_limit=args.download_limit,
+        page_start=args.page_start,
+        page_count=args.page_count,
+        page_limit=args.page_limit,
+        filter_links=args.filter_link,
+        schema=args.schema,
+        export_parquet=args.export_parquet,
+        sink=args.sink,
+        base_url=args.base_url,
+        profile=args.profile,
+        incremental=not args.full,
+        packed=args.packed,
+        revalidate=args.revalidate,
+        languages=args.language,
+    )
+
+
+def run_enqueue(args: argparse.Namespace) -> None:
+    from main import enqueue_crawl
+
+    enqueue_crawl(
+        page_start=args.page_start,
+        page_count=args.page_count,
+        page_limit=args.page_limit,
+        filter_links=args.filter_link,
+        base_url=args.base_url,
+    )
+
+
+def run_worker(args: argparse.Namespace) -> None:
+    from main import crawl_worker
+
+    crawl_worker(
+        job_types=args.job_type,
+        max_jobs=args.max_jobs,
+        idle_timeout=args.idle_timeout,
+        worker=args.name,
+        schema=args.schema,
+        export_parquet=args.export_parquet,
+        base_url=args.base_url,
+        packed=args.packed,
+        revalidate=args.revalidate,
+        languages=args.language,
+    )
+
+
+def run_verify(args: argparse.Namespace) -> None:
+    from utils.verify import verify_subtitles
+
+    corrupted = verify_subtitles(filter_anime=args.anime)
+    for anime, files in corrupted.items():
+        print(f"{anime}: {', '.join(files)}")
+    if corrupted:
+        sys.exit(1)
+
+
+def _add_sink(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--sink", choices=SINKS, default="postgres")
+
+
+def _add_pages(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--page-start", type=int, default=1)
+    parser.add_argument("--page-count", type=int, default=1)
+    parser.add_argument(
+        "--page-limit", type=int, default=1, help="max animes processed per page"
+    )
+    parser.add_argument(
+        "--filter-link",
+        action="append",
+        help="only process this series link (can be repeated)",
+    )
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+
+
+def _add_incremental(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="crawl every page, instead of stopping at entries crawled by previous runs",
+    )
+
+
+def _add_storage(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--packed",
+        action="store_true",
+        help="store subtitles in one archive per anime instead of one file per episode",
+    )
+    parser.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="check already downloaded files with conditional requests (ETag/Last-Modified)",
+    )
+    parser.add_argument(
+        "--language",
+        action="append",
+        help="subtitle language to download, e.g. por (can be repeated, default eng). "
+        "Languages other than eng are written to <anime>_<language> tables",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Scrapper to get anime subtitles from AnimeTosho website."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    crawl = subparsers.add_parser("crawl", help="collect subtitle links from listings")
+    _add_pages(crawl)
+    _add_sink(crawl)
+    crawl.add_argument("--no-save-links", action="store_true")
+    _add_incremental(crawl)
+    crawl.set_defaults(handler=run_crawl)
+
+    download = subparsers.add_parser(
+        "download", help="download the subtitles of one anime (by MAL id)"
+    )
+    download.add_argument("mal_id", type=int)
+    _add_sink(download)
+    _add_storage(download)
+    download.set_defaults(handler=run_download)
+
+    ingest = subparsers.add_parser(
+        "ingest", help="download collected subtitles and write the quotes"
+    )
+    ingest.add_argument("--download-limit", type=int, default=1)
+    ingest.add_argument("--schema", default=DEFAULT_SCHEMA)
+    ingest.add_argument("--export-parquet", action="store_true")
+    ingest.add_argument("--base-url", default=None)
+    _add_sink(ingest)
+    _add_storage(ingest)
+    ingest.set_defaults(handler=run_ingest)
+
+    export = subparsers.add_parser("export", help="export quote tables to parquet")
+    export.add_argument("tables", nargs="+")
+    export.add_argument("--schema", default=DEFAULT_SCHEMA)
+    export.add_argument("--root", default="exports/quotes")
+    _add_sink(export)
+    export.set_defaults(handler=run_export)
+
+    populate = subparsers.add_parser("populate", help="crawl + ingest (populate_db)")
+    _add_pages(populate)
+    _add_sink(populate)
+    populate.add_argument("--skip-links", action="store_true")
+    populate.add_argument("--download-limit", type=int, default=1)
+    populate.add_argument("--schema", default=DEFAULT_SCHEMA)
+    populate.add_argument("--export-parquet", action="store_true")
+    populate.add_argument("--profile", action="append")
+    _add_incremental(populate)
+    _add_storage(populate)
+    populate.set_defaults(handler=run_populate)
+
+    enqueue = subparsers.add_parser(
+        "enqueue", help="queue listing pages (or animes) for crawl workers (postgres)"
+    )
+    _add_pages(enqueue)
+    enqueue.set_defaults(handler=run_enqueue)
+
+    worker = subparsers.add_parser(
+        "worker", help="process queued crawl jobs, run as many as needed (postgres)"
+    )
+    worker.add_argument(
+        "--job-type",
+        action="append",
+        choices=JOB_TYPES,
+        help="only process these job types (can be repeated)",
+    )
+    worker.add_argument("--max-jobs", type=int, default=None)
+    worker.add_argument(
+        "--idle-timeout", type=float, default=60, help="seconds without jobs to stop"
+    )
+    worker.add_argument("--name", default=None, help="default is <hostname>:<pid>")
+    worker.add_argument("--schema", default=DEFAULT_SCHEMA)
+    worker.add_argument("--export-parquet", action="store_true")
+    worker.add_argument("--base-url", default=None)
+    _add_storage(worker)
+    worker.set_defaults(handler=run_worker)
+
+    verify = subparsers.add_parser(
+        "verify", help="check downloaded subtitles against their hashes (no network)"
+    )
+    verify.add_argument("anime", nargs="?", default="")
+    verify.set_defaults(handler=run_verify)
+
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    handler: Callable[[argparse.Namespace], None] = args.handler
+    _configure_logging()
+    handler(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,29 +1,85 @@
 import json
-
-# import logging
+import logging
+import threading
 import time
-import os
 import warnings
 from datetime import datetime
 
 # from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Literal, Optional
 
 import pandas as pd
 from dotenv import load_dotenv
 from prefect import flow, task, get_run_logger
-
-from utils.connectors import postgres_connector
-from utils.constants import DESIRED_SUBS, MAX_LINES_PER_EPISODE
+from prefect.runtime import flow_run
+
+from utils.breaker import FailureBudgetExceeded, reset_failure_budget
+from utils.caching import CACHE_EXPIRATION, ingest_cache_key
+from utils.connectors import get_connection
+from utils.crawl_state import (
+    CollectedAnimes,
+    TitleKeys,
+    read_high_water_mark,
+    read_resume_cursor,
+    write_high_water_mark,
+    write_resume_cursor,
+)
+from utils.constants import (
+    BASE_URL,
+    DESIRED_SUBS,
+    FORMAT,
+    JOB_POLL_SECONDS,
+    LISTING_PATH,
+    MAX_LINES_PER_EPISODE,
+    PARQUET_ROOT,
+)
 from utils.helpers import (
     build_df_from_ass_files,
+    expand_languages,
+    extract_titles_and_anime_links,
     generate_ass_files,
+    process_data_input,
 )
-from utils.parsers import download_subtitles
-from utils.queries import query_json_data, query_json_from_entry
+from utils.jobs import (
+    Job,
+    claim_jobs,
+    complete_job,
+    create_jobs_table,
+    default_worker_name,
+    enqueue_job,
+    fail_job,
+    get_job,
+    get_job_counts,
+    heartbeat,
+)
+from utils.manifest import list_manifests, manifest_path, write_manifest
+from utils.metrics import METRICS, flow_metrics
+from utils.profiling import dump_profiles, profiled, profiling
+from utils.parsers import (
+    download_subtitles,
+    filter_finished_entries,
+    get_listing_entries,
+)
+from utils.queries import (
+    query_json_from_entry,
+)
+from utils.parquet import export_tables, write_parquet
 from utils.readers import read_postgres
-from utils.routines import build_json_with_links
-from utils.writers import merge_quotes, write_postgres
+from utils.stats import has_stats, lines_per_episode_threshold
+from utils.routines import (
+    assemble_anime_job,
+    build_json_with_links,
+    handle_anime_job,
+    handle_episode_job,
+    handle_listing_job,
+)
+from utils.writers import (
+    create_json_reference,
+    merge_quotes,
+    write_json_reference,
+    write_postgres,
+    write_sqlite,
+)
 
 warnings.filterwarnings("ignore")
 # setup logger
@@ -35,46 +91,43 @@ warnings.filterwarnings("ignore")
 # )
 
 load_dotenv()
-host = os.getenv("HOST")
-port = os.getenv("PORT")
-database = os.getenv("DATABASE")
-user = os.getenv("USER")
-password = os.getenv("PASSWORD")
+
+Sink = Literal["postgres", "sqlite"]
+WRITERS = {"postgres": write_postgres, "sqlite": write_sqlite}
 
 
 @task
-def get_already_downloaded_animes(
-    query: str,
-) -> dict[str, dict[str, Any]]:
-    con = postgres_connector(
-        user=user, password=password, host=host, database=database, port=port
-    )
-    df = read_postgres(con=con, query=query)
-    mapping = df.to_dict(orient="list")
-    mal_ids = mapping["mal_id"]
-    is_complete = mapping["completed"]
-    ep_amount = mapping["ep_amount"]
-
-    result = {
-        mal_id: {"completed": status, "ep_amount": ep_count}
-        for mal_id, status, ep_count in zip(mal_ids, is_complete, ep_amount)
-    }
+def get_already_downloaded_animes(sink: Sink = "postgres") -> CollectedAnimes:
+    """
+    Lookup (by mal_id) of the animes already on raw_quotes.v_json_info. Each anime
+    is queried when first needed, instead of loading the whole view.
+    """
+    con = get_connection(sink=sink)
+    # fresh databases do not have the reference table/view yet
+    # (and older postgres tables get their indexed columns)
+    create_json_reference(con)
 
-    return result
+    return CollectedAnimes(con)
 
 
 @task
+@profiled()
 def export_links_to_db(
     con,
     data: dict[str, Any],
+    sink: Sink = "postgres",
 ) -> None:
     today = datetime.today()
 
-    normalized_entries = [
-        json.dumps({"name": key, "info": value})
-        for key, value in data.items()
-        if value["data"]
+    entries = [
+        {"name": key, "info": value} for key, value in data.items() if value["data"]
     ]
+    if sink == "postgres":
+        # native jsonb, in a single COPY
+        write_json_reference(entries=entries, con=con, reference_date=today)
+        return
+
+    normalized_entries = [json.dumps(entry) for entry in entries]
     json_df = pd.DataFrame(
         data={
             "json_data": normalized_entries,
@@ -82,7 +135,7 @@ def export_links_to_db(
     )
     json_df["reference_date"] = today
 
-    write_postgres(
+    WRITERS[sink](
         df=json_df,
         con=con,
         schema="raw_quotes",
@@ -90,10 +143,12 @@ def export_links_to_db(
         if_exists="append",
         clear_songs=False,
         cleanup=True,
+        update_stats=False,
     )
 
 
 @task
+@profiled()
 def get_links_from_web(
     page_start: int = 1,
     page_count: int = 1,
@@ -102,150 +157,587 @@ def get_links_from_web(
     filter_links: Optional[list[str]] = None,
     already_collected_animes: dict[str, dict[str, Any]] = dict(),
     save_links_on_db: bool = True,
+    sink: Sink = "postgres",
+    base_url: str = BASE_URL,
+    incremental: bool = True,
 ) -> None:
+    """
+    Crawls the listing pages. With incremental=True, pagination stops at the
+    high-water mark of the listing (the newest series link a previous run already
+    crawled). The mark is only moved when this run crawled every entry from the top
+    of the listing down to it (or to the end of the listing), so no entry is left
+    behind. A run that stops before that stores a resume cursor instead, and the
+    next run from page 1 continues from there.
+    Each crawled page overwrites its manifest (examples/page_N.ndjson).
+    """
     logger = get_run_logger()
     start = time.time()
+    listing = base_url + LISTING_PATH
+    state_con = get_connection(sink=sink)
+    title_keys = TitleKeys(state_con)
+    incremental = incremental and not filter_links
+    high_water_mark, seen_at = None, None
+    resume_page, newest_link = None, None
+    if incremental:
+        high_water_mark, seen_at = read_high_water_mark(state_con, listing)
+        if high_water_mark:
+            logger.info(f"Crawling until {high_water_mark} (seen at {seen_at}).")
+        if page_start == 1:
+            resume_page, newest_link = read_resume_cursor(state_con, listing)
+        if resume_page:
+            # newer entries are left to the run after the mark is moved
+            logger.info(f"Resuming the previous crawl on page {resume_page}.")
+            page_start = resume_page
+
+    # every entry from the top of the listing (or the resumed crawl) was crawled
+    contiguous = page_start == 1 or resume_page is not None
+    # the crawl got down to the high-water mark, or to the end of the listing
+    covered = False
+    pages = 0
+    last_page = page_start - 1
     for page in range(page_start, page_start + page_count):
-        data = build_json_with_links(
-            page=page,
-            limit_per_page=page_limit,
-            desired_subs=desired_subs,
-            filter_links=filter_links,
-            already_collected_animes=already_collected_animes,
-        )
-        with open(f"examples/page_{page}.json", "w+", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
-
-        if save_links_on_db and data:
-            con = postgres_connector(
-                user=user, password=password, host=host, database=database, port=port
+        pages += 1
+        animes = None
+        if not filter_links:
+            entries = get_listing_entries(page=page, base_url=base_url)
+            if entries is None:
+                contiguous = False
+                entries = []
+            elif not entries:
+                logger.info(f"Reached the end of the listing on page {page}, stopping.")
+                covered = True
+                break
+
+            animes = filter_finished_entries(entries)
+            _, links = extract_titles_and_anime_links(animes=animes, filter_links=[])
+            if page == 1 and links and not resume_page:
+                newest_link = links[0]
+            if high_water_mark in links:
+                # older entries were crawled by a previous run
+                covered = True
+                animes = animes[: links.index(high_water_mark)]
+            contiguous = contiguous and len(animes) <= page_limit
+
+        if animes or not covered:
+            data = build_json_with_links(
+                page=page,
+                limit_per_page=page_limit,
+                desired_subs=desired_subs,
+                filter_links=filter_links,
+                already_collected_animes=already_collected_animes,
+                base_url=base_url,
+                animes=animes,
+                title_keys=title_keys,
             )
-            export_links_to_db(con=con, data=data)
+            write_manifest(manifest_path(f"page_{page}"), data, append=False)
+
+            if save_links_on_db and data:
+                con = get_connection(sink=sink)
+                export_links_to_db(con=con, data=data, sink=sink)
+
+        last_page = page
+        if covered:
+            logger.info(f"Reached already crawled entries on page {page}, stopping.")
+            break
+
+    if incremental and newest_link and contiguous:
+        if covered:
+            write_high_water_mark(state_con, listing, newest_link)
+        else:
+            write_resume_cursor(state_con, listing, last_page + 1, newest_link)
+    state_con.close()
 
     end = time.time()
     logger.info(
-        f"Finished getting links for {page_count} pages in {round(end - start)}s."
+        f"Finished getting links for {pages} pages in {round(end - start)}s."
+    )
+
+
+def ingest_file(
+    file_path: str,
+    schema: str = "raw_quotes",
+    max_lines_per_episode: Optional[int] = None,
+    export_parquet: bool = False,
+    sink: Sink = "postgres",
+    base_url: Optional[str] = None,
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Optional[list[str]] = None,
+) -> None:
+    """
+    Downloads the subtitles of every anime on file_path and writes their quotes.
+    Without max_lines_per_episode, the threshold comes from the stats of the
+    episodes already written (see lines_per_episode_threshold).
+    """
+    logger = get_run_logger()
+    # DESIRED_SUBS quotes go to <anime>, the other languages to <anime>_<language>
+    languages = languages or [DESIRED_SUBS]
+
+    download_subtitles(
+        file_path=file_path,
+        base_url=base_url,
+        packed=packed,
+        revalidate=revalidate,
+        languages=languages,
     )
 
+    # packed archives are read directly, nothing to extract
+    if not packed:
+        generate_ass_files()
+
+    # files may have been extracted already (by another run or worker),
+    # so every anime of the file is written, not only the ones extracted now
+    created = expand_languages(process_data_input(file_path), languages).keys()
+
+    con = get_connection(sink=sink, schema=schema)
+    if max_lines_per_episode is None:
+        max_lines_per_episode = lines_per_episode_threshold(con, schema)
+        logger.info(f"Max lines per episode: {max_lines_per_episode}.")
+
+    # cached ingestions are only trusted when the table is still there
+    written = {anime for anime in created if has_stats(con, anime, schema)}
+    con.close()
+
+    # writing data to db for each anime
+    for anime in created:
+        ingest = ingest_anime
+        if anime not in written:
+            ingest = ingest_anime.with_options(refresh_cache=True)
+
+        ingest(
+            file_path=file_path,
+            anime=anime,
+            schema=schema,
+            max_lines_per_episode=max_lines_per_episode,
+            export_parquet=export_parquet,
+            sink=sink,
+            languages=languages,
+        )
+
+
+@task(
+    cache_key_fn=ingest_cache_key,
+    cache_expiration=CACHE_EXPIRATION,
+    persist_result=True,
+)
+def ingest_anime(
+    file_path: str,
+    anime: str,
+    schema: str = "raw_quotes",
+    max_lines_per_episode: int = MAX_LINES_PER_EPISODE,
+    export_parquet: bool = False,
+    sink: Sink = "postgres",
+    languages: Optional[list[str]] = None,
+) -> int:
+    """
+    Writes the quotes of one anime (already downloaded) of file_path.
+    Cached by the hashes of its subtitle files and PARSER_VERSION (see
+    ingest_cache_key), so reruns skip the animes whose files did not change.
+
+    Returns:
+    - int: Amount of rows written.
+    """
+    logger = get_run_logger()
+    logger.info(f"---------- Processing anime: {anime} ----------")
+    df = build_df_from_ass_files(
+        file_path=file_path,
+        anime_name=anime,
+        max_lines_per_episode=max_lines_per_episode,
+        languages=languages or [DESIRED_SUBS],
+    )
+
+    if df is None:
+        return 0
+
+    con = get_connection(sink=sink, schema=schema)
+    try:
+        df = merge_quotes(conn=con, schema=schema, table_name=anime, df=df)
+
+        WRITERS[sink](
+            df=df,
+            con=con,
+            schema=schema,
+            table_name=anime,
+            if_exists="replace",
+            cleanup=False,
+            index_quotes=True,
+        )
+
+        if export_parquet:
+            write_parquet(df=df, table_name=anime, if_exists="replace")
+    except Exception as err:
+        logger.error(err)
+        raise
+
+    finally:
+        con.close()
+
+    return len(df)
+
 
 @task
+@profiled()
 def get_subtitles_from_web(
     download_amount: int = 1,
     schema: str = "raw_quotes",
-    max_lines_per_episode: int = MAX_LINES_PER_EPISODE,
+    max_lines_per_episode: Optional[int] = None,
+    export_parquet: bool = False,
+    sink: Sink = "postgres",
+    base_url: Optional[str] = None,
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Optional[list[str]] = None,
 ) -> None:
     logger = get_run_logger()
-    for idx, file in enumerate(os.listdir("examples")):
+    for idx, file_path in enumerate(list_manifests()):
         if idx == download_amount:
             logger.info(f"Download amount of {download_amount} reached.")
             break
 
-        file_path = "examples/" + file
-
-        download_subtitles(
+        ingest_file(
             file_path=file_path,
+            schema=schema,
+            max_lines_per_episode=max_lines_per_episode,
+            export_parquet=export_parquet,
+            sink=sink,
+            base_url=base_url,
+            packed=packed,
+            revalidate=revalidate,
+            languages=languages,
         )
 
-        created = generate_ass_files()
-        if not created:
-            # probably, we already had built all the files
-            with open(file_path, "r+", encoding="utf-8") as f:
-                created = json.load(f).keys()
-
-        con = postgres_connector(
-            user=user, password=password, host=host, database=database, port=port
-        )
 
+@flow
+@flow_metrics
+def populate_db(
+    get_links: bool = True,
+    download_limit: int = 1,
+    page_start: int = 1,
+    page_count: int = 1,
+    page_limit: int = 1,
+    filter_links: Optional[list[str]] = None,
+    schema: str = "raw_quotes",
+    export_parquet: bool = False,
+    sink: Sink = "postgres",
+    base_url: str = BASE_URL,
+    profile: Optional[list[str]] = None,
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Optional[list[str]] = None,
+    incremental: bool = True,
+) -> None:
+    reset_failure_budget()
+    # e.g. ["get_subtitles_from_web", "merge_quotes"] or ["all"],
+    # only for this run (other flows of the process are not profiled)
+    with profiling(profile):
         try:
-            # writing data to db for each anime
-            for anime in created:
-                logger.info(f"---------- Processing anime: {anime} ----------")
-                df = build_df_from_ass_files(
-                    file_path=file_path,
-                    anime_name=anime,
-                    max_lines_per_episode=max_lines_per_episode,
+            anime_status_map = get_already_downloaded_animes(sink=sink)
+
+            if get_links:
+                with METRICS.timer("stage_seconds", stage="get_links_from_web"):
+                    get_links_from_web(
+                        page_start=page_start,
+                        page_count=page_count,
+                        page_limit=page_limit,
+                        desired_subs=DESIRED_SUBS,
+                        filter_links=filter_links,
+                        already_collected_animes=anime_status_map,
+                        save_links_on_db=True,
+                        sink=sink,
+                        base_url=base_url,
+                        incremental=incremental,
+                    )
+
+            with METRICS.timer("stage_seconds", stage="get_subtitles_from_web"):
+                get_subtitles_from_web(
+                    download_amount=download_limit,
+                    schema=schema,
+                    export_parquet=export_parquet,
+                    sink=sink,
+                    base_url=base_url if base_url != BASE_URL else None,
+                    packed=packed,
+                    revalidate=revalidate,
+                    languages=languages,
                 )
+        finally:
+            dump_profiles(run_name=str(flow_run.id or ""))
 
-                if df is None:
-                    continue
 
-                df = merge_quotes(conn=con, schema=schema, table_name=anime, df=df)
+@flow
+@flow_metrics
+def download_files_from_anime(
+    mal_id: int,
+    sink: Sink = "postgres",
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Optional[list[str]] = None,
+) -> None:
+    reset_failure_budget()
+    conn = get_connection(sink=sink)
+    query = query_json_from_entry % mal_id
+    df = read_postgres(con=conn, query=query, cleanup=True)
+    data = df["json_data"].values[0]
+    if isinstance(data, str):
+        # sqlite stores the json as plain text
+        data = json.loads(data)
+    fixed_dict = {data["name"]: data["info"]}
+    file_path = manifest_path("id_%s" % mal_id)
+    write_manifest(file_path, fixed_dict, append=False)
 
-                write_postgres(
-                    df=df,
-                    con=con,
-                    schema=schema,
-                    table_name=anime,
-                    if_exists="replace",
-                    cleanup=False,
-                )
-        except Exception as err:
-            logger.error(err)
-            raise
+    download_subtitles(
+        file_path=file_path,
+        packed=packed,
+        revalidate=revalidate,
+        languages=languages or [DESIRED_SUBS],
+    )
 
-        finally:
-            con.close()
+    if not packed:
+        generate_ass_files()
 
 
 @flow
-def populate_db(
-    get_links: bool = True,
-    download_limit: int = 1,
+@flow_metrics
+def crawl_links(
     page_start: int = 1,
     page_count: int = 1,
     page_limit: int = 1,
     filter_links: Optional[list[str]] = None,
-    schema: str = "raw_quotes",
+    save_links_on_db: bool = True,
+    sink: Sink = "postgres",
+    base_url: str = BASE_URL,
+    incremental: bool = True,
 ) -> None:
-    anime_status_map = get_already_downloaded_animes(query=query_json_data)
-
-    if get_links:
-        get_links_from_web(
-            page_start=page_start,
-            page_count=page_count,
-            page_limit=page_limit,
-            desired_subs=DESIRED_SUBS,
-            filter_links=filter_links,
-            already_collected_animes=anime_status_map,
-            save_links_on_db=True,
-        )
+    reset_failure_budget()
+    anime_status_map = get_already_downloaded_animes(sink=sink)
+    get_links_from_web(
+        page_start=page_start,
+        page_count=page_count,
+        page_limit=page_limit,
+        desired_subs=DESIRED_SUBS,
+        filter_links=filter_links,
+        already_collected_animes=anime_status_map,
+        save_links_on_db=save_links_on_db,
+        sink=sink,
+        base_url=base_url,
+        incremental=incremental,
+    )
+
 
+@flow
+@flow_metrics
+def ingest_subtitles(
+    download_limit: int = 1,
+    schema: str = "raw_quotes",
+    export_parquet: bool = False,
+    sink: Sink = "postgres",
+    base_url: Optional[str] = None,
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Optional[list[str]] = None,
+) -> None:
+    reset_failure_budget()
     get_subtitles_from_web(
         download_amount=download_limit,
         schema=schema,
-        max_lines_per_episode=MAX_LINES_PER_EPISODE,
+        export_parquet=export_parquet,
+        sink=sink,
+        base_url=base_url,
+        packed=packed,
+        revalidate=revalidate,
+        languages=languages,
     )
 
 
 @flow
-def download_files_from_anime(mal_id: int) -> None:
-    conn = postgres_connector(
-        user=user, password=password, host=host, database=database, port=port
+@flow_metrics
+def enqueue_crawl(
+    page_start: int = 1,
+    page_count: int = 1,
+    page_limit: Optional[int] = None,
+    filter_links: Optional[list[str]] = None,
+    base_url: str = BASE_URL,
+) -> None:
+    """
+    Queues listing pages (or only the filter_links animes) on raw_quotes.crawl_jobs,
+    to be processed by any number of crawl_worker runs. Postgres only.
+    """
+    logger = get_run_logger()
+    con = get_connection(sink="postgres")
+    try:
+        create_jobs_table(con)
+        for link in filter_links or []:
+            enqueue_job(con, "anime", link, refresh=True)
+
+        if not filter_links:
+            for page in range(page_start, page_start + page_count):
+                url = base_url + LISTING_PATH + f"?page={page}"
+                payload = {"page": page, "base_url": base_url, "limit": page_limit}
+                enqueue_job(con, "listing", url, payload, refresh=True)
+
+        for job_type, status, count in get_job_counts(con):
+            logger.info(f"{job_type} jobs {status}: {count}")
+    finally:
+        con.close()
+
+
+def handle_subtitle_job(con, job: Job, settings: dict[str, Any]) -> dict[str, Any]:
+    """
+    Crawl queue: saves the entry of an anime whose pages were all crawled, then
+    downloads its subtitles and writes the quotes.
+    """
+    data = assemble_anime_job(
+        con, job.payload["anime_job"], settings["already_collected_animes"]
     )
-    query = query_json_from_entry % mal_id
-    df = read_postgres(con=conn, query=query, cleanup=True)
-    data = df["json_data"].values[0]
-    fixed_dict = {data["name"]: data["info"]}
-    file_path = "examples/id_%s.json" % mal_id
+    if not data:
+        return {"episodes": 0}
 
-    with open(file=file_path, mode="w+", encoding="utf-8") as fp:
-        json.dump(fixed_dict, fp)
+    # the writer closes the connection it gets
+    export_links_to_db(con=get_connection(sink="postgres"), data=data, sink="postgres")
+    title_key = next(iter(data))
+    file_path = manifest_path(title_key)
+    write_manifest(file_path, data, append=False)
 
-    download_subtitles(
+    ingest_file(
         file_path=file_path,
+        schema=settings["schema"],
+        export_parquet=settings["export_parquet"],
+        base_url=settings["base_url"],
+        packed=settings["packed"],
+        revalidate=settings["revalidate"],
+        languages=settings["languages"],
     )
+    return {"episodes": len(data[title_key]["data"])}
 
-    generate_ass_files()
 
+JOB_HANDLERS = {
+    "listing": handle_listing_job,
+    "anime": handle_anime_job,
+    "episode": handle_episode_job,
+    "subtitle": handle_subtitle_job,
+}
 
-populate_db(
-    get_links=True,
-    download_limit=1,
-    page_start=1,
-    page_count=1,
-    page_limit=99,
-    # filter_links=["https://animetosho.org/series/sousou-no-frieren.17617"],
-    schema="raw_quotes",
-)
 
-# download_files_from_anime(mal_id=55791)
+@flow
+@flow_metrics
+def crawl_worker(
+    job_types: Optional[list[str]] = None,
+    max_jobs: Optional[int] = None,
+    idle_timeout: float = 60,
+    worker: Optional[str] = None,
+    schema: str = "raw_quotes",
+    export_parquet: bool = False,
+    base_url: Optional[str] = None,
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Optional[list[str]] = None,
+) -> None:
+    """
+    Processes jobs from raw_quotes.crawl_jobs (see enqueue_crawl) until the queue
+    stays empty for idle_timeout seconds (or max_jobs were processed).
+    Any number of workers may run at the same time, on any machine with access
+    to the database. Postgres only.
+    """
+    reset_failure_budget()
+    logger = get_run_logger()
+    worker = worker or default_worker_name()
+    con = get_connection(sink="postgres")
+    create_jobs_table(con)
+    settings = {
+        "already_collected_animes": get_already_downloaded_animes(sink="postgres"),
+        "title_keys": TitleKeys(con),
+        "desired_subs": DESIRED_SUBS,
+        "schema": schema,
+        "export_parquet": export_parquet,
+        "base_url": base_url,
+        "packed": packed,
+        "revalidate": revalidate,
+        "languages": languages,
+    }
+
+    processed = 0
+    idle_since = time.monotonic()
+    try:
+        while max_jobs is None or processed < max_jobs:
+            jobs = claim_jobs(con, worker, job_types)
+            if not jobs:
+                if time.monotonic() - idle_since > idle_timeout:
+                    logger.info(f"No jobs for {idle_timeout}s, stopping worker {worker}.")
+                    break
+                time.sleep(JOB_POLL_SECONDS)
+                continue
+
+            for job in jobs:
+                logger.info(f"[{worker}] {job.job_type} job {job.id}: {job.url}")
+                lost = threading.Event()
+                finished = None
+                try:
+                    with heartbeat(
+                        lambda: get_connection(sink="postgres"), job, worker
+                    ) as lost:
+                        result = JOB_HANDLERS[job.job_type](con, job, settings)
+                except FailureBudgetExceeded as err:
+                    # the site is probably down, stop instead of failing every job
+                    if not lost.is_set():
+                        fail_job(con, job, worker, repr(err))
+                    raise
+                except Exception as err:
+                    logger.warning(f"{job.job_type} job {job.id} failed: {err!r}")
+                    METRICS.inc("jobs_failed_total", job_type=job.job_type)
+                    if not lost.is_set():
+                        finished = fail_job(con, job, worker, repr(err))
+                else:
+                    if not lost.is_set():
+                        finished = complete_job(con, job, worker, result)
+                        METRICS.inc("jobs_done_total", job_type=job.job_type)
+
+                if lost.is_set():
+                    # the job may be running on another worker, which reports it
+                    logger.warning(
+                        f"Lost the lease of {job.job_type} job {job.id}, "
+                        "leaving it to the worker that claimed it."
+                    )
+                    METRICS.inc("jobs_lost_total", job_type=job.job_type)
+                if finished and job.job_type in ("anime", "episode"):
+                    # every page of the anime was crawled (or failed for good)
+                    anime_url = get_job(con, finished)[0]
+                    enqueue_job(
+                        con, "subtitle", anime_url, {"anime_job": finished}, refresh=True
+                    )
+
+            processed += len(jobs)
+            idle_since = time.monotonic()
+    finally:
+        con.close()
+
+    logger.info(f"Worker {worker} processed {processed} jobs.")
+
+
+@flow
+@flow_metrics
+def export_quotes(
+    table_names: list[str],
+    schema: str = "raw_quotes",
+    sink: Sink = "postgres",
+    root: str = PARQUET_ROOT,
+) -> None:
+    con = get_connection(sink=sink, schema=schema)
+    try:
+        export_tables(con, table_names, schema=schema, root=root)
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    # prefer the cli (python cli.py --help), this keeps the old `python main.py` run
+    logging.basicConfig(format=FORMAT, level=logging.INFO)
+    populate_db(
+        get_links=True,
+        download_limit=1,
+        page_start=1,
+        page_count=1,
+        page_limit=99,
+        # filter_links=["https://animetosho.org/series/sousou-no-frieren.17617"],
+        schema="raw_quotes",
+    )
+
+    # download_files_from_anime(mal_id=55791)
@@ -0,0 +1,159 @@
+import json
+import mmap
+import os
+import shutil
+from typing import Any, Optional
+
+from .constants import ARCHIVE_FILE, ARCHIVE_INDEX, DATA_FOLDER, DOWNLOAD_CHUNK_SIZE
+from .storage import hash_content
+
+MAGIC = b"ASUBPACK1\n"
+
+
+class SubtitleArchive:
+    """
+    Packed storage of the subtitle files of one anime: data/<anime>/subtitles.pack,
+    where members (the downloaded .xz files) are only appended, and
+    data/<anime>/subtitles.idx, the offset table: name -> offset, size and sha256.
+
+    Writing a member that already exists appends the new content and points the
+    index to it. Bytes not referenced by the index (e.g. an interrupted append)
+    are just ignored. Reads are random access over a mmap of the pack.
+    Appends with flush=False are only synced and indexed on flush() (or close()),
+    once for a whole batch of members.
+    """
+
+    def __init__(self, anime: str, folder: str = DATA_FOLDER) -> None:
+        self.folder = os.path.join(folder, anime)
+        self.pack_path = os.path.join(self.folder, ARCHIVE_FILE)
+        self.index_path = os.path.join(self.folder, ARCHIVE_INDEX)
+        self.members: dict[str, dict[str, Any]] = {}
+        self._mmap: Optional[mmap.mmap] = None
+        # members appended (with flush=False) since the index was last written
+        self._pending = 0
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.members = json.load(f)["members"]
+
+    @staticmethod
+    def exists(anime: str, folder: str = DATA_FOLDER) -> bool:
+        return os.path.exists(os.path.join(folder, anime, ARCHIVE_INDEX))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def names(self) -> list[str]:
+        """
+        Member names, in the order they were first added.
+        """
+        return list(self.members)
+
+    def append(self, name: str, content: bytes, flush: bool = True) -> str:
+        """
+        Appends content as member name and returns its sha256.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        self._close_mmap()
+        with open(self.pack_path, "ab") as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            offset = f.tell()
+            f.write(content)
+
+        digest = hash_content(content)
+        self.members[name] = {"offset": offset, "size": len(content), "sha256": digest}
+        self._pending += 1
+        if flush:
+            self.flush()
+        return digest
+
+    def append_file(self, name: str, path: str, digest: str, flush: bool = True) -> str:
+        """
+        Same as append, copying the content of an already written (and hashed) file.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        self._close_mmap()
+        with open(self.pack_path, "ab") as f, open(path, "rb") as source:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            offset = f.tell()
+            shutil.copyfileobj(source, f, DOWNLOAD_CHUNK_SIZE)
+            size = f.tell() - offset
+
+        self.members[name] = {"offset": offset, "size": size, "sha256": digest}
+        self._pending += 1
+        if flush:
+            self.flush()
+        return digest
+
+    def flush(self) -> None:
+        """
+        Syncs the pack and writes the index of the members appended so far.
+        The pack is synced first, so the index never points to bytes not on disk.
+        """
+        if not self._pending:
+            return
+
+        with open(self.pack_path, "ab") as f:
+            os.fsync(f.fileno())
+        self._write_index()
+        self._pending = 0
+
+    def read(self, name: str) -> bytes:
+        member = self.members[name]
+        if self._mmap is None:
+            with open(self.pack_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._mmap[member["offset"]:member["offset"] + member["size"]]
+
+    def digest(self, name: str) -> str:
+        return self.members[name]["sha256"]
+
+    def remove(self, name: str) -> None:
+        """
+        Drops name from the index (its bytes stay in the pack until it is rewritten).
+        """
+        self.members.pop(name, None)
+        self._write_index()
+
+    def verify(self) -> list[str]:
+        """
+        Checks every member against its sha256, without touching the network.
+        Returns the names of the corrupted (or truncated) members.
+        """
+        size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        corrupted = []
+        for name, member in self.members.items():
+            if member["offset"] + member["size"] > size:
+                corrupted.append(name)
+            elif hash_content(self.read(name)) != member["sha256"]:
+                corrupted.append(name)
+
+        return corrupted
+
+    def close(self) -> None:
+        self.flush()
+        self._close_mmap()
+
+    def _close_mmap(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _write_index(self) -> None:
+        # write to a temporary file first so readers never see a half written index
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"members": self.members}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def __enter__(self) -> "SubtitleArchive":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
@@ -0,0 +1,179 @@
+"""
+Protection against site outages: a circuit breaker per host, shared by every
+request of the process, and a failure budget per run (see read_url).
+"""
+import threading
+import time
+from typing import Dict, Literal
+from urllib.parse import urlsplit
+
+from .constants import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_MAX_RESET_TIMEOUT,
+    BREAKER_RESET_TIMEOUT,
+    FAILURE_BUDGET_MAX_FAILURES,
+    FAILURE_BUDGET_MIN_REQUESTS,
+    FAILURE_BUDGET_RATIO,
+)
+from .metrics import METRICS
+
+State = Literal["closed", "open", "half_open"]
+
+
+class FailureBudgetExceeded(RuntimeError):
+    """
+    Too many urls failed during the run, raised to abort the flow early.
+    """
+
+
+class CircuitBreaker:
+    """
+    closed: requests go through, consecutive failures are counted.
+    open: after failure_threshold consecutive failures, requests fail fast
+        (no request, no waits) for reset_timeout seconds.
+    half_open: then a single request is let through as a probe. If it succeeds the
+        circuit closes, otherwise it opens again (with twice the timeout).
+    """
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        max_reset_timeout: float = BREAKER_MAX_RESET_TIMEOUT,
+    ) -> None:
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state: State = "closed"
+            self.failures = 0
+            self.reset_timeout = self.base_reset_timeout
+            self.opened_at = 0.0
+            self._probing = False
+
+    @property
+    def state(self) -> State:
+        with self._lock:
+            if self._state == "open" and self._timeout_elapsed():
+                return "half_open"
+            return self._state
+
+    def _timeout_elapsed(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be made now. In half_open, only the caller that gets
+        True is probing, everyone else keeps failing fast until it reports back.
+        """
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and self._timeout_elapsed():
+                self._state = "half_open"
+            if self._state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != "closed":
+                METRICS.inc("circuit_transitions_total", host=self.host, state="closed")
+            self._state = "closed"
+            self.failures = 0
+            self.reset_timeout = self.base_reset_timeout
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == "open":
+                # requests that were already in flight when it opened
+                return
+            if self._state == "half_open":
+                # the probe failed, host is still down
+                self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+            elif self.failures < self.failure_threshold:
+                return
+
+            self._state = "open"
+            self.opened_at = time.monotonic()
+            self._probing = False
+            METRICS.inc("circuit_transitions_total", host=self.host, state="open")
+
+
+class CircuitBreakers:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(host)
+            return self._breakers[host]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+
+class FailureBudget:
+    """
+    Counts the urls requested during a run (after their retries) and raises
+    FailureBudgetExceeded once too many of them failed.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(
+        self,
+        max_failures: int = FAILURE_BUDGET_MAX_FAILURES,
+        max_ratio: float = FAILURE_BUDGET_RATIO,
+        min_requests: int = FAILURE_BUDGET_MIN_REQUESTS,
+    ) -> None:
+        with self._lock:
+            self.max_failures = max_failures
+            self.max_ratio = max_ratio
+            self.min_requests = min_requests
+            self.requests = 0
+            self.failures = 0
+
+    def record(self, success: bool, url: str = "") -> None:
+        with self._lock:
+            self.requests += 1
+            if success:
+                return
+            self.failures += 1
+            exceeded = self.failures >= self.max_failures or (
+                self.requests >= self.min_requests
+                and self.failures / self.requests > self.max_ratio
+            )
+
+        if exceeded:
+            raise FailureBudgetExceeded(
+                f"{self.failures} of {self.requests} urls failed during this run "
+                f"(last: {url}), aborting."
+            )
+
+
+BREAKERS = CircuitBreakers()
+FAILURE_BUDGET = FailureBudget()
+
+
+def reset_failure_budget() -> None:
+    """
+    Called at the start of every flow run: fresh budget, every circuit closed.
+    """
+    FAILURE_BUDGET.reset()
+    BREAKERS.reset()
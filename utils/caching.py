@@ -0,0 +1,84 @@
+"""
+Cache keys of the prefect tasks that can be skipped on reruns and retries.
+Keys are content addressed: a task runs again only when what it reads changed
+(the listing entry of a series, the subtitle files of an anime) or when
+PARSER_VERSION is bumped.
+"""
+import json
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from bs4.element import Tag
+from prefect.context import TaskRunContext
+
+from .archive import SubtitleArchive
+from .constants import CACHE_EXPIRATION_SECONDS, PARSER_VERSION
+from .helpers import read_anime_input
+from .storage import hash_content, read_episode_index
+
+CACHE_EXPIRATION = timedelta(seconds=CACHE_EXPIRATION_SECONDS)
+
+
+def _digest(*parts: Any) -> str:
+    content = json.dumps([PARSER_VERSION, *parts], sort_keys=True, default=str)
+    return hash_content(content.encode())
+
+
+def listing_fingerprint(entry: Tag) -> str:
+    """
+    Hash of the entry of a series on the listing, which changes with the series
+    (e.g. new releases), so its links are resolved again.
+    """
+    return hash_content(str(entry).encode())
+
+
+def subtitle_digests(anime: str) -> Dict[str, str]:
+    """
+    sha256 of every subtitle file of anime (episode file -> hash), from its episode
+    index or its packed archive. Empty when nothing was downloaded.
+    """
+    if SubtitleArchive.exists(anime):
+        archive = SubtitleArchive(anime)
+        return {name: archive.digest(name) for name in archive.names()}
+
+    return {
+        name: entry.get("processed") or entry.get("raw", "")
+        for name, entry in read_episode_index(anime).items()
+    }
+
+
+def series_cache_key(
+    context: TaskRunContext, parameters: Dict[str, Any]
+) -> Optional[str]:
+    # without the listing entry (e.g. filtered links) there is nothing to key on
+    if not parameters.get("fingerprint"):
+        return None
+
+    # shared by the tasks that resolve a series, each has its own entries
+    return _digest(
+        context.task.name,
+        parameters["link"],
+        parameters["fingerprint"],
+        parameters.get("desired_subs"),
+    )
+
+
+def ingest_cache_key(
+    context: TaskRunContext, parameters: Dict[str, Any]
+) -> Optional[str]:
+    anime = parameters["anime"]
+    digests = subtitle_digests(anime)
+    if not digests:
+        return None
+
+    # the links say which episode each file is
+    links = read_anime_input(parameters["file_path"], anime, parameters["languages"])
+    return _digest(
+        "ingest",
+        anime,
+        digests,
+        links.get(anime),
+        parameters["schema"],
+        parameters["sink"],
+        parameters["export_parquet"],
+    )
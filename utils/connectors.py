@@ -1,16 +1,48 @@
 import os
+import sqlite3
+from typing import Optional
 
 import psycopg2
-from sqlalchemy import create_engine
-from sqlalchemy.engine.base import Engine
+from dotenv import load_dotenv
 
+from .constants import SQLITE_DATABASE, SQLITE_PRAGMAS
 
-def sqlite_connector(db_name: str) -> Engine:
+
+def sqlite_connector(
+    db_name: str,
+    schema: Optional[str] = None,
+) -> sqlite3.Connection:
+    """
+    Opens a sqlite database stored under the database folder.
+
+    If schema is provided, the database file is attached under that name, so
+    queries written for postgres (schema.table) run unchanged. The connection is
+    in autocommit mode (isolation_level=None), writers manage their own transactions.
+    Prefect runs tasks on worker threads, so the connection may be used (one at a
+    time) by another thread than the one that opened it.
+    """
     if db_name[-3:] != ".db":
         db_name += ".db"
+    os.makedirs("database", exist_ok=True)
     db_path = os.path.realpath(f'database/{db_name}')
-    engine = create_engine(f'sqlite:///{db_path}', echo=False)
-    return engine
+
+    if schema is None:
+        connection = sqlite3.connect(
+            db_path, isolation_level=None, check_same_thread=False
+        )
+        prefix = ""
+    else:
+        connection = sqlite3.connect(
+            ":memory:", isolation_level=None, check_same_thread=False
+        )
+        connection.execute(f"ATTACH DATABASE ? AS {schema};", (db_path,))
+        prefix = f"{schema}."
+
+    for pragma, value in SQLITE_PRAGMAS.items():
+        connection.execute(f"PRAGMA {prefix}{pragma} = {value};")
+    connection.execute("PRAGMA temp_store = MEMORY;")
+
+    return connection
 
 
 def postgres_connector(
@@ -37,3 +69,22 @@ def postgres_connector(
         raise
 
     return connection
+
+
+def get_connection(sink: str = "postgres", schema: str = "raw_quotes"):
+    """
+    Connection to the sink: the sqlite database (SQLITE_DATABASE, with schema
+    attached) or postgres, configured by the HOST, PORT, DATABASE, USER and
+    PASSWORD environment variables (or a .env file).
+    """
+    if sink == "sqlite":
+        return sqlite_connector(db_name=SQLITE_DATABASE, schema=schema)
+
+    load_dotenv()
+    return postgres_connector(
+        user=os.getenv("USER"),
+        password=os.getenv("PASSWORD"),
+        host=os.getenv("HOST"),
+        database=os.getenv("DATABASE"),
+        port=os.getenv("PORT"),
+    )
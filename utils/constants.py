@@ -1,9 +1,24 @@
 # URL API Configs
-MAIN_URL = "https://animetosho.org/animes"
+BASE_URL = "https://animetosho.org"
+LISTING_PATH = "/animes"
+MAIN_URL = BASE_URL + LISTING_PATH
 REMOVE_REPACK = "?filter%5B0%5D%5Bt%5D=nyaa_class&filter%5B0%5D%5Bv%5D=remake&order=date-a"
 DEFAULT_TIMEOUT = 15
 DEFAULT_ATTEMPTS = 3
 DEFAULT_WAIT_TIME = 15.0
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes read/written at a time when downloading files
+CORRUPTED_DOWNLOAD_RETRIES = 2  # times a corrupted/truncated download is queued again
+# circuit breaker (per host): opens after this many consecutive failures,
+# then lets a probe through every BREAKER_RESET_TIMEOUT seconds (doubled while
+# the probes fail, up to BREAKER_MAX_RESET_TIMEOUT)
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30.0
+BREAKER_MAX_RESET_TIMEOUT = 300.0
+# failure budget (per run): abort once this many urls failed, or once more than
+# FAILURE_BUDGET_RATIO of them failed (after FAILURE_BUDGET_MIN_REQUESTS urls)
+FAILURE_BUDGET_MAX_FAILURES = 200
+FAILURE_BUDGET_RATIO = 0.5
+FAILURE_BUDGET_MIN_REQUESTS = 50
 
 # Logger config
 FORMAT = "[%(filename)s | %(funcName)s : %(lineno)s] %(levelname)s: %(message)s"
@@ -32,3 +47,88 @@ RESERVED_CHARACTERS_REMAP = {
     "!": "_" * 3
 }
 MAX_LINES_PER_EPISODE = 600
+# SONG (OP/ED lyrics) detection, see collapse_songs
+# styles with any of these words (e.g. "OP_Romaji", "ED-Eng", "Song - Kara")
+SONG_STYLE_REGEX = r'(?:^|[^a-z])(?:op|ed|opening|ending|song|insert|karaoke|kara|lyrics?)(?:[^a-z]|$)'
+SONG_NAMES = ["op", "ed", "opening", "ending", "song", "insert song", "lyrics", "karaoke"]
+# unflagged lines count as lyrics when the same text (with the same duration)
+# shows up in SONG_MIN_EPISODES episodes, as part of a run of SONG_MIN_RUN such lines
+SONG_MIN_EPISODES = 3
+SONG_MIN_RUN = 4
+
+# EXPORT configs
+PARQUET_ROOT = "exports/quotes"
+PARQUET_MANIFEST = "_manifest.json"
+
+# SQLITE configs
+SQLITE_DATABASE = "quotes"
+SQLITE_BATCH_SIZE = 50000
+# applied to every attached database (schema) on connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # negative means KiB, so ~64MB
+    "mmap_size": 268435456,
+}
+
+# SEARCH configs
+SEARCH_TABLE = "quote_search"
+SEARCH_TS_CONFIG = "english"  # postgres text search configuration
+SEARCH_DEFAULT_LIMIT = 50
+
+# STATS configs (one row per quote table and episode, kept by the writers)
+STATS_TABLE = "quote_stats"
+# the lines per episode threshold is this percentile of the episodes written so far
+# (times the margin, as rows are counted before merge_quotes joins continued lines)
+STATS_THRESHOLD_PERCENTILE = 0.99
+STATS_THRESHOLD_MARGIN = 1.2
+# below this many episodes, MAX_LINES_PER_EPISODE is used instead
+STATS_MIN_EPISODES = 100
+
+# METRICS configs
+METRICS_FOLDER = "metrics"
+METRICS_PREFIX = "animesubs"
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# PROFILING configs
+# comma separated names of the functions/tasks to profile (or "all")
+PROFILE_ENV_VAR = "ANIMESUBS_PROFILE"
+PROFILE_FOLDER = "profiles"
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+
+# TITLE PARSER configs
+TITLE_CACHE_SIZE = 65536
+
+# TASK CACHE configs (prefect results, see utils/caching.py)
+# bump when a change to the parsers/cleaning changes their output,
+# so cached link resolutions and ingestions are redone
+PARSER_VERSION = 1
+# cached results are also redone after this many seconds (e.g. tables
+# dropped by hand, animes completed since)
+CACHE_EXPIRATION_SECONDS = 7 * 24 * 3600
+
+# STORAGE configs
+DATA_FOLDER = "data"
+# content addressed files, shared by every anime (data/_blobs/ab/cd/abcd...)
+BLOBS_FOLDER = DATA_FOLDER + "/_blobs"
+BLOBS_INDEX = "_index.json"
+# per anime index (data/<anime>/_index.json), episode file -> blob hashes
+EPISODE_INDEX = "_index.json"
+# packed storage (one archive per anime instead of raw/ and processed/ folders)
+ARCHIVE_FILE = "subtitles.pack"
+ARCHIVE_INDEX = "subtitles.idx"
+# link manifests (examples/<name>.ndjson, one anime per line) and their offset index
+MANIFESTS_FOLDER = "examples"
+MANIFEST_SUFFIX = ".ndjson"
+MANIFEST_INDEX_SUFFIX = ".idx"
+MANIFEST_CACHE_SIZE = 64
+
+# CRAWL QUEUE configs (postgres only, see utils/jobs.py)
+CRAWL_JOBS_TABLE = "crawl_jobs"
+# lower runs first, so started animes are finished before new pages are listed
+JOB_PRIORITIES = {"subtitle": 0, "episode": 1, "anime": 2, "listing": 3}
+JOB_LEASE_SECONDS = 300
+JOB_HEARTBEAT_SECONDS = 60
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_WAIT = 30  # seconds, doubled at every attempt
+JOB_POLL_SECONDS = 5
@@ -0,0 +1,217 @@
+"""
+What previous crawls already saw: the high-water mark of each listing (and where
+to resume a crawl that did not get down to it), the animes already collected (raw_quotes.v_json_info) and the key of every anime
+(raw_quotes.title_keys). Works on both sinks.
+"""
+import sqlite3
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from .queries import (
+    query_anime_status,
+    query_any_title_key,
+    query_backfill_title_keys,
+    query_backfill_title_keys_sqlite,
+    query_claim_title_key,
+    query_create_crawl_state,
+    query_create_title_keys,
+    query_json_info_exists,
+    query_json_info_exists_sqlite,
+    query_read_crawl_state,
+    query_read_title_key,
+    query_write_crawl_state,
+    query_write_resume_cursor,
+)
+from .titles import normalize_title_key
+
+
+def _placeholders(con: Any, *names: str) -> Dict[str, str]:
+    # sqlite uses :name, psycopg2 uses %(name)s
+    if isinstance(con, sqlite3.Connection):
+        return {name: f":{name}" for name in names}
+    return {name: f"%({name})s" for name in names}
+
+
+def _fetchone(con: Any, query: str, params: Dict[str, Any]) -> Optional[Tuple]:
+    if isinstance(con, sqlite3.Connection):
+        return con.execute(query, params).fetchone()
+
+    with con.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchone()
+
+
+def _execute(con: Any, query: str, params: Optional[Dict[str, Any]] = None) -> None:
+    if isinstance(con, sqlite3.Connection):
+        con.execute(query, params or {})
+        return
+
+    with con.cursor() as cursor:
+        cursor.execute(query, params)
+
+
+def _read_crawl_state(con: Any, listing: str, schema: str) -> Optional[Tuple]:
+    _execute(con, query_create_crawl_state % {"schema": schema})
+    query = query_read_crawl_state % {
+        "schema": schema, **_placeholders(con, "listing")
+    }
+    return _fetchone(con, query, {"listing": listing})
+
+
+def read_high_water_mark(
+    con: Any, listing: str, schema: str = "raw_quotes"
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns:
+    - Tuple[Optional[str], Optional[str]]: The newest series link already crawled
+        from listing and when it was seen, (None, None) for a listing never crawled.
+    """
+    row = _read_crawl_state(con, listing, schema)
+    if not row or row[0] is None:
+        return None, None
+    return row[0], str(row[1])
+
+
+def read_resume_cursor(
+    con: Any, listing: str, schema: str = "raw_quotes"
+) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Returns:
+    - Tuple[Optional[int], Optional[str]]: The next page of a crawl of listing that
+        stopped before the high-water mark (or the end of the listing) and the
+        newest link when that crawl started, (None, None) if there is none.
+    """
+    row = _read_crawl_state(con, listing, schema)
+    if not row or row[2] is None:
+        return None, None
+    return row[2], row[3]
+
+
+def write_high_water_mark(
+    con: Any, listing: str, last_link: str, schema: str = "raw_quotes"
+) -> None:
+    _execute(con, query_create_crawl_state % {"schema": schema})
+    query = query_write_crawl_state % {
+        "schema": schema, **_placeholders(con, "listing", "last_link", "last_seen_at")
+    }
+    params = {
+        "listing": listing,
+        "last_link": last_link,
+        "last_seen_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
+    }
+    _execute(con, query, params)
+
+
+def write_resume_cursor(
+    con: Any, listing: str, page: int, newest_link: str, schema: str = "raw_quotes"
+) -> None:
+    """
+    Records where the next crawl of listing continues. The high-water mark is left
+    as is, it only moves to newest_link once a crawl gets down to it.
+    """
+    _execute(con, query_create_crawl_state % {"schema": schema})
+    query = query_write_resume_cursor % {
+        "schema": schema, **_placeholders(con, "listing", "resume_page", "resume_link")
+    }
+    params = {"listing": listing, "resume_page": page, "resume_link": newest_link}
+    _execute(con, query, params)
+
+
+class CollectedAnimes:
+    """
+    Animes already collected, by mal_id. Replaces loading the whole v_json_info view
+    into a dict: each lookup is a single (indexed) query, memoized for the run.
+    Dict-like, so callers keep using .get(mal_id, {}).get("completed", False).
+    """
+
+    def __init__(self, con: Any, schema: str = "raw_quotes") -> None:
+        self.con = con
+        self.query = query_anime_status % {
+            "schema": schema, **_placeholders(con, "mal_id")
+        }
+        self._statuses: Dict[int, Optional[Dict[str, Any]]] = {}
+
+    def get(self, mal_id: int, default: Any = None) -> Any:
+        if mal_id not in self._statuses:
+            row = _fetchone(self.con, self.query, {"mal_id": mal_id})
+            self._statuses[mal_id] = (
+                {"completed": bool(row[0]), "ep_amount": row[1]} if row else None
+            )
+
+        status = self._statuses[mal_id]
+        return status if status is not None else default
+
+    def __contains__(self, mal_id: int) -> bool:
+        return self.get(mal_id) is not None
+
+    def close(self) -> None:
+        self.con.close()
+
+
+class TitleKeys:
+    """
+    Key (folder and table name) of every anime crawled, by mal_id. A key is
+    generated once (see normalize_title_key) and kept, even if the title changes on
+    the site. An anime whose title gives a key already taken by another one gets its
+    mal_id as suffix (e.g. "nisekoi_9863"), instead of sharing its folder and table.
+    Animes crawled before the registry existed keep the key of their links.
+    Lookups are memoized for the run.
+    """
+
+    def __init__(self, con: Any, schema: str = "raw_quotes") -> None:
+        self.con = con
+        _execute(con, query_create_title_keys % {"schema": schema})
+        if _fetchone(con, query_any_title_key % {"schema": schema}, {}) is None:
+            self._backfill(schema)
+        self.read_query = query_read_title_key % {
+            "schema": schema, **_placeholders(con, "mal_id")
+        }
+        self.claim_query = query_claim_title_key % {
+            "schema": schema,
+            **_placeholders(con, "title_key", "mal_id", "title", "created_at"),
+        }
+        self._keys: Dict[int, str] = {}
+
+    def _backfill(self, schema: str) -> None:
+        # keys from v_json_info (the name of the newest links of each anime)
+        if isinstance(self.con, sqlite3.Connection):
+            exists_query, backfill_query = (
+                query_json_info_exists_sqlite, query_backfill_title_keys_sqlite
+            )
+        else:
+            exists_query, backfill_query = (
+                query_json_info_exists, query_backfill_title_keys
+            )
+
+        if _fetchone(self.con, exists_query % {"schema": schema}, {})[0]:
+            _execute(self.con, backfill_query % {"schema": schema})
+
+    def _read(self, mal_id: int) -> Optional[str]:
+        row = _fetchone(self.con, self.read_query, {"mal_id": mal_id})
+        return row[0] if row else None
+
+    def get(self, title: str, mal_id: int) -> str:
+        if mal_id in self._keys:
+            return self._keys[mal_id]
+
+        title_key = self._read(mal_id)
+        base_key = normalize_title_key(title)
+        candidates = [base_key, f"{base_key}_{mal_id}"] if base_key else [f"_{mal_id}"]
+        for candidate in candidates:
+            if title_key is not None:
+                break
+            params = {
+                "title_key": candidate,
+                "mal_id": mal_id,
+                "title": title,
+                "created_at": datetime.now().isoformat(sep=" ", timespec="seconds"),
+            }
+            _execute(self.con, self.claim_query, params)
+            # the key may belong to another anime, or another worker got here first
+            title_key = self._read(mal_id)
+
+        if title_key is None:
+            raise ValueError(f"No key available for anime {title} ({mal_id}).")
+
+        self._keys[mal_id] = title_key
+        return title_key
@@ -1,66 +1,55 @@
 import ass
 import datetime
+import io
 import json
 import logging
 import lzma
 import re
 import os
+import time
+import numpy as np
 import pandas as pd
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
 # from ass.line import Dialogue
 from bs4.element import Tag
 from prefect import get_run_logger
 
 from .constants import (
-    SEQUENCE_REGEX,
-    QUALITY_REGEX,
-    EPISODE_REGEX,
-    SEASON_REGEX,
-    REMOVE_DELIMITERS_REGEX,
     BRACKETS_REGEX,
-    SPECIAL_CHARS_REGEX,
     PREFERENCE_RAWS,
     DESIRED_SUBS,
-    FORMAT,
     PATH_ID_MEMBER_MAP,
-    NOT_ALLOWED_CHARACTERS,
-    RESERVED_CHARACTERS_REMAP
+    SONG_MIN_EPISODES,
+    SONG_MIN_RUN,
+    SONG_NAMES,
+    SONG_STYLE_REGEX,
 )
+from .archive import SubtitleArchive
+from .manifest import is_manifest, read_manifest, read_manifest_entry
+from .metrics import METRICS
+from .profiling import profiled
+from .storage import BlobStore, hash_file, read_episode_index, write_episode_index
+from . import titles
+from .titles import (
+    build_title_key,
+    extract_provider,
+    extract_season,
+    normalize_title,
+    parse_release_title,
+    parse_release_titles,
+)
+
+BRACKETS_PATTERN = re.compile(BRACKETS_REGEX)
 
-# Setup logger
+# Setup logger (handlers are configured by the entry point, see cli.py)
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    format=FORMAT,
-    level=logging.INFO,
-    handlers=[logging.StreamHandler()])
 
 
 def get_provider(text: str) -> str:
     # provider is (probably) at the start
-    provider = ""
-    if text.find("[") == 0:
-        possible_provider = text.split("]")[0] + "]"
-        matched = re.search(SEQUENCE_REGEX, possible_provider)
-        if not matched:
-            # then we know it is the provider
-            provider = possible_provider
-
-    if text.find("(") == 0:
-        # regex not needed here since torrent sequence do not appear inside ()
-        provider = text.split(")")[0] + ")"
-
-    # provider is (probably) at the end
-    # CURRENTLY IGNORING PROVIDERS AT THE END
-    # if text.find("]") == (len(text) - 1) and not provider:
-    #     possible_provider = "[" + text.split("[")[-1]
-    #     matched = re.search(SEQUENCE_REGEX, possible_provider)
-    #     if not matched:
-    #         provider = possible_provider
-
-    # if text.find(")") == (len(text) - 1) and not provider:
-    #     provider = "(" + text.split(")")[-1]
-
-    return provider
+    # providers at the end are currently ignored
+    return extract_provider(text)
 
 
 def extract_titles_and_anime_links(
@@ -82,6 +71,18 @@ def extract_titles_and_anime_links(
     return titles, links
 
 
+def rebase_url(url: str, base_url: str) -> str:
+    """
+    Points url to another host (e.g. a local stand-in server), keeping path and query.
+    Ex: rebase_url("https://storage.animetosho.org/attach/a.xz", "http://localhost:8000")
+    returns "http://localhost:8000/attach/a.xz".
+    """
+    parts = urlsplit(url)
+    base = urlsplit(base_url)
+    path = base.path.rstrip("/") + parts.path
+    return urlunsplit((base.scheme, base.netloc, path, parts.query, parts.fragment))
+
+
 def format_title_for_filter(title: str) -> str:
     return title.replace(" ", "").lower()
 
@@ -124,23 +125,17 @@ def filter_links_from_provider(
 ) -> List[Dict[str, str]]:
     # maybe return length of the list
     logger = get_run_logger()
-    already_selected = []
+    already_selected = set()
     filtered_entries = []
 
-    for entry in entries:
-        title = entry["link_title"]
-        quality_match = re.search(QUALITY_REGEX, title)
-        sequence_match = re.search(SEQUENCE_REGEX, title)
-        quality = quality_match.group(1) if quality_match else ""
-        sequence = sequence_match.group(1) if sequence_match else ""
-
-        cleaned_title = clean_title_string(
-            title, quality, sequence, batch_provider
-        )
-        if cleaned_title in already_selected:
+    releases = parse_release_titles(
+        (entry["link_title"] for entry in entries), batch_provider
+    )
+    for entry, release in zip(entries, releases):
+        if release.key in already_selected:
             continue
 
-        already_selected.append(cleaned_title)
+        already_selected.add(release.key)
         filtered_entries.append(entry)
 
     if ep_count:
@@ -159,19 +154,7 @@ def filter_links_from_provider(
 def clean_title_string(
     title: str, quality: str, sequence: str, batch_provider: str
 ) -> str:
-    # base cleaning (remove quality and torrent sequence)
-    title = title.replace(quality, "").replace(sequence, "")
-    # hevc changes nothing subtitle-wise
-    title = title.replace("[HEVC]", "").replace(" HEVC", "")
-
-    # try specific filter for current batch provider
-    match batch_provider:
-        case "[Erai-raws]":
-            # needs more testing, may remove too much
-            title = title.split("[Multiple Subtitle]")[0]
-        case _:
-            pass
-    return title
+    return build_title_key(title, quality, sequence, batch_provider)
 
 
 def filter_subs(
@@ -200,6 +183,65 @@ def filter_subs(
     return sub_info, sub_link
 
 
+def filter_ass_subs(subs: Dict[str, str]) -> Dict[str, str]:
+    """
+    Keeps only the .ass.xz attachments (of every language), the only format we parse.
+    """
+    return {lang: link for lang, link in subs.items() if link[-6:] == "ass.xz"}
+
+
+def language_key(anime: str, language: str = DESIRED_SUBS) -> str:
+    """
+    Name of the data folder/table of an anime for the given subtitle language.
+    DESIRED_SUBS keeps the plain anime name, other languages get it as suffix.
+    """
+    if language == DESIRED_SUBS:
+        return anime
+    return f"{anime}_{language}"
+
+
+def expand_languages(
+    data: Dict[str, Any], languages: Sequence[str] = (DESIRED_SUBS,)
+) -> Dict[str, Any]:
+    """
+    One entry per anime and language (see language_key), with sub_info/sub_link
+    of each episode pointing to the subtitles of that language. Subtitles of every
+    language are collected in a single crawl (the "subs" of each episode), so adding
+    a language costs downloads and parsing, but no extra page requests.
+    Entries crawled before that only have their DESIRED_SUBS subtitles, and
+    episodes with subtitles in other languages only are left out of the
+    DESIRED_SUBS entry.
+    """
+    result = {}
+    for anime, anime_info in data.items():
+        for language in languages:
+            if language == DESIRED_SUBS:
+                entries = [entry for entry in anime_info["data"] if entry.get("sub_link")]
+                if len(entries) == len(anime_info["data"]):
+                    result[anime] = anime_info
+                else:
+                    result[anime] = {**anime_info, "data": entries}
+                continue
+
+            entries = []
+            for entry in anime_info["data"]:
+                sub_info, sub_link = filter_subs(
+                    link=entry.get("link_url", ""),
+                    subs=entry.get("subs", {}),
+                    target_lang=language,
+                )
+                if sub_link:
+                    entries.append({**entry, "sub_info": sub_info, "sub_link": sub_link})
+
+            if entries:
+                result[language_key(anime, language)] = {
+                    "data": entries,
+                    "metadata": {**anime_info["metadata"], "language": language},
+                }
+
+    return result
+
+
 def clean_ass_text(line: str) -> str:
     """
     Obsolete fn. Replaced by prepare_text_for_insertion
@@ -260,9 +302,10 @@ def create_folders_for_anime(
 def generate_ass_files(filter_anime: str = "") -> List[str]:
     logger = get_run_logger()
     created = []
-    filter_anime = remove_special_characters(
-        filter_anime).replace(" ", "_").lower()
-    animes = os.listdir('data')
+    filter_anime = normalize_title(filter_anime)
+    # folders starting with _ are not animes (e.g. the blob store)
+    animes = [anime for anime in os.listdir('data') if not anime.startswith('_')]
+    store = BlobStore()
 
     # this is kinda obsolete, very hard to maintain
     # if you want to filter anime, it´s better to filter it´s link
@@ -276,9 +319,14 @@ def generate_ass_files(filter_anime: str = "") -> List[str]:
             continue
 
         folder_path = 'data/' + anime + '/raw'
+        if not os.path.exists(folder_path):
+            # packed storage (see SubtitleArchive), nothing to extract
+            continue
+
         episodes = os.listdir(folder_path)
         success = 0
         fails = 0
+        reused = 0
 
         # check if already generated all .ass for this entry
         proc_path = folder_path.replace("raw", "processed")
@@ -287,35 +335,63 @@ def generate_ass_files(filter_anime: str = "") -> List[str]:
                 logger.debug(f"Already generated .ass files for {anime}.")
                 continue
 
+        episode_index = read_episode_index(anime)
         logger.info(f'Generating .ass files for anime: {anime}')
         for idx, episode in enumerate(episodes):
             if ((idx + 1) % 10) == 0 or (idx + 1) == len(episodes):
                 logger.info(f"[Progress|Total]: [{idx+1}|{len(episodes)}]")
 
             path = folder_path + '/' + episode
-            # read .xz file
+            # removing .xz
+            key = episode[:-3]
+            # we want to save .ass files into processed folder, not raw
+            ass_path = path[:-3].replace('/raw/', '/processed/') + '.ass'
+            entry = episode_index.setdefault(key, {})
             try:
-                with lzma.open(path, mode='rb') as file:
-                    content = file.read()
-
-                # removing .xz
-                path = path[:-3]
-                # we want to save .ass files into processed folder, not raw
-                path = path.replace('/raw/', '/processed/')
-
-                with open(path + '.ass', 'wb') as file:  # write content into .ass file
-                    file.write(content)
-                    success += 1
+                raw_digest = entry.get("raw") or hash_file(path)
+                entry["raw"] = raw_digest
+
+                # same .xz was already decompressed (for this or another anime)
+                processed_digest = store.processed.get(raw_digest)
+                if store.exists(processed_digest, '.ass'):
+                    reused += 1
+                else:
+                    # read .xz file
+                    with lzma.open(path, mode='rb') as file:
+                        content = file.read()
+                    processed_digest = store.put(content, '.ass')
+                    store.processed[raw_digest] = processed_digest
+
+                store.link(processed_digest, '.ass', ass_path)
+                entry["processed"] = processed_digest
+                success += 1
+
+            except lzma.LZMAError:
+                # corrupted/truncated download, remove it so it is downloaded again
+                logger.warning(f"{path} is corrupted, it will be downloaded again.")
+                os.remove(path)
+                # the blob is the same (hard linked) file
+                blob_path = store.path(episode_index.pop(key, {}).get("raw") or "", '.xz')
+                if os.path.exists(blob_path):
+                    os.remove(blob_path)
+                fails += 1
+                continue
 
             except Exception:
                 fails += 1
                 continue
 
+        write_episode_index(anime, episode_index)
+        store.save()
+
         if success > 0:
             created.append(anime)
             logger.info(
                 f'Successfully created {success} .ass files for anime {anime}!')
 
+        if reused > 0:
+            logger.info(f"{reused} of them were already decompressed.")
+
         if fails > 0:
             logger.warning(
                 f"Failed to create {fails} .ass files for anime {anime}.")
@@ -337,43 +413,167 @@ def format_timedelta(delta: datetime.timedelta) -> str:
     return f"{hours:02}:{minutes:02}:{seconds:02}.{milliseconds:03}"
 
 
-def process_episode_data(
-        path: str, episode: int, mal_id: int
-) -> Tuple[List[List[str]], int]:
-    data = []
-    no_character_name = 0
+# name, style, text, start, end of a .ass dialogue event
+Event = Tuple[str, str, str, datetime.timedelta, datetime.timedelta]
+
 
+def read_ass_events(path: str) -> List[Event]:
     with open(path, encoding='utf_8_sig') as f:
         doc = ass.parse(f)
-        # get every dialogue line
-        events = doc.events
-        logger.debug(f'Reading {path.split("/")[-1]}...')
-        for event in events:
-            # we do not care about signs
-            if "sign" in event.style.lower() or \
-                    event.name.lower() == "sign":
-                continue
 
-            if event.start == event.end:
-                # it's probably just a text showing on screen
-                continue
+    logger.debug(f'Reading {path.split("/")[-1]}...')
+    return _dialogue_events(doc)
 
-            # save every line with whoever said the line
-            # also remove brackets and change \N to space
-            cleaned_text = prepare_text_for_insertion(event.text)
 
-            if not cleaned_text:
-                # empty string is useless
-                continue
+def read_packed_ass_events(archive: SubtitleArchive, name: str) -> List[Event]:
+    """
+    Same as read_ass_events, for a .xz member of a packed archive (decompressed in memory).
+    """
+    content = lzma.decompress(archive.read(name)).decode('utf_8_sig')
+    logger.debug(f'Reading {name} from {archive.pack_path}...')
+    return _dialogue_events(ass.parse(io.StringIO(content)))
 
-            # we will probably not have the character names
-            if not event.name or event.name == "NTP":
-                event.name = "Unknown"
-                no_character_name += 1
 
-            data.append(
-                [mal_id, episode, event.name, cleaned_text, event.start, event.end]
-            )
+def _dialogue_events(doc: Any) -> List[Event]:
+    # get every dialogue line
+    return [
+        (event.name, event.style, event.text, event.start, event.end)
+        for event in doc.events
+    ]
+
+
+def clean_events(events: List[Event]) -> Tuple[Any, int]:
+    """
+    Filters and cleans .ass events as column operations (arrow compute kernels),
+    so it can run over one episode or over every episode of an anime at once.
+
+    Parameters:
+    - events (List[Event]): Events as returned by read_ass_events.
+
+    Returns:
+    - Tuple[pa.Table, int]: Table with the kept events (row, name, quote, start_time,
+        end_time, style), row being the position in events, and the amount of quotes
+        without character name.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    names, styles, texts, starts, ends = zip(*events) if events else ([],) * 5
+    names = pa.array(names, pa.string())
+    styles = pa.array(styles, pa.string())
+    starts = pa.array(starts, pa.duration('us'))
+    ends = pa.array(ends, pa.duration('us'))
+
+    # we do not care about signs
+    is_sign = pc.or_(
+        pc.match_substring(styles, 'sign', ignore_case=True),
+        pc.equal(pc.utf8_lower(names), 'sign'),
+    )
+    # when start == end, it's probably just a text showing on screen
+    keep = pc.and_(pc.invert(is_sign), pc.not_equal(starts, ends))
+
+    # remove brackets and change \N to space
+    quotes = prepare_text_array(pa.array(texts, pa.string()))
+    # empty string is useless
+    keep = pc.and_(keep, pc.not_equal(quotes, ''))
+
+    table = pa.table({
+        'row': pa.array(range(len(events)), pa.int64()),
+        'name': names,
+        'quote': quotes,
+        'start_time': starts,
+        'end_time': ends,
+        'style': styles,
+    }).filter(keep)
+
+    # we will probably not have the character names
+    unknown = pc.or_(pc.equal(table['name'], ''), pc.equal(table['name'], 'NTP'))
+    table = table.set_column(
+        1, 'name', pc.if_else(unknown, 'Unknown', table['name'])
+    )
+
+    return table, pc.sum(unknown).as_py() or 0
+
+
+def find_songs(
+    df: pd.DataFrame,
+    min_episodes: int = SONG_MIN_EPISODES,
+    min_run: int = SONG_MIN_RUN,
+) -> np.ndarray:
+    """
+    Flags the lines of df that are OP/ED (or insert song) lyrics, as column
+    operations: lines with a song style (when df has a style column) or name, and
+    lines whose text and duration (hashed together) repeat in at least min_episodes
+    episodes, in runs of at least min_run consecutive repeated lines of an episode
+    (so a catchphrase alone is not taken as lyrics).
+
+    Returns:
+    - np.ndarray: Boolean mask, aligned with the rows of df.
+    """
+    flagged = df["name"].str.lower().isin(SONG_NAMES).to_numpy()
+    if "style" in df.columns:
+        flagged |= df["style"].str.contains(
+            SONG_STYLE_REGEX, case=False, regex=True, na=False
+        ).to_numpy()
+
+    if df["episode"].nunique() < min_episodes:
+        return flagged
+
+    # times may come back from the database as strings or datetime.time
+    duration = (
+        pd.to_timedelta(df["end_time"], errors="coerce")
+        - pd.to_timedelta(df["start_time"], errors="coerce")
+    ).dt.round("10ms")
+    key = pd.util.hash_pandas_object(
+        pd.DataFrame({"quote": df["quote"], "duration": duration}), index=False
+    )
+    episodes = pd.DataFrame({"key": key.to_numpy(), "episode": df["episode"].to_numpy()})
+    seen_in = episodes.drop_duplicates().groupby("key")["episode"].size()
+    repeated = episodes["key"].map(seen_in).to_numpy() >= min_episodes
+
+    # runs of consecutive repeated lines, per episode
+    episode = df["episode"].to_numpy()
+    changed = np.ones(len(df), dtype=bool)
+    changed[1:] = (repeated[1:] != repeated[:-1]) | (episode[1:] != episode[:-1])
+    run = np.cumsum(changed)
+    run_size = np.bincount(run)[run]
+
+    return flagged | (repeated & (run_size >= min_run))
+
+
+def collapse_songs(df: pd.DataFrame, **kwargs: Any) -> pd.DataFrame:
+    """
+    Keeps a single copy of each song line (see find_songs) per anime, the first
+    one, preserving the order of the rows. kwargs go to find_songs.
+    """
+    if df.empty:
+        return df
+
+    songs = find_songs(df, **kwargs)
+    if not songs.any():
+        return df
+
+    quote_hash = pd.util.hash_pandas_object(df["quote"], index=False).to_numpy()
+    repeated = pd.Series(np.where(songs, quote_hash, 0)).duplicated().to_numpy()
+    keep = ~(songs & repeated)
+    METRICS.inc("song_lines_dropped_total", int((~keep).sum()))
+
+    return df[keep].reset_index(drop=True)
+
+
+@profiled()
+def process_episode_data(
+        path: str, episode: int, mal_id: int
+) -> Tuple[List[List[str]], int]:
+    start = time.perf_counter()
+    table, no_character_name = clean_events(read_ass_events(path))
+    columns = table.select(['name', 'quote', 'start_time', 'end_time']).to_pydict()
+    data = [
+        [mal_id, episode, *row] for row in zip(*columns.values())
+    ]
+
+    METRICS.observe("episode_parse_seconds", time.perf_counter() - start)
+    METRICS.inc("episode_lines_total", len(data))
 
     return data, no_character_name
 
@@ -381,59 +581,106 @@ def process_episode_data(
 def build_df_from_ass_files(
     file_path: str,
     anime_name: str,
-    max_lines_per_episode: int
+    max_lines_per_episode: int,
+    languages: Sequence[str] = (DESIRED_SUBS,),
 ) -> Optional[pd.DataFrame]:
     logger = get_run_logger()
-    data = process_data_input(file_path)
+    data = read_anime_input(file_path, anime_name, languages)
 
     # nothing to be done
     if not data:
         return
 
-    elif not data[anime_name]["data"]:
+    elif not data.get(anime_name, {}).get("data"):
         logger.info(f"No links available for anime {anime_name}. Skipping...")
         return
 
-    no_character_name = 0
     folder_path = 'data/' + anime_name + '/processed'
-    # list of every .ass file in anime folder
-    episodes = os.listdir(folder_path)
+    archive = None
+    if SubtitleArchive.exists(anime_name):
+        # packed storage, members are the .xz files
+        archive = SubtitleArchive(anime_name)
+        episodes = archive.names()
+        episode_index = {
+            name: {"processed": archive.digest(name)} for name in episodes
+        }
+    else:
+        # list of every .ass file in anime folder
+        episodes = os.listdir(folder_path)
+        episode_index = {
+            name + '.ass': entry
+            for name, entry in read_episode_index(anime_name).items()
+        }
     anime_info = data[anime_name]
     mal_id = anime_info["metadata"]["mal_id"]
 
-    table = []
+    # events by hash of the file, so the same file is parsed only once
+    parsed: Dict[str, List[Event]] = {}
+    events = []
+    episode_numbers = []
 
     for episode, entry in zip(episodes, anime_info["data"]):
         path = folder_path + '/' + episode
         episode_number = entry["episode_number"]
+        digest = episode_index.get(episode, {}).get("processed")
 
         try:
-            episode_data, no_character = process_episode_data(
-                path, episode_number, mal_id)
-            table += episode_data
-            no_character_name += no_character
-
+            if digest and digest in parsed:
+                episode_events = parsed[digest]
+            else:
+                if archive is not None:
+                    path = archive.pack_path + ':' + episode
+                    episode_events = read_packed_ass_events(archive, episode)
+                else:
+                    episode_events = read_ass_events(path)
+                if digest:
+                    parsed[digest] = episode_events
         except Exception as err:
             logger.error(f'Error reading {path}.')
             raise err
 
+        events += episode_events
+        episode_numbers += [episode_number] * len(episode_events)
+
+    if archive is not None:
+        archive.close()
+
+    # clean every episode of the anime at once
+    start = time.perf_counter()
+    table, _ = clean_events(events)
+    METRICS.observe("episode_parse_seconds", time.perf_counter() - start)
+    METRICS.inc("episode_lines_total", table.num_rows)
+
+    df = table.drop(['row']).to_pandas()
+    df.insert(0, 'episode', np.array(episode_numbers, dtype=object)[table['row'].to_numpy()])
+    df.insert(0, 'mal_id', mal_id)
+    df = df.astype({
+        'mal_id': 'int32',
+        'episode': 'int32',
+        'start_time': 'timedelta64[ns]',
+        'end_time': 'timedelta64[ns]',
+    })
+    # OP/ED lyrics repeat on every episode, one copy is enough
+    rows = len(df)
+    df = collapse_songs(df).drop(columns=['style'])
+    if len(df) < rows:
+        logger.info(f"Dropped {rows - len(df)} repeated song lines.")
+
     ep_count = len(episodes)
     threshold = ep_count * max_lines_per_episode
-    if len(table) > threshold and anime_info["metadata"]["episode_count"] > 1:
+    if len(df) > threshold and anime_info["metadata"]["episode_count"] > 1:
         # probably not a movie, and possibly with lots of "useless" lines.
         # may require manual checking for some cases.
-        # the max_lines_per_episode defined in constants file is based of
-        # the avg of lines per episode from all the shows in the database
-        # but the actual number is somewhat arbitrary, so it may requires tweaking
+        # max_lines_per_episode comes from the lines per episode of the shows
+        # already in the database (see utils/stats.py), MAX_LINES_PER_EPISODE
+        # until there are enough of them, so it may still require tweaking
         logger.warning(
             f"Anime {anime_name} have exceeded the threshold for insertion. "
-            f"It has {len(table)} rows, with the limit being {threshold}."
+            f"It has {len(df)} rows, with the limit being {threshold}."
         )
         return
 
-    df = pd.DataFrame(
-        table, columns=['mal_id', 'episode', 'name', 'quote', 'start_time', 'end_time'])
-    df = df.astype({'mal_id': 'int32', 'episode': 'int32'})
+    no_character_name = int((df['name'] == 'Unknown').sum())
     logger.info(
         f"{len(df) - no_character_name}/{len(df)} quotes with character name.")
 
@@ -464,17 +711,48 @@ def process_data_input(file_path: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
                      f" either str or dict.")
         raise TypeError
 
-    # we accept either a path for the json or the actual json
-    elif isinstance(file_path, str):
+    # we accept either a path for the links (manifest or json) or the actual json
+    if isinstance(file_path, dict):
+        return file_path
+
+    try:
+        if is_manifest(file_path):
+            # parsed once per change of the file (see utils/manifest.py)
+            return read_manifest(file_path)
+
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def read_anime_input(
+    file_path: Union[str, Dict[str, Any]],
+    anime_name: str,
+    languages: Sequence[str] = (DESIRED_SUBS,),
+) -> Dict[str, Any]:
+    """
+    Entry of anime_name (an anime or one of its language_key) from the links on
+    file_path, expanded as in expand_languages. From a manifest, only the line of
+    that anime is read.
+    """
+    if not (isinstance(file_path, str) and is_manifest(file_path)):
+        return expand_languages(process_data_input(file_path), languages)
+
+    for language in languages:
+        suffix = language_key("", language)
+        if not anime_name.endswith(suffix):
+            continue
+
+        anime = anime_name[: len(anime_name) - len(suffix)]
         try:
-            f = open(file_path)
-            data = json.load(f)
-        except Exception:
-            data = {}
-        finally:
-            f.close()
+            anime_info = read_manifest_entry(file_path, anime)
+        except OSError:
+            return {}
+        if anime_info is not None:
+            return expand_languages({anime: anime_info}, [language])
 
-    return data
+    return {}
 
 
 def check_for_id(mal_id: int, members_cut: int) -> bool:
@@ -487,97 +765,36 @@ def check_for_id(mal_id: int, members_cut: int) -> bool:
 
 
 def remove_text_inside_delimiters(input_string: str) -> str:
-    # remove text inside de parenthesis or brackets
-    cleaned_string = re.sub(REMOVE_DELIMITERS_REGEX, '', input_string)
-    # clean extra spaces
-    return re.sub(r'\s{2,}', ' ', cleaned_string)
+    return titles.remove_text_inside_delimiters(input_string)
 
 
 def find_episode_number(input_string: str) -> str:
-    # this method for episode seems to work fine for most cases
-    if not input_string:
-        return ""
-
-    text = remove_text_inside_delimiters(input_string)
-    # match any sequence of 2 to 4 numbers followed by space
-    regex = EPISODE_REGEX
-    matches = re.finditer(regex, text)
-    results = [(match.group(), match.start()) for match in matches]
-    number = ""
-    for res in results:
-        if text[res[1] - 1] in NOT_ALLOWED_CHARACTERS:
-            # the number is probably not an episode number
-            continue
-        else:
-            number = res[0]
-            break
-
-    if not number:
-        # let's try another case (match string like [XY]Z.mkv, XYZ being digits)
-        pattern = r'\s(\d{1,3})\.mkv'
-        match = re.search(pattern, input_string)
-        if match:
-            number = match.group(1)
-
-    # should not happen, but just to make sure
-    if "." in number:
-        # .5 episodes, ignore
-        number = ""
-
-    return number
+    return parse_release_title(input_string).episode
 
 
 def find_season(input_string: str, provider: str) -> str:
-    if not input_string:
-        return ""
-    # try most common first. If not found, try more specifics
-    # first we try "SXYE", where X, Y are 0-9. Ex: "S01E10" should match
-    regex = SEASON_REGEX
-    match = re.search(regex, input_string)
-    if match:
-        return match.group(1)
-
-    # try same logic, but without need to have "E" after number
-    # "S3 bla bla" should match now
-    regex = r'S([0-9]{1,2})'
-    match = re.search(regex, input_string)
-    if match:
-        return match.group(1)
-
-    # the whole above logic can be one for loop, but this is better to explain
-
-    # try specifics for famous providers
-    match provider:
-        case "[Erai-raws]":
-            # try searching for word season
-            res = list(map(lambda x: x.lower(), input_string.split(" ")))
-            if "season" in res:
-                return res[res.index("season") + 1]
-        case _:
-            # can expand
-            return ""
-    # no luck
-    return ""
+    return extract_season(input_string, provider)
 
 
 def remove_special_characters(input_string: str) -> str:
-    pattern = SPECIAL_CHARS_REGEX
-    clean_text = re.sub(pattern, '', input_string)
-
-    # some animes use ! and : to distinguish between seasons
-    # example: nisekoi and nisekoi:
-    # hence, for these symbols, we change to multiples of "_" character
-    for char, new_char in RESERVED_CHARACTERS_REMAP.items():
-        clean_text = clean_text.replace(char, new_char)
-
-    return clean_text
+    return titles.remove_special_characters(input_string)
 
 
 def prepare_text_for_insertion(input_string: str) -> str:
     """
     This is used before writing dataframe to database. This is the last processing step.
     """
-    regex = BRACKETS_REGEX
-    clean_text = re.sub(regex, '', input_string)
+    clean_text = BRACKETS_PATTERN.sub('', input_string)
     clean_text = clean_text.replace("\\N", " ").replace("  ", " ")
     return clean_text
+
+
+def prepare_text_array(texts: Any) -> Any:
+    """
+    Same as prepare_text_for_insertion, for a whole arrow string array at once.
+    """
+    import pyarrow.compute as pc
+
+    clean_text = pc.replace_substring_regex(texts, BRACKETS_REGEX, '')
+    clean_text = pc.replace_substring(clean_text, "\\N", " ")
+    return pc.replace_substring(clean_text, "  ", " ")
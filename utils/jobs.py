@@ -0,0 +1,283 @@
+"""
+Durable crawl queue on postgres (raw_quotes.crawl_jobs), so any number of worker
+processes/nodes can share a crawl (see crawl_worker on main.py).
+
+Jobs are unique by (job_type, url). Workers claim them with FOR UPDATE SKIP LOCKED
+and hold a lease, extended by a heartbeat while the job runs: the job of a worker
+that died becomes claimable again once its lease expires. Failed jobs are retried
+(with exponential backoff) until max_attempts.
+"""
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from psycopg2.extras import Json
+
+from .constants import (
+    JOB_HEARTBEAT_SECONDS,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_PRIORITIES,
+    JOB_RETRY_WAIT,
+)
+from .queries import (
+    query_claim_jobs,
+    query_complete_job,
+    query_create_crawl_jobs,
+    query_enqueue_job,
+    query_fail_expired_jobs,
+    query_fail_job,
+    query_heartbeat_job,
+    query_job,
+    query_job_children,
+    query_job_counts,
+    query_lock_job,
+    query_pending_children,
+)
+
+
+@dataclass(frozen=True)
+class Job:
+    id: int
+    job_type: str
+    url: str
+    payload: Dict[str, Any]
+    parent_id: Optional[int]
+    attempts: int
+
+
+def default_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _execute(con: Any, query: str, params: Dict[str, Any], schema: str) -> Any:
+    cursor = con.cursor()
+    cursor.execute(query % {"schema": schema}, params)
+    return cursor
+
+
+def create_jobs_table(con: Any, schema: str = "raw_quotes") -> None:
+    with con.cursor() as cursor:
+        cursor.execute(query_create_crawl_jobs % {"schema": schema})
+
+
+def enqueue_job(
+    con: Any,
+    job_type: str,
+    url: str,
+    payload: Optional[Dict[str, Any]] = None,
+    parent_id: Optional[int] = None,
+    refresh: bool = False,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    schema: str = "raw_quotes",
+) -> Optional[int]:
+    """
+    Adds a job to the queue, unless there is already one with the same type and url.
+    With refresh=True, a finished (done or failed) job is put back on the queue.
+
+    Returns:
+    - Optional[int]: The id of the queued job, None if it was already queued.
+    """
+    params = {
+        "job_type": job_type,
+        "url": url,
+        "payload": Json(payload or {}),
+        "parent_id": parent_id,
+        "priority": JOB_PRIORITIES[job_type],
+        "max_attempts": max_attempts,
+        "refresh": refresh,
+    }
+    with _execute(con, query_enqueue_job, params, schema) as cursor:
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+def claim_jobs(
+    con: Any,
+    worker: str,
+    job_types: Optional[List[str]] = None,
+    limit: int = 1,
+    lease: int = JOB_LEASE_SECONDS,
+    schema: str = "raw_quotes",
+) -> List[Job]:
+    """
+    Claims up to limit jobs (highest priority first). Rows locked by other workers
+    are skipped instead of waited for, so concurrent workers never get the same job.
+    """
+    with _execute(con, query_fail_expired_jobs, {}, schema):
+        pass
+
+    params = {
+        "worker": worker,
+        "job_types": job_types or list(JOB_PRIORITIES),
+        "limit": limit,
+        "lease": lease,
+    }
+    with _execute(con, query_claim_jobs, params, schema) as cursor:
+        rows = cursor.fetchall()
+
+    return sorted((Job(*row) for row in rows), key=lambda job: job.id)
+
+
+def heartbeat_job(
+    con: Any,
+    job: Job,
+    worker: str,
+    lease: int = JOB_LEASE_SECONDS,
+    schema: str = "raw_quotes",
+) -> bool:
+    """
+    Extends the lease of a running job. False means the lease was lost.
+    """
+    params = {"id": job.id, "worker": worker, "lease": lease}
+    with _execute(con, query_heartbeat_job, params, schema) as cursor:
+        return cursor.rowcount == 1
+
+
+def _finish_job(
+    con: Any, job: Job, query: str, params: Dict[str, Any], schema: str
+) -> Optional[int]:
+    """
+    Runs query (which ends the job and returns its new status) and checks if its
+    family is finished. Ending the parent or a child is serialized by a lock on
+    the parent row, so exactly one of them sees the whole family finished.
+    """
+    family_id = job.parent_id or job.id
+
+    with con.cursor() as cursor:
+        cursor.execute("BEGIN;")
+        try:
+            parent_status = None
+            if job.parent_id:
+                cursor.execute(
+                    query_lock_job % {"schema": schema}, {"id": job.parent_id}
+                )
+                cursor.execute(query_job % {"schema": schema}, {"id": job.parent_id})
+                parent_status = cursor.fetchone()[1]
+
+            cursor.execute(query % {"schema": schema}, params)
+            row = cursor.fetchone()
+            status = row[0] if row else None
+
+            cursor.execute(
+                query_pending_children % {"schema": schema}, {"parent_id": family_id}
+            )
+            pending = cursor.fetchone()[0]
+            cursor.execute("COMMIT;")
+        except Exception:
+            cursor.execute("ROLLBACK;")
+            raise
+
+    # a child that failed for good ends its family as well, a failed parent does not
+    family_status = parent_status or status
+    if status in ("done", "failed") and family_status == "done" and pending == 0:
+        return family_id
+    return None
+
+
+def complete_job(
+    con: Any,
+    job: Job,
+    worker: str,
+    result: Optional[Dict[str, Any]] = None,
+    schema: str = "raw_quotes",
+) -> Optional[int]:
+    """
+    Marks the job as done, storing its result.
+
+    Jobs may have children (e.g. the episode pages of an anime). Completing the
+    parent or a child is serialized by a lock on the parent row, so exactly one of
+    them sees the whole family finished.
+
+    Returns:
+    - Optional[int]: The id of the parent job (or of the job itself, if it has no
+        parent) when it is done and none of its children is pending anymore.
+    """
+    params = {"id": job.id, "worker": worker, "result": Json(result or {})}
+    return _finish_job(con, job, query_complete_job, params, schema)
+
+
+def fail_job(
+    con: Any,
+    job: Job,
+    worker: str,
+    error: str,
+    wait: float = JOB_RETRY_WAIT,
+    schema: str = "raw_quotes",
+) -> Optional[int]:
+    """
+    Puts the job back on the queue (available after wait * 2^(attempts-1) seconds),
+    or marks it as failed if it has no attempts left.
+
+    Returns:
+    - Optional[int]: As complete_job, the id of the parent job when this child
+        failed for good and none of its siblings is pending anymore.
+    """
+    params = {"id": job.id, "worker": worker, "error": error[:1000], "wait": wait}
+    return _finish_job(con, job, query_fail_job, params, schema)
+
+
+def get_job(
+    con: Any, job_id: int, schema: str = "raw_quotes"
+) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """
+    Returns:
+    - Tuple[str, str, Optional[Dict[str, Any]]]: The url, status and result of the job.
+    """
+    with _execute(con, query_job, {"id": job_id}, schema) as cursor:
+        return cursor.fetchone()
+
+
+def get_job_children(
+    con: Any, parent_id: int, schema: str = "raw_quotes"
+) -> List[Tuple[str, str, Optional[Dict[str, Any]]]]:
+    with _execute(con, query_job_children, {"parent_id": parent_id}, schema) as cursor:
+        return cursor.fetchall()
+
+
+def get_job_counts(con: Any, schema: str = "raw_quotes") -> List[Tuple[str, str, int]]:
+    """
+    Amount of jobs per type and status, e.g. [("anime", "done", 20), ...].
+    """
+    with _execute(con, query_job_counts, {}, schema) as cursor:
+        return cursor.fetchall()
+
+
+@contextmanager
+def heartbeat(
+    connect: Callable[[], Any],
+    job: Job,
+    worker: str,
+    interval: float = JOB_HEARTBEAT_SECONDS,
+    lease: int = JOB_LEASE_SECONDS,
+    schema: str = "raw_quotes",
+) -> Iterator[threading.Event]:
+    """
+    Extends the lease of job every interval seconds while the block runs, on its
+    own connection. The yielded event is set if the lease was lost (the job may be
+    running on another worker by then).
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def beat() -> None:
+        con = connect()
+        try:
+            while not stop.wait(interval):
+                if not heartbeat_job(con, job, worker, lease, schema):
+                    lost.set()
+                    break
+        finally:
+            con.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,165 @@
+import json
+import os
+from functools import lru_cache
+from typing import Any, Iterator, Optional
+
+from .constants import (
+    MANIFEST_CACHE_SIZE,
+    MANIFEST_INDEX_SUFFIX,
+    MANIFEST_SUFFIX,
+    MANIFESTS_FOLDER,
+)
+
+# (offset, length) of the line of each anime
+Offsets = dict[str, tuple[int, int]]
+
+
+def manifest_path(name: str, folder: str = MANIFESTS_FOLDER) -> str:
+    return os.path.join(folder, name + MANIFEST_SUFFIX)
+
+
+def is_manifest(path: str) -> bool:
+    return path.endswith(MANIFEST_SUFFIX)
+
+
+def list_manifests(folder: str = MANIFESTS_FOLDER) -> list[str]:
+    """
+    Manifests of folder, sorted by name. Plain .json link files (written before
+    manifests existed) are listed as well, process_data_input reads both, unless a
+    manifest of the same name replaced them (page_1.json is skipped when
+    page_1.ndjson exists).
+    """
+    if not os.path.isdir(folder):
+        return []
+
+    names = set(os.listdir(folder))
+    return [
+        os.path.join(folder, name)
+        for name in sorted(names)
+        if name.endswith(MANIFEST_SUFFIX)
+        or (
+            name.endswith(".json")
+            and name[: -len(".json")] + MANIFEST_SUFFIX not in names
+        )
+    ]
+
+
+def _signature(path: str) -> tuple[int, int]:
+    # cached reads are keyed by it, so any write to the manifest invalidates them
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _scan(path: str) -> Iterator[tuple[str, int, bytes]]:
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            # a line without newline is an interrupted append, ignored
+            if line.endswith(b"\n") and line.strip():
+                anime = next(iter(json.loads(line)))
+                yield anime, offset, line
+            offset += len(line)
+
+
+def _write_index(path: str, size: int, offsets: Offsets) -> None:
+    index_path = path + MANIFEST_INDEX_SUFFIX
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"size": size, "animes": offsets}, f)
+    os.replace(tmp_path, index_path)
+
+
+def _read_index(path: str) -> Optional[tuple[int, Offsets]]:
+    index_path = path + MANIFEST_INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return index["size"], {
+        anime: (offset, length) for anime, (offset, length) in index["animes"].items()
+    }
+
+
+def write_manifest(path: str, data: dict[str, Any], append: bool = True) -> None:
+    """
+    Writes each anime of data as one line of the manifest ({anime: info}) and
+    updates its offset index (path + MANIFEST_INDEX_SUFFIX).
+    Lines are only appended: writing an anime again adds a new line and points the
+    index to it. With append=False, the manifest is started over (the page
+    manifests of get_links_from_web are, so each holds the latest crawl of its page).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    offsets: Offsets = {}
+    if append and os.path.exists(path):
+        offsets = read_offsets(path).copy()
+    elif os.path.exists(path):
+        os.remove(path)
+
+    with open(path, "ab") as f:
+        # drops the tail of an interrupted append, if any
+        offset = max((start + length for start, length in offsets.values()), default=0)
+        f.truncate(offset)
+        for anime, anime_info in data.items():
+            line = (json.dumps({anime: anime_info}, ensure_ascii=False) + "\n").encode()
+            f.write(line)
+            offsets[anime] = (offset, len(line))
+            offset += len(line)
+
+    _write_index(path, offset, offsets)
+
+
+def read_offsets(path: str) -> Offsets:
+    return _cached_offsets(path, _signature(path))
+
+
+@lru_cache(maxsize=MANIFEST_CACHE_SIZE)
+def _cached_offsets(path: str, signature: tuple[int, int]) -> Offsets:
+    index = _read_index(path)
+    if index is not None and index[0] == signature[1]:
+        return index[1]
+
+    # missing or stale index (e.g. interrupted write), rebuilt from the lines
+    offsets = {anime: (offset, len(line)) for anime, offset, line in _scan(path)}
+    _write_index(path, signature[1], offsets)
+    return offsets
+
+
+def read_manifest_entry(path: str, anime: str) -> Optional[dict[str, Any]]:
+    """
+    Info of a single anime of the manifest, read from its offset (no full parse).
+    Results are cached until the manifest changes, so they must not be modified.
+    """
+    return _cached_entry(path, _signature(path), anime)
+
+
+@lru_cache(maxsize=MANIFEST_CACHE_SIZE * 16)
+def _cached_entry(
+    path: str, signature: tuple[int, int], anime: str
+) -> Optional[dict[str, Any]]:
+    position = _cached_offsets(path, signature).get(anime)
+    if position is None:
+        return None
+
+    offset, length = position
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.read(length))[anime]
+
+
+def read_manifest(path: str) -> dict[str, Any]:
+    """
+    Every anime of the manifest (the latest line of each). Results are cached
+    until the manifest changes, so they must not be modified.
+    """
+    return _cached_manifest(path, _signature(path))
+
+
+@lru_cache(maxsize=MANIFEST_CACHE_SIZE)
+def _cached_manifest(path: str, signature: tuple[int, int]) -> dict[str, Any]:
+    data = {}
+    with open(path, "rb") as f:
+        for anime, (offset, length) in _cached_offsets(path, signature).items():
+            f.seek(offset)
+            data[anime] = json.loads(f.read(length))[anime]
+    return data
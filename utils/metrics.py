@@ -0,0 +1,206 @@
+import bisect
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+from urllib.parse import urlsplit
+
+from .constants import (
+    LATENCY_BUCKETS,
+    LISTING_PATH,
+    METRICS_FOLDER,
+    METRICS_PREFIX,
+)
+
+Labels = tuple[tuple[str, str], ...]
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _labels(labels: dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    items = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def url_class(url: str) -> str:
+    """
+    Groups urls by the kind of page they point to, to keep metric labels bounded.
+    """
+    path = urlsplit(url).path
+    if path.rstrip("/").endswith(LISTING_PATH):
+        return "listing"
+    if "/series/" in path:
+        return "series"
+    if "/view/" in path:
+        return "episode"
+    if "/attach/" in path or path.endswith(".xz"):
+        return "subtitle"
+    return "other"
+
+
+class Metrics:
+    """
+    Process wide counters and histograms, exported at the end of a flow run
+    as a prefect artifact and as a prometheus text file.
+    """
+
+    def __init__(self, buckets: list[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = sorted(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters: dict[str, dict[Labels, float]] = {}
+            self.histograms: dict[str, dict[Labels, dict[str, Any]]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.setdefault(
+                key, {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            )
+            histogram["buckets"][bisect.bisect_left(self.buckets, value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                metric = f"{METRICS_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in series.items():
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+            for name, series in sorted(self.histograms.items()):
+                metric = f"{METRICS_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, histogram in series.items():
+                    cumulative = 0
+                    bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram["buckets"]):
+                        cumulative += count
+                        bucket_labels = _format_labels(labels, 'le="%s"' % bound)
+                        lines.append(f"{metric}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+                    lines.append(
+                        f"{metric}_count{_format_labels(labels)} {histogram['count']}"
+                    )
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[dict[str, Any]]:
+        """
+        One row per metric/label set, used for the prefect table artifact.
+        """
+        rows = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                for labels, value in series.items():
+                    rows.append(
+                        {"metric": name, "labels": _format_labels(labels), "value": value}
+                    )
+
+            for name, series in sorted(self.histograms.items()):
+                for labels, histogram in series.items():
+                    count = histogram["count"]
+                    rows.append(
+                        {
+                            "metric": name,
+                            "labels": _format_labels(labels),
+                            "value": round(histogram["sum"], 3),
+                            "count": count,
+                            "mean": round(histogram["sum"] / count, 4) if count else 0,
+                        }
+                    )
+
+            # rows/second written per sink
+            written = self.counters.get("rows_written_total", {})
+            durations = self.histograms.get("write_seconds", {})
+            for labels, rows_written in written.items():
+                seconds = durations.get(labels, {}).get("sum", 0)
+                if seconds:
+                    rows.append(
+                        {
+                            "metric": "rows_written_per_second",
+                            "labels": _format_labels(labels),
+                            "value": round(rows_written / seconds, 1),
+                        }
+                    )
+
+        return rows
+
+    def write_prometheus(self, file_name: str, folder: str = METRICS_FOLDER) -> str:
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, file_name)
+        # textfile collectors may read at any time, so write then rename
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(path + ".tmp", path)
+        return path
+
+
+METRICS = Metrics()
+
+
+def publish_metrics(flow_name: str) -> None:
+    """
+    Exposes the metrics collected during the run as a prefect table artifact
+    and as a prometheus text file (metrics/<flow_name>.prom).
+    """
+    # prefect is slow to import, keep it out of the commands that do not run flows
+    from prefect.artifacts import create_table_artifact
+
+    key = flow_name.lower().replace("_", "-") + "-metrics"
+    create_table_artifact(
+        key=key,
+        table=METRICS.summary(),
+        description=f"Per-stage metrics of the {flow_name} run.",
+    )
+    METRICS.write_prometheus(f"{flow_name}.prom")
+
+
+def flow_metrics(fn: F) -> F:
+    """
+    Wraps a flow so its metrics are collected from scratch and published (see
+    publish_metrics) when it ends, also when it fails.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        METRICS.reset()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            try:
+                publish_metrics(fn.__name__)
+            except Exception as err:
+                # never hides the outcome of the run itself
+                logging.getLogger(__name__).warning(
+                    f"Could not publish the metrics of {fn.__name__}: {err!r}"
+                )
+
+    return wrapper  # type: ignore[return-value]
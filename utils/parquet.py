@@ -0,0 +1,163 @@
+"""
+Parquet exports of the quote tables. Kept apart from the database writers, so
+exporting needs pandas and pyarrow but neither prefect nor the crawler.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Literal
+
+import pandas as pd
+
+from .constants import PARQUET_MANIFEST, PARQUET_ROOT
+from .metrics import METRICS
+
+# setup logger (handlers are configured by the entry point, see cli.py)
+logger = logging.getLogger(__name__)
+
+
+def _read_manifest(root: str) -> dict[str, Any]:
+    path = os.path.join(root, PARQUET_MANIFEST)
+    if not os.path.exists(path):
+        return {"files": []}
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(root: str, manifest: dict[str, Any]) -> None:
+    # write to a temporary file first so readers never see a half written manifest
+    path = os.path.join(root, PARQUET_MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def write_parquet(
+    df: pd.DataFrame,
+    table_name: str,
+    root: str = PARQUET_ROOT,
+    if_exists: Literal["replace", "append"] = "append",
+    clear_songs: bool = True,
+) -> int:
+    """
+    Exports quotes to a parquet dataset partitioned by mal_id and table (hive
+    style, e.g. exports/quotes/mal_id=52991/table=sousou_no_frieren/part-<timestamp>.parquet),
+    so the tables of each language of an anime (see language_key) are kept apart.
+    Inside each file, rows are sorted by episode and every episode is written as
+    its own row group, so readers filtering by episode only touch the row groups
+    they need.
+
+    Parameters:
+    - df (pd.DataFrame): Quotes dataframe, as built by build_df_from_ass_files/merge_quotes.
+    - table_name (str): Name of the anime (same as the postgres table), stored on the manifest.
+    - root (str): Root folder of the dataset. Default is PARQUET_ROOT.
+    - if_exists (str): "append" adds a new part file to the partition,
+        "replace" removes the current files of table_name first (the other tables
+        of the same mal_id are left as they are). Default is "append".
+    - clear_songs (bool): Same as in write_postgres. Default is True.
+
+    Returns:
+    - int: Number of rows written.
+    """
+    # pyarrow is only needed for exports, keep it out of the import path of other commands
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if df.empty:
+        logger.info("Nothing to be done, empty dataframe.")
+        return 0
+
+    if clear_songs:
+        from .helpers import collapse_songs
+
+        df = collapse_songs(df)
+
+    start = time.perf_counter()
+    os.makedirs(root, exist_ok=True)
+    manifest = _read_manifest(root)
+    written = 0
+    now = datetime.now()
+
+    for mal_id, partition in df.groupby("mal_id", sort=False):
+        partition_dir = os.path.join(root, f"mal_id={mal_id}", f"table={table_name}")
+
+        if if_exists == "replace":
+            logger.info(f"Removing current parquet files of {table_name} ({mal_id})...")
+            if os.path.exists(partition_dir):
+                shutil.rmtree(partition_dir)
+            # also the files of older exports, written to mal_id=<id> directly
+            kept = []
+            for entry in manifest["files"]:
+                if entry["mal_id"] == mal_id and entry["table_name"] == table_name:
+                    path = os.path.join(root, entry["path"])
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    kept.append(entry)
+            manifest["files"] = kept
+
+        os.makedirs(partition_dir, exist_ok=True)
+        file_name = f"part-{now.strftime('%Y%m%d%H%M%S%f')}.parquet"
+        file_path = os.path.join(partition_dir, file_name)
+
+        # mal_id (and the table) are already encoded in the folder names (hive partitioning)
+        partition = partition.drop(columns=["mal_id"])
+        # stable sort keeps the original quote order inside each episode
+        partition = partition.sort_values("episode", kind="stable")
+        table = pa.Table.from_pandas(partition, preserve_index=False)
+
+        episodes = []
+        with pq.ParquetWriter(file_path, table.schema) as writer:
+            for episode, episode_df in partition.groupby("episode", sort=False):
+                writer.write_table(
+                    pa.Table.from_pandas(
+                        episode_df, schema=table.schema, preserve_index=False
+                    )
+                )
+                episodes.append(int(episode))
+
+        manifest["files"].append(
+            {
+                "path": os.path.relpath(file_path, root).replace(os.sep, "/"),
+                "table_name": table_name,
+                "mal_id": int(mal_id),
+                "rows": len(partition),
+                "episodes": episodes,
+                "written_at": now.isoformat(),
+            }
+        )
+        written += len(partition)
+
+    _write_manifest(root, manifest)
+    METRICS.observe("write_seconds", time.perf_counter() - start, sink="parquet")
+    METRICS.inc("rows_written_total", written, sink="parquet")
+    logger.info(f"Exported {written} rows of {table_name} to parquet dataset {root}.")
+
+    return written
+
+
+def export_tables(
+    con: Any,
+    table_names: list[str],
+    schema: str = "raw_quotes",
+    root: str = PARQUET_ROOT,
+) -> int:
+    """
+    Replaces the parquet partitions of each table (see write_parquet) with its
+    current quotes on database (either sink).
+
+    Returns:
+    - int: Number of rows written.
+    """
+    written = 0
+    for table_name in table_names:
+        df = pd.read_sql(sql=f"SELECT * FROM {schema}.{table_name};", con=con)
+        written += write_parquet(
+            df=df, table_name=table_name, root=root, if_exists="replace", clear_songs=False
+        )
+    return written
@@ -1,6 +1,7 @@
 import logging
 import os
-from typing import Any, Dict, List, Optional, Tuple, Union
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import requests
 from bs4 import BeautifulSoup
@@ -8,50 +9,75 @@ from bs4.element import Tag
 from prefect import get_run_logger
 
 from .constants import (
+    BASE_URL,
+    CORRUPTED_DOWNLOAD_RETRIES,
     DESIRED_SUBS,
-    FORMAT,
-    MAIN_URL,
+    DOWNLOAD_CHUNK_SIZE,
+    LISTING_PATH,
     REMOVE_REPACK,
 )
 from .helpers import (
     convert_title_to_size,
     create_data_folder,
     create_folders_for_anime,
+    expand_languages,
+    filter_ass_subs,
     filter_subs,
-    find_episode_number,
     get_mal_id,
-    get_provider,
     process_data_input,
-    remove_special_characters,
+    rebase_url,
 )
+from .archive import SubtitleArchive
+from .metrics import METRICS
 from .readers import read_url
+from .storage import (
+    BlobStore,
+    CorruptedFileError,
+    read_episode_index,
+    write_episode_index,
+    write_stream,
+)
+from .titles import normalize_title, parse_release_title
 
-# setup logger
+# setup logger (handlers are configured by the entry point, see cli.py)
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    format=FORMAT, level=logging.INFO, handlers=[logging.StreamHandler()]
-)
 
 
-def get_animes_finished_from_page(page: int = 1) -> List[Optional[Tag]]:
+def get_listing_entries(page: int = 1, base_url: str = BASE_URL) -> Optional[List[Tag]]:
+    """
+    Every entry of a listing page, finished or not.
+
+    Returns:
+    - Optional[List[Tag]]: The entries, empty past the last page of the listing.
+        None if the page could not be requested.
+    """
     logger = get_run_logger()
-    url = MAIN_URL + f"?page={page}"
-    finished_entries = []
+    url = base_url + LISTING_PATH + f"?page={page}"
     response = read_url(url=url)
 
     if not response:
-        return []
+        return None
 
     data = response.text
     soup = BeautifulSoup(data, "html.parser")
-
-    for div in soup.find_all("div", class_="home_list_entry"):
-        if "(finished)" in div.text or "(movie)" in div.text:
-            finished_entries.append(div)
+    entries = soup.find_all("div", class_="home_list_entry")
 
     logger.info(f"Processed page {page} request.")
 
-    return finished_entries
+    return entries
+
+
+def filter_finished_entries(entries: List[Tag]) -> List[Tag]:
+    return [
+        div for div in entries if "(finished)" in div.text or "(movie)" in div.text
+    ]
+
+
+def get_animes_finished_from_page(
+    page: int = 1, base_url: str = BASE_URL
+) -> List[Optional[Tag]]:
+    entries = get_listing_entries(page=page, base_url=base_url)
+    return filter_finished_entries(entries or [])
 
 
 def get_batch_options_and_episode_count(
@@ -68,9 +94,17 @@ def get_batch_options_and_episode_count(
     parent_divs = soup.find_all("div", class_="home_list_entry")
 
     for candidate in parent_divs:
-        # skip all batches
+        batch_obj = candidate.find("div", class_="link").find("a")
+        provider = parse_release_title(batch_obj.text).provider
+        if not provider:
+            continue
+
+        # batches are not downloaded, so their size does not matter.
+        # their pages may list the subtitles of every episode (see get_batch_subtitle_links)
         is_batch = candidate.find("div", class_="links").find("em")
         if is_batch:
+            info = batch_options.setdefault(provider, {"amount": 0, "trial_link": ""})
+            info.setdefault("batch_links", []).append(batch_obj.get("href"))
             continue
 
         # skip options > 16 GB
@@ -79,18 +113,15 @@ def get_batch_options_and_episode_count(
         if size_in_gb > 16.0:
             continue
 
-        batch_obj = candidate.find("div", class_="link").find("a")
-        provider = get_provider(batch_obj.text)
-        if not provider:
-            continue
-
         if provider in batch_options:
             batch_options[provider]["amount"] += 1
+            if not batch_options[provider]["trial_link"]:
+                batch_options[provider]["trial_link"] = batch_obj.get("href")
         else:
             batch_options[provider] = {"amount": 1, "trial_link": batch_obj.get("href")}
 
     # not a single option below 16gb for this anime
-    if not batch_options:
+    if not any(info["amount"] for info in batch_options.values()):
         logger.warning(f"No available non-batch file below 16GB for anime {title}.")
 
     # get episode count
@@ -111,46 +142,112 @@ def get_batch_options_and_episode_count(
     return batch_options, int(episode_count), mal_id
 
 
-def get_subtitle_links(link: str, desired_subs: str = DESIRED_SUBS) -> Tuple[str, str]:
-    logger = get_run_logger()
-    sub_info, sub_link = "", ""
+def get_subtitle_tables(link: str) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Parses a release page. Each table of the page describes a file (a single one
+    for episode releases, one per file for batches).
 
+    Returns:
+    - List[Tuple[str, Dict[str, str]]]: For every table with a Subtitles row,
+        the file name and its subtitles (language -> link).
+    """
+    logger = get_run_logger()
     if not link:
-        return "", ""
+        return []
 
     res = read_url(url=link)
     if not res:
-        return "", ""
+        return []
 
     soup = BeautifulSoup(res.text, "html.parser")
     content = soup.find("div", id="content")
     if not content:
         # no divs implies no subtitles
         logger.warning(f"Could not get subtitles for link {link}.")
-        return "", ""
+        return []
 
     tables = content.find_all("table", recursive=False)
     if not tables:
         # no tables implies no subtitles
         logger.warning(f"No table found on link {link}.")
-        return "", ""
+        return []
 
+    files = []
     for table in tables:
-        # if last row has Subtitles as header, then page may have download links
-        last_row = table.find_all("tr", recursive=False)[-1]
+        rows = table.find_all("tr", recursive=False)
+        if not rows:
+            continue
 
+        # if last row has Subtitles as header, then page may have download links
+        last_row = rows[-1]
         if last_row.find("th").text == "Subtitles":
-            # now, we may or may not have eng subs
-            target_row = last_row
-            sub_options = parse_subtitles(target_row.find("td"))
+            file_cell = rows[0].find("td")
+            file_name = file_cell.text.strip() if file_cell else ""
+            files.append((file_name, parse_subtitles(last_row.find("td"))))
+
+    return files
+
+
+def get_subtitle_options(link: str) -> Dict[str, str]:
+    """
+    Every .ass.xz subtitle (language -> link) of the file of a release page.
+    """
+    for _, sub_options in get_subtitle_tables(link)[:1]:
+        return filter_ass_subs(sub_options)
+
+    return dict()
+
+
+def get_subtitle_links(link: str, desired_subs: str = DESIRED_SUBS) -> Tuple[str, str]:
+    # now, we may or may not have eng subs
+    # check for en subs and see if has .ass downloadable file
+    return filter_subs(link=link, subs=get_subtitle_options(link), target_lang=desired_subs)
+
+
+def get_batch_subtitle_links(
+    links: List[str], desired_subs: str = DESIRED_SUBS
+) -> Dict[str, Dict[str, str]]:
+    """
+    Collects the subtitles of every file listed on batch release pages, so a whole
+    season needs one request instead of one per episode.
+
+    Parameters:
+    - links (List[str]): Batch release pages (of the same provider).
+    - desired_subs (str, optional): The desired subtitle language. Default is "eng".
+
+    Returns:
+    - Dict[str, Dict[str, str]]: Episode number -> entry with link_title, link_url,
+        sub_info, sub_link and subs (same shape as get_all_subtitles_info entries),
+        for every file with .ass subtitles in any language.
+    """
+    logger = get_run_logger()
+    episodes = {}
+
+    for link in links:
+        files = get_subtitle_tables(link)
+        for file_name, sub_options in files:
+            episode_number = parse_release_title(file_name).episode
+            if not episode_number or episode_number in episodes:
+                continue
 
-            # check for en subs and see if has .ass downloadable file
+            sub_options = filter_ass_subs(sub_options)
+            if not sub_options:
+                continue
             sub_info, sub_link = filter_subs(
                 link=link, subs=sub_options, target_lang=desired_subs
             )
-            break
 
-    return sub_info, sub_link
+            episodes[episode_number] = {
+                "link_title": file_name,
+                "link_url": link,
+                "sub_info": sub_info,
+                "sub_link": sub_link,
+                "subs": sub_options,
+            }
+
+        logger.info(f"Got {len(episodes)} episode subtitles from batch {link}.")
+
+    return episodes
 
 
 def parse_subtitles(subs: Optional[Tag]) -> Dict[str, str]:
@@ -200,24 +297,47 @@ def get_all_links_from_provider(
     return episode_links, has_entries
 
 
+def _subtitle_key(sub_link: str, subs: Dict[str, str]) -> str:
+    # identifies the subtitle of an episode, even without a desired_subs one
+    if sub_link:
+        return sub_link
+    return next(iter(filter_ass_subs(subs).values()), "")
+
+
 def get_all_subtitles_info(
     title: str,
     anime_info: dict[str, Any],
     provider_name: str,
     desired_subs: str = DESIRED_SUBS,
+    batch_subs: Optional[Dict[str, Dict[str, str]]] = None,
+    page_subs: Optional[Dict[str, Dict[str, str]]] = None,
 ) -> List[Dict[str, str]]:
+    """
+    Gets the subtitle link of every episode entry of anime_info. Episodes found on
+    the provider batch pages (batch_subs, see get_batch_subtitle_links) do not need
+    their episode page to be requested, the others fall back to it.
+    Besides the desired_subs subtitle (sub_info/sub_link), the .ass subtitles of every
+    language are kept in "subs", see expand_languages. Episodes are kept as long as
+    they have a subtitle in any language (sub_info/sub_link are empty if none is in
+    desired_subs).
+    Episode pages already requested (e.g. by crawl queue workers) can be given as
+    page_subs (link_url -> subtitles, see get_subtitle_options).
+    """
     logger = get_run_logger()
     final_object = []
     already_obtained_links = set()
     already_obtained_episodes = set()
     episode_count = anime_info["metadata"]["episode_count"]
     total_to_gather = len(anime_info["data"])
+    batch_subs = batch_subs or {}
+    page_subs = page_subs or {}
 
-    if total_to_gather == 0:
+    if total_to_gather == 0 and not batch_subs:
         logger.info(f"Anime {title} does not have subtitles available.")
         return []
 
     logger.info(f"Gathering subtitle links for anime {title}...")
+    from_batches = 0
 
     for idx, item in enumerate(anime_info["data"]):
         if ((idx + 1) % 10) == 0 or (idx + 1) == total_to_gather:
@@ -233,19 +353,31 @@ def get_all_subtitles_info(
         link_url = item.get("link_url", "")
         link_title = item.get("link_title", "")
 
-        sub_info, sub_link = get_subtitle_links(link_url, desired_subs=desired_subs)
-
-        # skip repeated episodes and episodes without subs
-        if sub_link in already_obtained_links or not sub_link:
-            continue
-
-        episode_number = find_episode_number(link_title)
+        # already parsed (and cached) when filtering the provider links
+        episode_number = parse_release_title(link_title, provider_name).episode
         # season = find_season(link_title, provider_name)
 
         if episode_number in already_obtained_episodes:
             # maybe duplicate link
             continue
 
+        if episode_number in batch_subs:
+            sub_options = batch_subs[episode_number]["subs"]
+            from_batches += 1
+        elif link_url in page_subs:
+            sub_options = page_subs[link_url]
+        else:
+            sub_options = get_subtitle_options(link_url)
+
+        sub_info, sub_link = filter_subs(
+            link=link_url, subs=sub_options, target_lang=desired_subs
+        )
+        subtitle = _subtitle_key(sub_link, sub_options)
+
+        # skip repeated episodes and episodes without subs (in any language)
+        if not subtitle or subtitle in already_obtained_links:
+            continue
+
         if not episode_number:
             if episode_count == 1:
                 # assuming it is a movie, so set ep to "1"
@@ -259,17 +391,70 @@ def get_all_subtitles_info(
 
         item["sub_link"] = sub_link
         item["sub_info"] = sub_info
+        item["subs"] = sub_options
         item["episode_number"] = episode_number
         # item["season"] = season
         final_object.append(item)
-        already_obtained_links.add(sub_link)
+        already_obtained_links.add(subtitle)
+        already_obtained_episodes.add(episode_number)
+
+    # episodes only available on batches
+    for episode_number, batch_item in sorted(batch_subs.items()):
+        if len(final_object) >= episode_count:
+            break
+        if episode_number in already_obtained_episodes:
+            continue
+        subtitle = _subtitle_key(batch_item["sub_link"], batch_item["subs"])
+        if subtitle in already_obtained_links:
+            continue
+
+        final_object.append({**batch_item, "episode_number": episode_number})
+        already_obtained_links.add(subtitle)
         already_obtained_episodes.add(episode_number)
+        from_batches += 1
+
+    if from_batches:
+        logger.info(f"{from_batches} episode subtitles were taken from batch releases.")
 
     return final_object
 
 
-def get_subtitle_file(link: str) -> Optional[requests.Response]:
-    response = read_url(url=link)
+class _NotModified:
+    def __repr__(self) -> str:
+        return "NOT_MODIFIED"
+
+
+# returned by get_subtitle_file when the stored file is still current
+NOT_MODIFIED = _NotModified()
+
+
+def get_subtitle_file(
+    link: str, validators: Optional[Dict[str, Any]] = None
+) -> Union[requests.Response, _NotModified, None]:
+    """
+    Downloads the subtitle file. If validators (as stored by file_validators) are
+    given, the request is conditional and NOT_MODIFIED is returned when the file
+    did not change (a 304 from the server). Without ETag/Last-Modified, a HEAD
+    request compares the size first, and an equal Content-Length also counts as
+    not modified.
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        if not headers and validators.get("size"):
+            head = read_url(url=link, method="HEAD")
+            length = head.headers.get("Content-Length") if head else None
+            if length and int(length) == validators["size"]:
+                return NOT_MODIFIED
+
+    response = read_url(url=link, headers=headers or None, stream=True)
+    if response is not None and response.status_code == 304:
+        response.close()
+        return NOT_MODIFIED
     # logger.warning(
     #     f"Error when downloading file from link: {link}. (attempt {attempt+1})"
     # )
@@ -277,35 +462,95 @@ def get_subtitle_file(link: str) -> Optional[requests.Response]:
     return response
 
 
-def save_subtitle_file(response: Optional[requests.Response], file_path: str) -> bool:
-    completed = False
+def file_validators(response: requests.Response, size: int) -> Dict[str, Any]:
+    """
+    What we keep from a download to revalidate it later (see get_subtitle_file).
+    """
+    return {
+        "etag": response.headers.get("ETag", ""),
+        "last_modified": response.headers.get("Last-Modified", ""),
+        "size": size,
+    }
+
+
+def save_subtitle_file(
+    response: Optional[requests.Response],
+    file_path: str,
+    store: Optional[BlobStore] = None,
+    archive: Optional[SubtitleArchive] = None,
+) -> Optional[Tuple[str, int]]:
+    """
+    Streams the downloaded file (in chunks) to a temporary file, checking the .xz
+    integrity on the way, then moves it in place. When a store is given, the file
+    goes to it and file_path becomes a link to the blob. When an archive is given,
+    the file is appended to it instead (as a member named like the file).
+
+    Returns:
+    - Optional[Tuple[str, int]]: sha256 and size of the file, None on failure.
+        Raises CorruptedFileError if the file is truncated or corrupted.
+    """
+    saved = None
     # bad request, did not got file
     if not response:
-        return completed
+        return saved
 
+    filename = file_path.split("/")[-1]
     # proceed if request is successful
     if response.status_code == 200:
-        filename = file_path.split("/")[-1]
-        with open(file_path, "wb") as file:
-            # write response object to file
-            file.write(response.content)
-            logger.debug(f"{filename} downloaded successfully.")
-            completed = True
+        if store is not None:
+            tmp_path = store.temp_path(filename)
+        else:
+            tmp_path = file_path + ".part"
+
+        try:
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            digest, size = write_stream(chunks, tmp_path, check_xz=True)
+        finally:
+            response.close()
+        METRICS.inc("bytes_downloaded_total", size, url_class="subtitle")
+
+        if archive is not None:
+            # synced and indexed once per anime (see download_subtitles)
+            archive.append_file(filename, tmp_path, digest, flush=False)
+            os.remove(tmp_path)
+        elif store is not None:
+            store.put_file(tmp_path, digest, ".xz")
+            store.link(digest, ".xz", file_path)
+        else:
+            os.replace(tmp_path, file_path)
+        saved = (digest, size)
+        logger.debug(f"{filename} downloaded successfully.")
     else:
+        response.close()
         logger.error(
-            f"Failed to download {filename}. Status code:", response.status_code
+            f"Failed to download {filename}. Status code: {response.status_code}"
         )
 
-    return completed
+    return saved
 
 
 def download_subtitles(
     file_path: Union[str, Dict[str, List[Dict[str, str]]]],
     filter_anime: str = "",
+    base_url: Optional[str] = None,
+    packed: bool = False,
+    revalidate: bool = False,
+    languages: Sequence[str] = (DESIRED_SUBS,),
 ) -> None:
+    """
+    Downloads the subtitle files of every anime on file_path, for each of the
+    languages (other than DESIRED_SUBS, stored as data/<anime>_<language>,
+    see expand_languages).
+    By default, files are saved on the blob store and linked as data/<anime>/raw/ep_N.xz.
+    With packed=True, they are appended to data/<anime>/subtitles.pack instead
+    (see SubtitleArchive), with no file per episode.
+    Files already downloaded are skipped, unless revalidate=True: then a conditional
+    request is made (with the stored ETag/Last-Modified/size) and the file is only
+    downloaded again if it changed on the server.
+    """
     logger = get_run_logger()
     # verify data
-    data = process_data_input(file_path)
+    data = expand_languages(process_data_input(file_path), languages)
 
     # nothing to be done
     if not data:
@@ -317,9 +562,10 @@ def download_subtitles(
     except Exception as e:
         raise e
 
-    filter_anime = (
-        remove_special_characters(input_string=filter_anime).replace(" ", "_").lower()
-    )
+    # packed files live in their archive, not in the blob store
+    store = None if packed else BlobStore()
+
+    filter_anime = normalize_title(filter_anime)
     # iterate over every anime on .json file
     for anime, anime_info in data.items():
         # target just entry/entries from filter
@@ -334,18 +580,37 @@ def download_subtitles(
             continue
 
         error_count = 0
-        result = create_folders_for_anime(anime_name=anime)
+        reused = 0
+        not_modified = 0
+        updated = 0
+        archive = None
+        if packed:
+            archive = SubtitleArchive(anime)
+            folder_path = archive.folder
+            # for the episode index and partial downloads, even if nothing is saved
+            os.makedirs(folder_path, exist_ok=True)
+            downloaded = set(archive.names())
+        else:
+            result = create_folders_for_anime(anime_name=anime)
 
-        if not result:
-            logger.warning(f"Failed creating folders for anime {anime}. Skipping...")
-            continue
+            if not result:
+                logger.warning(f"Failed creating folders for anime {anime}. Skipping...")
+                continue
 
-        folder_path = f"data/{anime}/raw"
+            folder_path = f"data/{anime}/raw"
+            downloaded = set(os.listdir(folder_path))
+        episode_index = read_episode_index(anime)
 
         logger.info("Downloading subtitles...")
-        for idx, entry in enumerate(entries):
-            if ((idx + 1) % 10) == 0 or (idx + 1) == len(entries):
-                logger.info(f"[Progress|Total]: [{idx+1}|{len(entries)}]")
+        # (entry, attempt), corrupted downloads go back to the end of the queue
+        queue = deque((entry, 0) for entry in entries)
+        idx = -1
+        while queue:
+            entry, attempt = queue.popleft()
+            if not attempt:
+                idx += 1
+                if ((idx + 1) % 10) == 0 or (idx + 1) == len(entries):
+                    logger.info(f"[Progress|Total]: [{idx+1}|{len(entries)}]")
 
             episode = entry.get("episode_number", "")
             if not episode:
@@ -361,20 +626,83 @@ def download_subtitles(
                 logger.debug(f"Subtitle file for episode {episode} does not exists.")
                 continue
 
+            # path like data/anime_name/ep_number.xz
+            file_path = os.path.join(folder_path, filename)
+            key = f"ep_{episode}"
+            link = rebase_url(sub_link, base_url) if base_url else sub_link
+
             # check if file is already downloaded
-            if filename not in os.listdir(folder_path):
-                # path like data/anime_name/ep_number.xz
-                file_path = os.path.join(folder_path, filename)
-                sub_file = get_subtitle_file(link=sub_link)
-                completed = save_subtitle_file(response=sub_file, file_path=file_path)
-                if not completed:
+            if filename in downloaded:
+                if not revalidate:
+                    logger.debug(f'{folder_path + "/" + filename} is already downloaded')
+                    continue
+
+                sub_file = get_subtitle_file(link=link, validators=episode_index.get(key))
+                if sub_file is NOT_MODIFIED:
+                    not_modified += 1
+                    continue
+            else:
+                # same file may be attached to another release, or was already
+                # downloaded under another title
+                digest = store.links.get(sub_link) if store is not None else None
+                if store is not None and store.exists(digest, ".xz"):
+                    store.link(digest, ".xz", file_path)
+                    downloaded.add(filename)
+                    episode_index[key] = {"raw": digest, "sub_link": sub_link}
+                    reused += 1
+                    continue
+
+                sub_file = get_subtitle_file(link=link)
+
+            try:
+                saved = save_subtitle_file(
+                    response=sub_file, file_path=file_path, store=store, archive=archive
+                )
+            except CorruptedFileError as err:
+                logger.warning(str(err))
+                METRICS.inc("corrupted_downloads_total")
+                if attempt < CORRUPTED_DOWNLOAD_RETRIES:
+                    queue.append((entry, attempt + 1))
+                else:
                     error_count += 1
+                continue
 
-            else:
-                logger.debug(f'{folder_path + "/" + filename} is already downloaded')
+            if saved is None:
+                error_count += 1
                 continue
+            digest, size = saved
+            if store is not None:
+                store.links[sub_link] = digest
+
+            previous = episode_index.get(key, {}).get("raw")
+            if previous and previous != digest:
+                updated += 1
+                # the .ass extracted from the old file is stale now
+                processed_path = f"data/{anime}/processed/{key}.ass"
+                if os.path.exists(processed_path):
+                    os.remove(processed_path)
+            elif previous:
+                not_modified += 1
+            downloaded.add(filename)
+            episode_index[key] = {
+                "raw": digest, "sub_link": sub_link, **file_validators(sub_file, size)
+            }
+
+        if archive is not None:
+            # members first, so the episode index never lists a file not indexed
+            archive.close()
+        write_episode_index(anime, episode_index)
+        if store is not None:
+            store.save()
+        METRICS.inc("subtitle_files_reused_total", reused)
 
         logger.info(f"Finished downloading files for anime {anime}.")
+        if reused > 0:
+            logger.info(f"{reused} files were already stored (same subtitle link).")
+        if revalidate:
+            logger.info(
+                f"{not_modified} files not modified and {updated} updated on the server."
+            )
         if error_count > 0:
             logger.info(f"Failed {error_count} from a total of {len(entries)} files.")
 
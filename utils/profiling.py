@@ -0,0 +1,143 @@
+import cProfile
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+from .constants import PROFILE_ENV_VAR, PROFILE_FOLDER, PROFILE_SAMPLE_INTERVAL
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# names currently being profiled, read on every call of a wrapped function
+_enabled: frozenset[str] = frozenset()
+# accumulated profiles per name: deterministic (cProfile) and sampled stacks
+_profiles: dict[str, cProfile.Profile] = {}
+_stacks: dict[str, Counter] = {}
+_locks: dict[str, threading.Lock] = {}
+_active = threading.local()
+
+
+def enable_profiling(targets: Optional[Iterable[str] | str]) -> None:
+    """
+    Enables the profiler for the given function/task names ("all" profiles
+    every wrapped function). None or empty disables it.
+    """
+    global _enabled
+    if isinstance(targets, str):
+        targets = targets.split(",")
+    _enabled = frozenset(t.strip() for t in targets or [] if t.strip())
+
+
+@contextmanager
+def profiling(targets: Optional[Iterable[str] | str]) -> Iterator[None]:
+    """
+    Profiles targets (see enable_profiling) inside the block only, the previously
+    enabled names (e.g. from the environment) are restored after it. None or empty
+    keeps them as they are.
+    """
+    global _enabled
+    previous = _enabled
+    if targets:
+        enable_profiling(targets)
+    try:
+        yield
+    finally:
+        _enabled = previous
+
+
+def _sample(thread_id: int, name: str, stop: threading.Event) -> None:
+    stacks = _stacks.setdefault(name, Counter())
+    while not stop.wait(PROFILE_SAMPLE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+
+
+def _run_profiled(name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    lock = _locks.setdefault(name, threading.Lock())
+    # only one profiler can run per thread and a profile object is not thread safe,
+    # so nested or concurrent calls just run normally
+    if getattr(_active, "busy", False) or not lock.acquire(blocking=False):
+        return fn(*args, **kwargs)
+
+    profile = _profiles.setdefault(name, cProfile.Profile())
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=_sample, args=(threading.get_ident(), name, stop), daemon=True
+    )
+    _active.busy = True
+    sampler.start()
+    profile.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.disable()
+        stop.set()
+        sampler.join()
+        _active.busy = False
+        lock.release()
+
+
+def profiled(name: Optional[str] = None) -> Callable[[F], F]:
+    """
+    Wraps a function so it is profiled when its name is enabled (through
+    enable_profiling or the ANIMESUBS_PROFILE environment variable). When disabled,
+    the only overhead is a set lookup per call.
+    """
+    def decorator(fn: F) -> F:
+        key = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled or (key not in _enabled and "all" not in _enabled):
+                return fn(*args, **kwargs)
+            return _run_profiled(key, fn, *args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def dump_profiles(run_name: Optional[str] = None, folder: str = PROFILE_FOLDER) -> list[str]:
+    """
+    Writes one <name>.pstats (open with pstats/snakeviz) and one <name>.collapsed
+    (flamegraph.pl / speedscope input) per profiled name under folder/run_name,
+    then clears the accumulated profiles.
+    """
+    if not _profiles:
+        return []
+
+    run_name = run_name or time.strftime("%Y%m%d-%H%M%S")
+    run_folder = os.path.join(folder, run_name)
+    os.makedirs(run_folder, exist_ok=True)
+    written = []
+
+    for name, profile in list(_profiles.items()):
+        path = os.path.join(run_folder, f"{name}.pstats")
+        profile.dump_stats(path)
+        written.append(path)
+
+        path = os.path.join(run_folder, f"{name}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in _stacks.get(name, Counter()).most_common():
+                f.write(f"{stack} {count}\n")
+        written.append(path)
+
+    _profiles.clear()
+    _stacks.clear()
+
+    return written
+
+
+enable_profiling(os.getenv(PROFILE_ENV_VAR))
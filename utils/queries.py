@@ -25,3 +25,491 @@ SELECT
 FROM raw_quotes.v_json_info
 WHERE mal_id = %s;
 """
+
+# one mal_id at a time, %(mal_id)s is the placeholder of the driver (see CollectedAnimes)
+query_anime_status = """
+SELECT
+	completed,
+	ep_amount
+FROM %(schema)s.v_json_info
+WHERE mal_id = %(mal_id)s
+ORDER BY completed DESC, ep_amount DESC
+LIMIT 1;
+"""
+
+query_create_table_sqlite = """
+create table if not exists %s.%s (
+	mal_id INTEGER,
+	episode INTEGER,
+	name VARCHAR(200),
+	quote TEXT,
+	start_time TEXT,
+	end_time TEXT
+);
+"""
+
+# sqlite has no json view out of the box, so we mirror raw_quotes.v_json_info
+# (sqlite keeps column names as declared, hence the lowercase names)
+query_create_json_reference_sqlite = """
+create table if not exists %(schema)s.json_reference (
+	json_data TEXT,
+	reference_date TEXT
+);
+
+create view if not exists %(schema)s.v_json_info as
+select
+	json_extract(json_data, '$.info.metadata.mal_id') as mal_id,
+	json_data,
+	json_array_length(json_data, '$.info.data') as ep_amount,
+	json_array_length(json_data, '$.info.data')
+		>= json_extract(json_data, '$.info.metadata.episode_count') as completed,
+	reference_date
+from json_reference;
+
+-- used by the mal_id lookups on v_json_info (see CollectedAnimes)
+create index if not exists %(schema)s.json_reference_mal_id_idx
+	on json_reference (json_extract(json_data, '$.info.metadata.mal_id'));
+"""
+
+# json_data as jsonb, with the fields looked up by the crawl extracted to indexed
+# (generated) columns, so lookups do not parse the json of every row.
+# Tables created before (json_data as text/json) are migrated in place, the
+# advisory lock keeps concurrent writers from migrating at the same time.
+query_create_json_reference = """
+do $$
+begin
+	perform pg_advisory_xact_lock(hashtext('%(schema)s.json_reference'));
+
+	create schema if not exists %(schema)s;
+	create table if not exists %(schema)s.json_reference (
+		JSON_DATA JSONB,
+		REFERENCE_DATE TIMESTAMP
+	);
+
+	if not exists (
+		select 1 from information_schema.columns
+		where table_schema = '%(schema)s' and table_name = 'json_reference'
+			and column_name = 'completed'
+	) then
+		drop view if exists %(schema)s.v_json_info;
+
+		alter table %(schema)s.json_reference
+			alter column JSON_DATA type JSONB using JSON_DATA::JSONB,
+			add column MAL_ID INTEGER generated always as (
+				(JSON_DATA #>> '{info,metadata,mal_id}')::INTEGER
+			) stored,
+			add column EP_AMOUNT INTEGER generated always as (
+				jsonb_array_length(JSON_DATA #> '{info,data}')
+			) stored,
+			add column COMPLETED BOOLEAN generated always as (
+				jsonb_array_length(JSON_DATA #> '{info,data}')
+					>= (JSON_DATA #>> '{info,metadata,episode_count}')::INTEGER
+			) stored;
+
+		-- lookups by mal_id, newest status first (see query_anime_status)
+		create index if not exists json_reference_mal_id_idx
+			on %(schema)s.json_reference (MAL_ID, COMPLETED desc, EP_AMOUNT desc);
+
+		create view %(schema)s.v_json_info as
+		select
+			MAL_ID,
+			JSON_DATA,
+			EP_AMOUNT,
+			COMPLETED,
+			REFERENCE_DATE
+		from %(schema)s.json_reference;
+	end if;
+
+	-- created by earlier migrations, nothing scans by status anymore
+	drop index if exists %(schema)s.json_reference_status_idx;
+end
+$$;
+"""
+
+query_copy_json_reference = """
+COPY %(schema)s.json_reference (json_data, reference_date) FROM STDIN WITH (FORMAT csv);
+"""
+
+# full text search over every quote, maintained by the writers (index_quotes=True)
+query_create_search_table = """
+create table if not exists %(schema)s.quote_search (
+	TABLE_NAME VARCHAR(200),
+	MAL_ID INTEGER,
+	EPISODE INTEGER,
+	NAME VARCHAR(200),
+	QUOTE TEXT,
+	START_TIME TIME(3),
+	END_TIME TIME(3),
+	QUOTE_TSV TSVECTOR GENERATED ALWAYS AS (
+		to_tsvector('%(config)s', coalesce(QUOTE, ''))
+	) STORED
+);
+
+create index if not exists quote_search_tsv_idx
+	on %(schema)s.quote_search using gin (QUOTE_TSV);
+
+create index if not exists quote_search_filters_idx
+	on %(schema)s.quote_search (MAL_ID, EPISODE);
+"""
+
+query_create_search_table_sqlite = """
+create virtual table if not exists %(schema)s.quote_search using fts5(
+	quote,
+	name UNINDEXED,
+	table_name UNINDEXED,
+	mal_id UNINDEXED,
+	episode UNINDEXED,
+	start_time UNINDEXED,
+	end_time UNINDEXED,
+	tokenize = 'porter unicode61'
+);
+"""
+
+query_search_quotes = """
+SELECT
+	table_name,
+	mal_id,
+	episode,
+	name,
+	quote,
+	start_time,
+	end_time,
+	ts_rank(quote_tsv, query) AS rank
+FROM %(schema)s.quote_search, %(ts_function)s('%(config)s', %%(text)s) AS query
+WHERE quote_tsv @@ query
+%(filters)s
+ORDER BY rank DESC
+LIMIT %%(limit)s;
+"""
+
+query_search_quotes_sqlite = """
+SELECT
+	table_name,
+	mal_id,
+	episode,
+	name,
+	quote,
+	start_time,
+	end_time,
+	rank
+FROM %(schema)s.quote_search
+WHERE quote_search MATCH :text
+%(filters)s
+ORDER BY rank
+LIMIT :limit;
+"""
+
+# durable crawl queue (postgres only), see utils/jobs.py
+query_create_crawl_jobs = """
+create schema if not exists %(schema)s;
+
+create table if not exists %(schema)s.crawl_jobs (
+	ID BIGSERIAL PRIMARY KEY,
+	JOB_TYPE VARCHAR(20) NOT NULL,
+	URL TEXT NOT NULL,
+	PAYLOAD JSONB NOT NULL DEFAULT '{}',
+	PARENT_ID BIGINT,
+	STATUS VARCHAR(10) NOT NULL DEFAULT 'pending',
+	PRIORITY SMALLINT NOT NULL DEFAULT 0,
+	ATTEMPTS INTEGER NOT NULL DEFAULT 0,
+	MAX_ATTEMPTS INTEGER NOT NULL,
+	AVAILABLE_AT TIMESTAMPTZ NOT NULL DEFAULT now(),
+	LEASE_UNTIL TIMESTAMPTZ,
+	WORKER VARCHAR(100),
+	LAST_ERROR TEXT,
+	RESULT JSONB,
+	CREATED_AT TIMESTAMPTZ NOT NULL DEFAULT now(),
+	UPDATED_AT TIMESTAMPTZ NOT NULL DEFAULT now(),
+	UNIQUE (JOB_TYPE, URL)
+);
+
+create index if not exists crawl_jobs_claim_idx
+	on %(schema)s.crawl_jobs (PRIORITY, ID)
+	where STATUS in ('pending', 'running');
+
+create index if not exists crawl_jobs_parent_idx
+	on %(schema)s.crawl_jobs (PARENT_ID);
+"""
+
+# refresh=True puts finished jobs back on the queue (e.g. listing pages)
+query_enqueue_job = """
+INSERT INTO %(schema)s.crawl_jobs
+	(job_type, url, payload, parent_id, priority, max_attempts)
+VALUES (%%(job_type)s, %%(url)s, %%(payload)s, %%(parent_id)s, %%(priority)s, %%(max_attempts)s)
+ON CONFLICT (job_type, url) DO UPDATE
+	SET status = 'pending', attempts = 0, available_at = now(), payload = EXCLUDED.payload,
+		parent_id = EXCLUDED.parent_id, updated_at = now()
+	WHERE %%(refresh)s AND crawl_jobs.status IN ('done', 'failed')
+RETURNING id;
+"""
+
+# running jobs whose lease expired belong to a dead worker, so they are claimable
+query_claim_jobs = """
+UPDATE %(schema)s.crawl_jobs AS jobs
+SET status = 'running',
+	attempts = jobs.attempts + 1,
+	worker = %%(worker)s,
+	lease_until = now() + make_interval(secs => %%(lease)s),
+	updated_at = now()
+WHERE jobs.id IN (
+	SELECT id
+	FROM %(schema)s.crawl_jobs
+	WHERE (
+		(status = 'pending' AND available_at <= now())
+		OR (status = 'running' AND lease_until < now())
+	)
+	AND attempts < max_attempts
+	AND job_type = ANY(%%(job_types)s)
+	ORDER BY priority, id
+	LIMIT %%(limit)s
+	FOR UPDATE SKIP LOCKED
+)
+RETURNING jobs.id, jobs.job_type, jobs.url, jobs.payload, jobs.parent_id, jobs.attempts;
+"""
+
+# expired leases without attempts left would never be claimed again
+query_fail_expired_jobs = """
+UPDATE %(schema)s.crawl_jobs
+SET status = 'failed', last_error = 'lease expired', updated_at = now()
+WHERE status = 'running' AND lease_until < now() AND attempts >= max_attempts;
+"""
+
+query_heartbeat_job = """
+UPDATE %(schema)s.crawl_jobs
+SET lease_until = now() + make_interval(secs => %%(lease)s), updated_at = now()
+WHERE id = %%(id)s AND worker = %%(worker)s AND status = 'running';
+"""
+
+query_complete_job = """
+UPDATE %(schema)s.crawl_jobs
+SET status = 'done', result = %%(result)s, lease_until = NULL, updated_at = now()
+WHERE id = %%(id)s AND worker = %%(worker)s AND status = 'running'
+RETURNING status;
+"""
+
+query_fail_job = """
+UPDATE %(schema)s.crawl_jobs
+SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+	available_at = now() + make_interval(secs => %%(wait)s * power(2, attempts - 1)),
+	last_error = %%(error)s,
+	lease_until = NULL,
+	updated_at = now()
+WHERE id = %%(id)s AND worker = %%(worker)s AND status = 'running'
+RETURNING status;
+"""
+
+# taken before ending a child job, so only the last child sees no pending siblings
+query_lock_job = """
+SELECT id FROM %(schema)s.crawl_jobs WHERE id = %%(id)s FOR UPDATE;
+"""
+
+query_pending_children = """
+SELECT count(*)
+FROM %(schema)s.crawl_jobs
+WHERE parent_id = %%(parent_id)s AND status IN ('pending', 'running');
+"""
+
+query_job_children = """
+SELECT url, status, result
+FROM %(schema)s.crawl_jobs
+WHERE parent_id = %%(parent_id)s
+ORDER BY id;
+"""
+
+query_job = """
+SELECT url, status, result FROM %(schema)s.crawl_jobs WHERE id = %%(id)s;
+"""
+
+query_job_counts = """
+SELECT job_type, status, count(*) AS jobs
+FROM %(schema)s.crawl_jobs
+GROUP BY job_type, status
+ORDER BY job_type, status;
+"""
+
+# high-water mark of each listing (newest series link already crawled) and the
+# cursor of a crawl that did not get down to it yet (next page, newest link when it
+# started). Works on both sinks, %(placeholder)s is formatted with the placeholder
+# of the driver
+query_create_crawl_state = """
+create table if not exists %(schema)s.crawl_state (
+	LISTING TEXT PRIMARY KEY,
+	LAST_LINK TEXT,
+	LAST_SEEN_AT TIMESTAMP,
+	RESUME_PAGE INTEGER,
+	RESUME_LINK TEXT
+);
+"""
+
+query_read_crawl_state = """
+SELECT last_link, last_seen_at, resume_page, resume_link
+FROM %(schema)s.crawl_state
+WHERE listing = %(listing)s;
+"""
+
+query_write_crawl_state = """
+INSERT INTO %(schema)s.crawl_state (listing, last_link, last_seen_at)
+VALUES (%(listing)s, %(last_link)s, %(last_seen_at)s)
+ON CONFLICT (listing) DO UPDATE
+	SET last_link = excluded.last_link,
+		last_seen_at = excluded.last_seen_at,
+		resume_page = NULL,
+		resume_link = NULL;
+"""
+
+query_write_resume_cursor = """
+INSERT INTO %(schema)s.crawl_state (listing, resume_page, resume_link)
+VALUES (%(listing)s, %(resume_page)s, %(resume_link)s)
+ON CONFLICT (listing) DO UPDATE
+	SET resume_page = excluded.resume_page, resume_link = excluded.resume_link;
+"""
+
+# key (folder/table name) of every anime, see TitleKeys
+query_create_title_keys = """
+create table if not exists %(schema)s.title_keys (
+	TITLE_KEY VARCHAR(200) PRIMARY KEY,
+	MAL_ID INTEGER NOT NULL UNIQUE,
+	TITLE TEXT,
+	CREATED_AT TIMESTAMP
+);
+"""
+
+query_read_title_key = """
+SELECT title_key
+FROM %(schema)s.title_keys
+WHERE mal_id = %(mal_id)s;
+"""
+
+query_any_title_key = """
+SELECT 1 FROM %(schema)s.title_keys LIMIT 1;
+"""
+
+query_json_info_exists = """
+SELECT to_regclass('%(schema)s.v_json_info') IS NOT NULL;
+"""
+
+query_json_info_exists_sqlite = """
+SELECT count(*) > 0 FROM %(schema)s.sqlite_master WHERE name = 'v_json_info';
+"""
+
+# keys of the animes crawled before title_keys existed (the name of their newest
+# links), so they keep their folder and table
+query_backfill_title_keys = """
+INSERT INTO %(schema)s.title_keys (title_key, mal_id, title, created_at)
+SELECT DISTINCT ON (mal_id)
+	json_data::jsonb ->> 'name',
+	mal_id,
+	json_data::jsonb #>> '{info,metadata,original_name}',
+	reference_date
+FROM %(schema)s.v_json_info
+WHERE mal_id IS NOT NULL AND json_data::jsonb ->> 'name' IS NOT NULL
+ORDER BY mal_id, reference_date DESC
+ON CONFLICT DO NOTHING;
+"""
+
+query_backfill_title_keys_sqlite = """
+INSERT INTO %(schema)s.title_keys (title_key, mal_id, title, created_at)
+SELECT
+	json_extract(json_data, '$.name'),
+	mal_id,
+	json_extract(json_data, '$.info.metadata.original_name'),
+	max(reference_date)
+FROM %(schema)s.v_json_info
+WHERE mal_id IS NOT NULL AND json_extract(json_data, '$.name') IS NOT NULL
+GROUP BY mal_id
+ON CONFLICT DO NOTHING;
+"""
+
+# taken keys (or animes) are left as they are, the caller reads back who owns it
+query_claim_title_key = """
+INSERT INTO %(schema)s.title_keys (title_key, mal_id, title, created_at)
+VALUES (%(title_key)s, %(mal_id)s, %(title)s, %(created_at)s)
+ON CONFLICT DO NOTHING;
+"""
+
+# per episode stats of the quote tables, upserted by the writers (see utils/stats.py)
+query_create_stats_table = """
+create table if not exists %(schema)s.quote_stats (
+	TABLE_NAME VARCHAR(200) NOT NULL,
+	MAL_ID INTEGER NOT NULL,
+	EPISODE INTEGER NOT NULL,
+	LINES INTEGER NOT NULL,
+	UNKNOWN_LINES INTEGER NOT NULL,
+	DURATION_SECONDS DOUBLE PRECISION NOT NULL,
+	UPDATED_AT TIMESTAMP NOT NULL,
+	PRIMARY KEY (TABLE_NAME, EPISODE)
+);
+
+create index if not exists quote_stats_mal_id_idx on %(schema)s.quote_stats (MAL_ID);
+create index if not exists quote_stats_lines_idx on %(schema)s.quote_stats (LINES);
+
+create or replace view %(schema)s.v_quote_stats as
+select
+	TABLE_NAME,
+	MAL_ID,
+	count(*) as EPISODES,
+	sum(LINES) as LINES,
+	sum(UNKNOWN_LINES) * 1.0 / sum(LINES) as UNKNOWN_RATIO,
+	sum(DURATION_SECONDS) as DURATION_SECONDS,
+	max(UPDATED_AT) as UPDATED_AT
+from %(schema)s.quote_stats
+group by TABLE_NAME, MAL_ID;
+"""
+
+# same as above, sqlite puts the schema on the index/view name instead
+query_create_stats_table_sqlite = """
+create table if not exists %(schema)s.quote_stats (
+	table_name VARCHAR(200) NOT NULL,
+	mal_id INTEGER NOT NULL,
+	episode INTEGER NOT NULL,
+	lines INTEGER NOT NULL,
+	unknown_lines INTEGER NOT NULL,
+	duration_seconds DOUBLE PRECISION NOT NULL,
+	updated_at TIMESTAMP NOT NULL,
+	PRIMARY KEY (table_name, episode)
+);
+
+create index if not exists %(schema)s.quote_stats_mal_id_idx on quote_stats (mal_id);
+create index if not exists %(schema)s.quote_stats_lines_idx on quote_stats (lines);
+
+create view if not exists %(schema)s.v_quote_stats as
+select
+	table_name,
+	mal_id,
+	count(*) as episodes,
+	sum(lines) as lines,
+	sum(unknown_lines) * 1.0 / sum(lines) as unknown_ratio,
+	sum(duration_seconds) as duration_seconds,
+	max(updated_at) as updated_at
+from quote_stats
+group by table_name, mal_id;
+"""
+
+# appended rows add to the stats of the episode, %(values)s is filled by the writer
+query_upsert_stats = """
+INSERT INTO %(schema)s.quote_stats
+	(table_name, mal_id, episode, lines, unknown_lines, duration_seconds, updated_at)
+VALUES %(values)s
+ON CONFLICT (table_name, episode) DO UPDATE SET
+	mal_id = excluded.mal_id,
+	lines = quote_stats.lines + excluded.lines,
+	unknown_lines = quote_stats.unknown_lines + excluded.unknown_lines,
+	duration_seconds = quote_stats.duration_seconds + excluded.duration_seconds,
+	updated_at = excluded.updated_at;
+"""
+
+# any stats of the table, i.e. it was written (see has_stats)
+query_table_has_stats = """
+SELECT 1 FROM %(schema)s.quote_stats WHERE table_name = %(table_name)s LIMIT 1;
+"""
+
+query_count_stats = """
+SELECT count(*) FROM %(schema)s.quote_stats;
+"""
+
+# lines of the episode at a given rank (used for percentiles, see utils/stats.py)
+query_lines_at_rank = """
+SELECT lines FROM %(schema)s.quote_stats
+ORDER BY lines
+LIMIT 1 OFFSET %(rank)s;
+"""
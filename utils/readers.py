@@ -1,5 +1,5 @@
-from time import sleep
-from typing import Any, Callable, Optional
+from time import perf_counter, sleep
+from typing import Any, Callable, Literal, Optional
 
 # import logging
 import pandas as pd
@@ -10,8 +10,12 @@ from .constants import (
     DEFAULT_ATTEMPTS,
     DEFAULT_TIMEOUT,
     DEFAULT_WAIT_TIME,
+    PARQUET_ROOT,
     # FORMAT,
 )
+from .breaker import BREAKERS, FAILURE_BUDGET
+from .metrics import METRICS, url_class
+from .profiling import profiled
 # logger = logging.getLogger(__name__)
 # level = logging.INFO
 # logging.basicConfig(
@@ -20,25 +24,57 @@ from .constants import (
 #     handlers=[logging.StreamHandler()])
 
 
+@profiled()
 def read_url(
     url: str,
     max_retries: int = DEFAULT_ATTEMPTS,
     timeout: int = DEFAULT_TIMEOUT,
     wait_time: int = DEFAULT_WAIT_TIME,
     process_fn: Optional[Callable[[requests.Response], Any]] = None,
+    headers: Optional[dict[str, str]] = None,
+    method: Literal["GET", "HEAD"] = "GET",
+    stream: bool = False,
 ) -> requests.Response | Any:
+    """
+    Requests url, retrying (with increasing waits) on failures.
+    Requests fail fast (no request, no waits) while the circuit breaker of the host
+    is open, and every url that still fails counts against the failure budget of
+    the run, which raises FailureBudgetExceeded once it is spent.
+    headers can be used for conditional requests (If-None-Match, If-Modified-Since),
+    in which case a 304 response is returned as is (res.ok is True for it).
+    With stream=True the body is not read here (use res.iter_content, then close it).
+    """
     logger = get_run_logger()
+    fetch = requests.head if method == "HEAD" else requests.get
     attempts = 0
     completed = False
     wait = False
+    kind = url_class(url)
+    breaker = BREAKERS.for_url(url)
 
     for attempts in range(max_retries):
-        if wait:
+        if wait and breaker.state == "closed":
             sleep(wait_time)
+        if not breaker.allow():
+            METRICS.inc("http_requests_short_circuited_total", url_class=kind)
+            logger.warning(f"Host {breaker.host} is down (circuit open), skipping {url}.")
+            break
         try:
-            res = requests.get(url=url, timeout=timeout)
+            start = perf_counter()
+            res = fetch(url=url, timeout=timeout, headers=headers, stream=stream)
+            METRICS.observe("http_request_seconds", perf_counter() - start, url_class=kind)
+            METRICS.inc("http_requests_total", url_class=kind, status=res.status_code)
             completed = res.ok
+            if res.status_code >= 500 or res.status_code == 429:
+                breaker.record_failure()
+            else:
+                # even a 404 means the host is answering
+                breaker.record_success()
             if completed:
+                METRICS.inc("pages_fetched_total", url_class=kind)
+                if not stream:
+                    # streamed bodies are counted by whoever reads them
+                    METRICS.inc("bytes_downloaded_total", len(res.content), url_class=kind)
                 break
 
             # lets try again but now waiting a little
@@ -50,14 +86,19 @@ def read_url(
             )
 
         except TimeoutError:
+            breaker.record_failure()
+            METRICS.inc("http_requests_total", url_class=kind, status="timeout")
             logger.error(f"Timeout during url {url} request. (attempt: {attempts + 1})")
 
         except Exception as e:
+            breaker.record_failure()
+            METRICS.inc("http_requests_total", url_class=kind, status="error")
             logger.debug(str(e))
             logger.warning(
                 f"Failed to request subtitle data from link {url}. (attempt: {attempts + 1})"
             )
 
+    FAILURE_BUDGET.record(completed, url)
     if not completed:
         logger.warning(
             f"Failed to get response from url {url} after {max_retries} attempts."
@@ -85,3 +126,32 @@ def read_postgres(con, query: str, cleanup: bool = True) -> pd.DataFrame:
             con.close()
 
     return df
+
+
+def read_parquet(
+    root: str = PARQUET_ROOT,
+    columns: Optional[list[str]] = None,
+    mal_ids: Optional[list[int]] = None,
+    episodes: Optional[list[int]] = None,
+) -> pd.DataFrame:
+    """
+    Reads quotes from the parquet dataset written by write_parquet.
+    Only the requested columns are read, mal_id filters prune whole partitions
+    and episode filters are pushed down to the row group statistics.
+    """
+    import pyarrow.parquet as pq
+
+    filters = []
+    if mal_ids:
+        filters.append(("mal_id", "in", list(mal_ids)))
+    if episodes:
+        filters.append(("episode", "in", list(episodes)))
+
+    table = pq.read_table(
+        root,
+        columns=columns,
+        filters=filters or None,
+        partitioning="hive",
+    )
+
+    return table.to_pandas()
@@ -1,25 +1,34 @@
 # import logging
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
-from prefect import get_run_logger
+from bs4.element import Tag
+from prefect import get_run_logger, task
 
-from utils.constants import DESIRED_SUBS, MEMBER_CUT
+from utils.breaker import FAILURE_BUDGET
+from utils.caching import CACHE_EXPIRATION, listing_fingerprint, series_cache_key
+from utils.constants import BASE_URL, DESIRED_SUBS, MEMBER_CUT
+from utils.crawl_state import TitleKeys
 from utils.helpers import (
     check_for_id,
     extract_titles_and_anime_links,
     filter_links_from_provider,
-    remove_special_characters,
     sort_options_by_priority,
 )
+from utils.jobs import Job, enqueue_job, get_job, get_job_children
 from utils.parsers import (
+    filter_finished_entries,
     get_all_links_from_provider,
     get_all_subtitles_info,
     get_animes_finished_from_page,
     get_batch_options_and_episode_count,
+    get_batch_subtitle_links,
+    get_listing_entries,
     get_subtitle_links,
+    get_subtitle_options,
     get_title_name,
 )
 from utils.readers import read_url
+from utils.titles import normalize_title_key, parse_release_title
 
 # logger = logging.getLogger(__name__)
 # level = logging.INFO
@@ -29,12 +38,278 @@ from utils.readers import read_url
 #     handlers=[logging.StreamHandler()])
 
 
+def check_anime(
+    title: str,
+    providers_info: dict[str, dict[str, Any]],
+    episode_count: int,
+    mal_id: int,
+    already_collected_animes: dict[str, dict[str, Any]] = dict(),
+) -> bool:
+    """
+    Whether the anime (as found on its series page, see
+    get_batch_options_and_episode_count) is worth collecting: not completed on
+    database yet, with episode count, MAL id and providers, and relevant enough.
+    """
+    logger = get_run_logger()
+    logger.debug(f"Batch Providers: {providers_info}")
+
+    # check if we already have this full entry
+    if already_collected_animes.get(mal_id, {}).get("completed", False):
+        logger.info(
+            f"Anime [{title}] with id of {mal_id} already completed in database. Skipping..."
+        )
+        return False
+
+    if episode_count == 0 or mal_id == 0:
+        # we will not be able to sort our data appropriatelly
+        logger.info("Could not find either episode count or MAL ID. Skipping...")
+        return False
+
+    if len(providers_info) == 0:
+        # nothing we can do
+        logger.warning(f"No available provider for anime {title}. Skipping...")
+        return False
+
+    # TODO: we need to rebuild this map to include recent animes
+    is_relevant = check_for_id(mal_id=mal_id, members_cut=MEMBER_CUT)
+    if not is_relevant:
+        logger.info(
+            f"Anime {title} has less than {MEMBER_CUT} members. Ignoring..."
+        )
+        return False
+
+    return True
+
+
+def collect_provider_links(
+    title: str,
+    link: str,
+    providers_info: dict[str, dict[str, Any]],
+    episode_count: int,
+    mal_id: int,
+    desired_subs: str = DESIRED_SUBS,
+) -> Optional[Tuple[Dict[str, Any], str, Dict[str, Dict[str, str]]]]:
+    """
+    Selects a provider for the anime on link and collects its episode links
+    (not their subtitles yet, see get_all_subtitles_info).
+
+    Returns:
+    - Optional[Tuple[Dict[str, Any], str, Dict[str, Dict[str, str]]]]: The anime
+        entry (data and metadata), the selected provider and the subtitles found on
+        its batch releases. None if no provider has subtitles.
+    """
+    logger = get_run_logger()
+    provider_selected = ""
+    batch_subs = {}
+    # sort provider_names by priority (preference, then amount of links)
+    providers_info = sort_options_by_priority(providers_info)
+
+    # search for a functional provider
+    for provider_name, info in providers_info.items():
+        # link to test provider (empty if it only has batch releases)
+        trial_link = info["trial_link"]
+        sub_info, sub_link = get_subtitle_links(trial_link, desired_subs)
+
+        works = bool(sub_info and sub_link)
+
+        if info.get("batch_links"):
+            # one request per batch instead of one per episode page,
+            # subtitles found there also prove the provider works
+            batch_subs = get_batch_subtitle_links(info["batch_links"], desired_subs)
+            works = works or any(entry["sub_link"] for entry in batch_subs.values())
+
+        if works:
+            provider_selected = provider_name
+            logger.info(f"Selected {provider_selected} provider for anime {title}.")
+            break
+
+    if not provider_selected:
+        # nothing to be done
+        logger.warning(
+            f"No available provider with subtitles for anime {title}. Skipping..."
+        )
+        return None
+
+    # if we get here, we may have good data for this entry, let's process it
+    processing = True
+    page = 1
+    anime_info = {
+        "data": [],
+        "metadata": {
+            "episode_count": episode_count,
+            "mal_id": mal_id,
+            "original_name": title,
+        },
+    }
+
+    while processing:
+        logger.info(f"Parsing page {page}")
+        page_links, has_entries = get_all_links_from_provider(
+            provider_selected, page, link
+        )
+        anime_info["data"] += page_links
+        processing = has_entries
+        page += 1
+
+    anime_info["data"] = filter_links_from_provider(
+        anime_info["data"], provider_selected, episode_count
+    )
+
+    return anime_info, provider_selected, batch_subs
+
+
+def get_title_key(title: str, mal_id: int, title_keys: Optional[TitleKeys] = None) -> str:
+    if title_keys is not None:
+        return title_keys.get(title, mal_id)
+    return normalize_title_key(title)
+
+
+def collect_anime_links(
+    title: str,
+    link: str,
+    desired_subs: str = DESIRED_SUBS,
+    already_collected_animes: dict[str, dict[str, Any]] = dict(),
+    title_keys: Optional[TitleKeys] = None,
+) -> Optional[Tuple[str, Dict[str, Any], str, Dict[str, Dict[str, str]]]]:
+    """
+    Selects a provider for the anime on link and collects its episode links
+    (not their subtitles yet, see get_all_subtitles_info). The title_key comes from
+    title_keys when given, so it is unique across the catalogue.
+
+    Returns:
+    - Optional[Tuple[str, Dict[str, Any], str, Dict[str, Dict[str, str]]]]: The
+        title_key, the anime entry (data and metadata), the selected provider and
+        the subtitles found on its batch releases. None if the anime is skipped.
+    """
+    providers_info, episode_count, mal_id = get_batch_options_and_episode_count(
+        title=title, link=link
+    )
+    if not check_anime(
+        title, providers_info, episode_count, mal_id, already_collected_animes
+    ):
+        return None
+
+    collected = collect_provider_links(
+        title, link, providers_info, episode_count, mal_id, desired_subs
+    )
+    if collected is None:
+        return None
+
+    anime_info, provider_selected, batch_subs = collected
+    title_key = get_title_key(title, mal_id, title_keys)
+    return title_key, anime_info, provider_selected, batch_subs
+
+
+@task(
+    cache_key_fn=series_cache_key,
+    cache_expiration=CACHE_EXPIRATION,
+    persist_result=True,
+)
+def resolve_series(
+    title: str, link: str, fingerprint: Optional[str] = None
+) -> Tuple[dict[str, dict[str, Any]], int, int]:
+    """
+    Providers, episode count and MAL id of the anime on link (see
+    get_batch_options_and_episode_count). Cached as resolve_anime_links.
+    """
+    return get_batch_options_and_episode_count(title=title, link=link)
+
+
+@task(
+    cache_key_fn=series_cache_key,
+    cache_expiration=CACHE_EXPIRATION,
+    persist_result=True,
+)
+def resolve_anime_links(
+    title: str,
+    link: str,
+    fingerprint: Optional[str] = None,
+    desired_subs: str = DESIRED_SUBS,
+    providers_info: dict[str, dict[str, Any]] = dict(),
+    episode_count: int = 0,
+    mal_id: int = 0,
+) -> Dict[str, Any]:
+    """
+    Collects the episode links of the anime on link and their subtitles.
+    Cached by link and fingerprint (of its listing entry, see listing_fingerprint),
+    so reruns skip the series whose entry did not change. The database status and
+    key of the anime are not part of it, see resolve_links.
+
+    Returns:
+    - Dict[str, Any]: The anime entry ("anime_info", None if no provider has
+        subtitles) and whether every request succeeded meanwhile ("complete").
+    """
+    failures = FAILURE_BUDGET.failures
+    anime_info = None
+    collected = collect_provider_links(
+        title, link, providers_info, episode_count, mal_id, desired_subs
+    )
+    if collected is not None:
+        anime_info, provider_selected, batch_subs = collected
+        anime_info["data"] = get_all_subtitles_info(
+            title, anime_info, provider_selected, desired_subs, batch_subs
+        )
+
+    return {"anime_info": anime_info, "complete": FAILURE_BUDGET.failures == failures}
+
+
+def resolve_links(
+    title: str,
+    link: str,
+    fingerprint: Optional[str] = None,
+    desired_subs: str = DESIRED_SUBS,
+    already_collected_animes: dict[str, dict[str, Any]] = dict(),
+    title_keys: Optional[TitleKeys] = None,
+) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    collect_anime_links and get_all_subtitles_info, with the requests cached by the
+    listing entry of the series (resolve_series, resolve_anime_links). Whether the
+    anime is already completed on database and its key are checked on every run.
+    Links resolved while some request failed are resolved again on the next run.
+
+    Returns:
+    - Optional[Tuple[str, Dict[str, Any]]]: The title_key and the anime entry,
+        None if the anime is skipped.
+    """
+    logger = get_run_logger()
+    providers_info, episode_count, mal_id = resolve_series(
+        title=title, link=link, fingerprint=fingerprint
+    )
+    if not check_anime(
+        title, providers_info, episode_count, mal_id, already_collected_animes
+    ):
+        return None
+
+    parameters = {
+        "title": title,
+        "link": link,
+        "fingerprint": fingerprint,
+        "desired_subs": desired_subs,
+        "providers_info": providers_info,
+        "episode_count": episode_count,
+        "mal_id": mal_id,
+    }
+    state = resolve_anime_links(**parameters, return_state=True)
+    resolved = state.result()
+    if not resolved["complete"] and state.name == "Cached":
+        logger.info(f"Links of {title} were cached with failed requests, resolving again.")
+        resolved = resolve_anime_links.with_options(refresh_cache=True)(**parameters)
+
+    if resolved["anime_info"] is None:
+        return None
+
+    return get_title_key(title, mal_id, title_keys), resolved["anime_info"]
+
+
 def build_json_with_links(
     page: int = 1,
     limit_per_page: int = 1,
     filter_links: list[str] = None,
     desired_subs: str = DESIRED_SUBS,
     already_collected_animes: dict[str, dict[str, Any]] = dict(),
+    base_url: str = BASE_URL,
+    animes: Optional[List[Tag]] = None,
+    title_keys: Optional[TitleKeys] = None,
 ) -> Dict[str, Any]:
     """
     Constructs a dictionary containing anime titles and corresponding lists
@@ -57,6 +332,11 @@ def build_json_with_links(
         Default is an empty string.
     - desired_subs (str, optional): The desired subtitle language (e.g. "eng").
         Default is "eng".
+    - base_url (str, optional): Website to crawl, useful to point the crawler to a
+        local stand-in server. Default is BASE_URL (animetosho.org).
+    - animes (List[Tag], optional): Entries of the page, if already requested.
+    - title_keys (TitleKeys, optional): Registry of the keys of the animes, so two
+        animes never share a key. Without it, keys are only generated from titles.
 
     Returns:
     - Dict[str, Any]: A dictionary containing data and metadata about the entry.
@@ -70,7 +350,8 @@ def build_json_with_links(
     data = {}
     if filter_links is None:
         filter_links = []
-    animes = get_animes_finished_from_page(page=page)
+    if animes is None:
+        animes = get_animes_finished_from_page(page=page, base_url=base_url)
 
     if not animes:
         logger.error(f"Bad response from page {page}. Skipping...")
@@ -97,99 +378,31 @@ def build_json_with_links(
             f"Will only process {limit_per_page} of {len(links)} entries from page {page}."
         )
 
+    # the listing entry of each series, to skip the ones that did not change
+    fingerprints = {
+        entry.find("a").get("href"): listing_fingerprint(entry) for entry in animes
+    }
+
     for title, link in zip(titles[:limit_per_page], links[:limit_per_page]):
         logger.info(f"Processing link: {link}")
         logger.info(f"Processing anime: {title}")
 
-        providers_info, episode_count, mal_id = get_batch_options_and_episode_count(
-            title=title, link=link
+        resolved = resolve_links(
+            title=title,
+            link=link,
+            fingerprint=fingerprints.get(link),
+            desired_subs=desired_subs,
+            already_collected_animes=already_collected_animes,
+            title_keys=title_keys,
         )
-        logger.debug(f"Batch Providers: {providers_info}")
-
-        # check if we already have this full entry
-        if already_collected_animes.get(mal_id, {}).get("completed", False):
-            logger.info(
-                f"Anime [{title}] with id of {mal_id} already completed in database. Skipping..."
-            )
-            continue
-
-        if episode_count == 0 or mal_id == 0:
-            # we will not be able to sort our data appropriatelly
-            logger.info("Could not find either episode count or MAL ID. Skipping...")
+        if resolved is None:
             continue
 
-        if len(providers_info) == 0:
-            # nothing we can do
-            logger.warning(f"No available provider for anime {title}. Skipping...")
-            continue
-
-        # TODO: we need to rebuild this map to include recent animes
-        is_relevant = check_for_id(mal_id=mal_id, members_cut=MEMBER_CUT)
-        if not is_relevant:
-            logger.info(
-                f"Anime {title} has less than {MEMBER_CUT} members. Ignoring..."
-            )
-            continue
-
-        provider_selected = ""
-        # sort provider_names by priority (preference, then amount of links)
-        providers_info = sort_options_by_priority(providers_info)
-
-        # search for a functional provider
-        for provider_name, info in providers_info.items():
-            # link to test provider
-            trial_link = info["trial_link"]
-            sub_info, sub_link = get_subtitle_links(trial_link, desired_subs)
-
-            if sub_info and sub_link:
-                provider_selected = provider_name
-                logger.info(f"Selected {provider_selected} provider for anime {title}.")
-                break
-
-        if not provider_selected:
-            # nothing to be done
-            logger.warning(
-                f"No available provider with subtitles for anime {title}. Skipping..."
-            )
-            continue
-
-        # if we get here, we may have good data for this entry, let's process it
-        processing = True
-        page = 1
-        title_key = remove_special_characters(title).replace(" ", "_").lower()
-
-        if title_key[0].isdigit():
-            # table names cannot start with digits
-            title_key = "_" + title_key
-
-        data[title_key] = {
-            "data": [],
-            "metadata": {
-                "episode_count": episode_count,
-                "mal_id": mal_id,
-                "original_name": title,
-            },
-        }
-
-        while processing:
-            logger.info(f"Parsing page {page}")
-            page_links, has_entries = get_all_links_from_provider(
-                provider_selected, page, link
-            )
-            data[title_key]["data"] += page_links
-            processing = has_entries
-            page += 1
-
-        data[title_key]["data"] = filter_links_from_provider(
-            data[title_key]["data"], provider_selected, episode_count
-        )
+        title_key, anime_info = resolved
+        data[title_key] = anime_info
 
     for anime_title, anime_info in data.items():
-        all_subs_info = get_all_subtitles_info(
-            anime_title, anime_info, provider_selected, desired_subs
-        )
-        data[anime_title]["data"] = all_subs_info
-
+        all_subs_info = anime_info["data"]
         # if this is a new entry, we will write it regardless
         # however, if this is duplicate, we only want to write back to db if it has more eps
         current_id = data[anime_title]["metadata"]["mal_id"]
@@ -203,3 +416,117 @@ def build_json_with_links(
             data[anime_title]["data"] = []
 
     return data
+
+
+def handle_listing_job(con: Any, job: Job, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Crawl queue: queues an anime job for every finished entry of a listing page.
+    """
+    logger = get_run_logger()
+    page = job.payload["page"]
+    base_url = job.payload.get("base_url", BASE_URL)
+    entries = get_listing_entries(page=page, base_url=base_url)
+    if entries is None:
+        # bad response, let it be retried
+        raise RuntimeError(f"Bad response from page {page}.")
+    if not entries:
+        logger.info(f"Reached the end of the listing on page {page}.")
+        return {"animes": 0}
+
+    # a page without finished entries is done as well
+    animes = filter_finished_entries(entries)
+    titles, links = extract_titles_and_anime_links(animes=animes, filter_links=[])
+    limit = job.payload.get("limit") or len(links)
+    for title, link in zip(titles[:limit], links[:limit]):
+        enqueue_job(con, "anime", link, {"title": title}, refresh=True)
+
+    logger.info(f"Queued {min(limit, len(links))} animes from page {page}.")
+    return {"animes": min(limit, len(links))}
+
+
+def handle_anime_job(con: Any, job: Job, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Crawl queue: selects the provider and collects the episode links of an anime,
+    queueing an episode job for each page whose subtitles are not on a batch release.
+    The subtitle job is queued once the episodes are done (see complete_job).
+    """
+    logger = get_run_logger()
+    title = job.payload.get("title") or read_url(url=job.url, process_fn=get_title_name)
+    desired_subs = settings.get("desired_subs", DESIRED_SUBS)
+    collected = collect_anime_links(
+        title=title,
+        link=job.url,
+        desired_subs=desired_subs,
+        already_collected_animes=settings.get("already_collected_animes", {}),
+        title_keys=settings.get("title_keys"),
+    )
+    if collected is None:
+        return {"skipped": True}
+
+    title_key, anime_info, provider_selected, batch_subs = collected
+    pages = 0
+    for entry in anime_info["data"]:
+        episode_number = parse_release_title(entry["link_title"], provider_selected).episode
+        if episode_number in batch_subs:
+            continue
+        enqueue_job(con, "episode", entry["link_url"], parent_id=job.id, refresh=True)
+        pages += 1
+
+    logger.info(f"Queued {pages} episode pages for anime {title}.")
+    return {
+        "title_key": title_key,
+        "anime_info": anime_info,
+        "provider": provider_selected,
+        "batch_subs": batch_subs,
+        "desired_subs": desired_subs,
+    }
+
+
+def handle_episode_job(con: Any, job: Job, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Crawl queue: gets the subtitles (of every language) of an episode page.
+    """
+    return {"subs": get_subtitle_options(job.url)}
+
+
+def assemble_anime_job(
+    con: Any, anime_job_id: int, already_collected_animes: dict[str, dict[str, Any]] = dict()
+) -> Dict[str, Any]:
+    """
+    Crawl queue: builds the entry of an anime (same as build_json_with_links) from
+    the results of its anime and episode jobs, without requesting any page again.
+
+    Returns:
+    - Dict[str, Any]: {title_key: entry}, empty if the anime was skipped or has no
+        more episodes than the ones already on database.
+    """
+    logger = get_run_logger()
+    _, _, result = get_job(con, anime_job_id)
+    if not result or result.get("skipped"):
+        return dict()
+
+    # failed episode pages are not requested again
+    page_subs = {
+        url: (child_result or {}).get("subs", {})
+        for url, _, child_result in get_job_children(con, anime_job_id)
+    }
+    title_key, anime_info = result["title_key"], result["anime_info"]
+    anime_info["data"] = get_all_subtitles_info(
+        title_key,
+        anime_info,
+        result["provider"],
+        result["desired_subs"],
+        result["batch_subs"],
+        page_subs,
+    )
+
+    current_id = anime_info["metadata"]["mal_id"]
+    eps_in_db = already_collected_animes.get(current_id, {}).get("ep_amount", 0)
+    if eps_in_db >= len(anime_info["data"]):
+        logger.info(
+            f"This anime curretly has {eps_in_db} eps in db. This iteration "
+            f"would provide {len(anime_info['data'])} eps, so it will not be inserted."
+        )
+        return dict()
+
+    return {title_key: anime_info}
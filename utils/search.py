@@ -0,0 +1,104 @@
+import re
+import sqlite3
+from typing import Any, Literal, Optional
+
+import pandas as pd
+
+from .constants import SEARCH_DEFAULT_LIMIT, SEARCH_TS_CONFIG
+from .queries import query_search_quotes, query_search_quotes_sqlite
+
+SearchMode = Literal["words", "phrase", "prefix"]
+
+# postgres function used to build the tsquery for each search mode
+TS_FUNCTIONS = {
+    "words": "plainto_tsquery",
+    "phrase": "phraseto_tsquery",
+    "prefix": "to_tsquery",
+}
+
+
+def _split_terms(text: str) -> list[str]:
+    # only keep word characters, so user input can never break the query syntax
+    return re.findall(r"\w+", text)
+
+
+def _build_match_expression(text: str, mode: SearchMode) -> str:
+    """
+    Builds the fts5 MATCH expression (sqlite) for the given search mode.
+    """
+    terms = _split_terms(text)
+    if mode == "phrase":
+        return '"' + " ".join(terms) + '"'
+    if mode == "prefix":
+        return " ".join(f'"{term}"*' for term in terms)
+
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def _build_filters(
+    mal_id: Optional[int],
+    episode: Optional[int],
+    name: Optional[str],
+    placeholder: str,
+) -> tuple[str, dict[str, Any]]:
+    filters, params = [], {}
+    for column, value in (("mal_id", mal_id), ("episode", episode), ("name", name)):
+        if value is not None:
+            filters.append(f"AND {column} = {placeholder % column}")
+            params[column] = value
+
+    return "\n".join(filters), params
+
+
+def search_quotes(
+    con: Any,
+    text: str,
+    mode: SearchMode = "words",
+    mal_id: Optional[int] = None,
+    episode: Optional[int] = None,
+    name: Optional[str] = None,
+    schema: str = "raw_quotes",
+    limit: int = SEARCH_DEFAULT_LIMIT,
+) -> pd.DataFrame:
+    """
+    Searches quotes across every anime ingested with index_quotes=True.
+
+    Parameters:
+    - con: Either a postgres connection or a sqlite connection (from sqlite_connector,
+        with the schema attached).
+    - text (str): Text to search for.
+    - mode (str): "words" matches lines containing every word (any order),
+        "phrase" matches the exact sequence of words and "prefix" treats every
+        word as a prefix (e.g. "frier" matches "Frieren"). Default is "words".
+    - mal_id, episode, name (optional): Restrict the search to an anime,
+        an episode and/or a speaker.
+    - schema (str): Schema holding the quote_search table. Default is "raw_quotes".
+    - limit (int): Maximum number of rows returned, best matches first.
+
+    Returns:
+    - pd.DataFrame: Matching quotes (table_name, mal_id, episode, name, quote,
+        start_time, end_time, rank).
+    """
+    terms = _split_terms(text)
+    if not terms:
+        return pd.DataFrame()
+
+    if isinstance(con, sqlite3.Connection):
+        filters, params = _build_filters(mal_id, episode, name, placeholder=":%s")
+        query = query_search_quotes_sqlite % {"schema": schema, "filters": filters}
+        params.update({"text": _build_match_expression(text, mode), "limit": limit})
+
+    else:
+        filters, params = _build_filters(mal_id, episode, name, placeholder="%%(%s)s")
+        query = query_search_quotes % {
+            "schema": schema,
+            "ts_function": TS_FUNCTIONS[mode],
+            "config": SEARCH_TS_CONFIG,
+            "filters": filters,
+        }
+        search_text = text
+        if mode == "prefix":
+            search_text = " & ".join(f"{term}:*" for term in terms)
+        params.update({"text": search_text, "limit": limit})
+
+    return pd.read_sql(sql=query, con=con, params=params)
@@ -0,0 +1,111 @@
+"""
+Per episode stats of the quote tables (raw_quotes.quote_stats): lines, lines
+without speaker ("Unknown") and total duration. The writers keep them updated on
+every write, so thresholds and QA checks read this small table instead of
+scanning the quote tables. Works on both sinks.
+"""
+import sqlite3
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+import pandas as pd
+
+from .constants import (
+    MAX_LINES_PER_EPISODE,
+    STATS_MIN_EPISODES,
+    STATS_THRESHOLD_MARGIN,
+    STATS_THRESHOLD_PERCENTILE,
+)
+from .crawl_state import _fetchone, _placeholders
+from .queries import (
+    query_count_stats,
+    query_create_stats_table,
+    query_create_stats_table_sqlite,
+    query_lines_at_rank,
+    query_table_has_stats,
+)
+
+StatsRow = Tuple[str, int, int, int, int, float, str]
+
+
+def episode_stats(
+    df: pd.DataFrame, table_name: str, updated_at: Optional[datetime] = None
+) -> List[StatsRow]:
+    """
+    One row per (mal_id, episode) of df: (table_name, mal_id, episode, lines,
+    unknown_lines, duration_seconds, updated_at), as in query_upsert_stats.
+    """
+    updated_at = (updated_at or datetime.now()).isoformat(sep=" ", timespec="seconds")
+    # times may come back from the database as strings or datetime.time
+    duration = (
+        pd.to_timedelta(df["end_time"], errors="coerce")
+        - pd.to_timedelta(df["start_time"], errors="coerce")
+    ).dt.total_seconds()
+    stats = (
+        pd.DataFrame({
+            "mal_id": df["mal_id"].to_numpy(),
+            "episode": df["episode"].to_numpy(),
+            "unknown": (df["name"] == "Unknown").to_numpy(),
+            "duration": duration.fillna(0).to_numpy(),
+        })
+        .groupby(["mal_id", "episode"], sort=True)
+        .agg(
+            lines=("unknown", "size"),
+            unknown_lines=("unknown", "sum"),
+            duration_seconds=("duration", "sum"),
+        )
+    )
+    return [
+        (table_name, int(mal_id), int(episode), int(lines), int(unknown), float(seconds), updated_at)
+        for (mal_id, episode), (lines, unknown, seconds) in zip(
+            stats.index, stats.itertuples(index=False, name=None)
+        )
+    ]
+
+
+def create_stats_table(con: Any, schema: str = "raw_quotes") -> None:
+    if isinstance(con, sqlite3.Connection):
+        con.executescript(query_create_stats_table_sqlite % {"schema": schema})
+        return
+
+    cur = con.cursor()
+    cur.execute(query_create_stats_table % {"schema": schema})
+    con.commit()
+    cur.close()
+
+
+def lines_per_episode_threshold(
+    con: Any,
+    schema: str = "raw_quotes",
+    percentile: float = STATS_THRESHOLD_PERCENTILE,
+    margin: float = STATS_THRESHOLD_MARGIN,
+    min_episodes: int = STATS_MIN_EPISODES,
+    default: int = MAX_LINES_PER_EPISODE,
+) -> int:
+    """
+    Max lines per episode accepted by build_df_from_ass_files: the given percentile
+    of the lines of every episode written so far (times margin). Falls back to
+    default while less than min_episodes episodes were written.
+    """
+    create_stats_table(con, schema)
+    (episodes,) = _fetchone(con, query_count_stats % {"schema": schema}, {})
+    if episodes < min_episodes:
+        return default
+
+    # nearest rank
+    rank = min(int(episodes * percentile), episodes - 1)
+    query = query_lines_at_rank % {"schema": schema, **_placeholders(con, "rank")}
+    (lines,) = _fetchone(con, query, {"rank": rank})
+    return int(lines * margin)
+
+
+def has_stats(con: Any, table_name: str, schema: str = "raw_quotes") -> bool:
+    """
+    Whether table_name has stats, i.e. was written (tables written before the
+    stats existed, or dropped by hand, do not).
+    """
+    create_stats_table(con, schema)
+    query = query_table_has_stats % {
+        "schema": schema, **_placeholders(con, "table_name")
+    }
+    return _fetchone(con, query, {"table_name": table_name}) is not None
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import logging
+import lzma
+import os
+import shutil
+from typing import Any, Iterable, Optional
+
+from .constants import (
+    BLOBS_FOLDER,
+    BLOBS_INDEX,
+    DATA_FOLDER,
+    DOWNLOAD_CHUNK_SIZE,
+    EPISODE_INDEX,
+)
+
+# setup logger (handlers are configured by the entry point, see cli.py)
+logger = logging.getLogger(__name__)
+
+
+def hash_content(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CorruptedFileError(ValueError):
+    """
+    Raised when a downloaded file is truncated or is not a valid .xz stream.
+    """
+
+
+class _XzChecker:
+    """
+    Decompresses (and throws away) an .xz file fed in chunks, to check its
+    integrity checks. As lzma.decompress, it accepts concatenated streams and the
+    stream padding between them (null bytes, in multiples of 4). Anything else
+    after a stream is not valid .xz, so it is rejected.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.decompressor = lzma.LZMADecompressor()
+        self.padding = 0
+
+    def feed(self, data: bytes) -> None:
+        while data:
+            if self.decompressor.eof:
+                stripped = data.lstrip(b"\0")
+                self.padding += len(data) - len(stripped)
+                data = stripped
+                if not data:
+                    return
+                if self.padding % 4:
+                    raise CorruptedFileError(f"Invalid .xz stream padding in {self.path}.")
+                # another stream
+                self.decompressor = lzma.LZMADecompressor()
+                self.padding = 0
+
+            # bounded output, we only want the integrity checks
+            self.decompressor.decompress(data, max_length=DOWNLOAD_CHUNK_SIZE)
+            while not self.decompressor.needs_input and not self.decompressor.eof:
+                self.decompressor.decompress(b"", max_length=DOWNLOAD_CHUNK_SIZE)
+            data = self.decompressor.unused_data if self.decompressor.eof else b""
+
+    def close(self) -> None:
+        if not self.decompressor.eof:
+            raise CorruptedFileError(f"Truncated .xz stream in {self.path}.")
+        if self.padding % 4:
+            raise CorruptedFileError(f"Invalid .xz stream padding in {self.path}.")
+
+
+def write_stream(
+    chunks: Iterable[bytes], path: str, check_xz: bool = False
+) -> tuple[str, int]:
+    """
+    Writes chunks to path, hashing them on the way, so memory use does not depend
+    on the file size. With check_xz, the chunks are also decompressed (and thrown
+    away) to check the .xz integrity checks, and the file must end with a complete
+    stream (see _XzChecker). path is removed if the stream fails.
+
+    Returns:
+    - tuple[str, int]: sha256 and size of the written content.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    checker = _XzChecker(path) if check_xz else None
+    try:
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+                if checker is not None:
+                    checker.feed(chunk)
+
+        if checker is not None:
+            checker.close()
+
+    except lzma.LZMAError as err:
+        os.remove(path)
+        raise CorruptedFileError(f"Invalid .xz stream in {path}: {err}") from err
+
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    return digest.hexdigest(), size
+
+
+def _read_json(path: str, default: dict[str, Any]) -> dict[str, Any]:
+    if not os.path.exists(path):
+        return default
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data: dict[str, Any]) -> None:
+    # write to a temporary file first so readers never see a half written index
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class BlobStore:
+    """
+    Content addressed storage for the subtitle files. Every file is saved once,
+    named by its sha256 (sharded as ab/cd/abcd...<suffix>), and the usual
+    data/<anime>/raw|processed/ep_N files are hard links to it.
+
+    Besides the blobs, it keeps two lookups (saved on .save()):
+    - links: subtitle link -> hash of the downloaded .xz, so a file attached to
+      several releases (or re-crawled under another title) is downloaded once.
+    - processed: hash of the .xz -> hash of the decompressed .ass.
+    """
+
+    def __init__(self, root: str = BLOBS_FOLDER) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, BLOBS_INDEX)
+        index = _read_json(self.index_path, {})
+        self.links: dict[str, str] = index.get("links", {})
+        self.processed: dict[str, str] = index.get("processed", {})
+
+    def path(self, digest: str, suffix: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + suffix)
+
+    def exists(self, digest: Optional[str], suffix: str) -> bool:
+        return bool(digest) and os.path.exists(self.path(digest, suffix))
+
+    def put(self, content: bytes, suffix: str) -> str:
+        """
+        Saves content (if not already stored) and returns its hash.
+        """
+        digest = hash_content(content)
+        path = self.path(digest, suffix)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        return digest
+
+    def put_file(self, path: str, digest: str, suffix: str) -> str:
+        """
+        Moves an already written (and hashed) file into the store.
+        """
+        blob_path = self.path(digest, suffix)
+        if os.path.exists(blob_path):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(path, blob_path)
+
+        return digest
+
+    def temp_path(self, name: str) -> str:
+        # inside the store, so moving it to the blob is an atomic rename
+        return os.path.join(self.root, f"{name}.{os.getpid()}.part")
+
+    def link(self, digest: str, suffix: str, dest: str) -> None:
+        """
+        Makes dest point to the blob (hard link, or a copy when links are not supported).
+        """
+        source = self.path(digest, suffix)
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copyfile(source, dest)
+
+    def save(self) -> None:
+        _write_json(
+            self.index_path, {"links": self.links, "processed": self.processed}
+        )
+
+
+def read_episode_index(anime: str) -> dict[str, dict[str, str]]:
+    """
+    Per anime index, episode file name (without extension) -> {"raw": hash, "processed": hash, "sub_link": link}.
+    """
+    path = os.path.join(DATA_FOLDER, anime, EPISODE_INDEX)
+    return _read_json(path, {})
+
+
+def write_episode_index(anime: str, index: dict[str, dict[str, str]]) -> None:
+    _write_json(os.path.join(DATA_FOLDER, anime, EPISODE_INDEX), index)
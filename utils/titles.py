@@ -0,0 +1,225 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable
+
+from .constants import (
+    EPISODE_REGEX,
+    NOT_ALLOWED_CHARACTERS,
+    QUALITY_REGEX,
+    REMOVE_DELIMITERS_REGEX,
+    RESERVED_CHARACTERS_REMAP,
+    SEASON_REGEX,
+    SEQUENCE_REGEX,
+    SPECIAL_CHARS_REGEX,
+    TITLE_CACHE_SIZE,
+)
+
+# compiled once, instead of going through re's pattern cache for every title
+SEQUENCE_PATTERN = re.compile(SEQUENCE_REGEX)
+# quality and torrent sequence never overlap (sequence is uppercase inside brackets),
+# so a single scan finds the first occurrence of both
+QUALITY_SEQUENCE_PATTERN = re.compile(
+    f"(?P<quality>{QUALITY_REGEX[1:-1]})|\\[(?P<sequence>{SEQUENCE_REGEX[3:-3]})\\]"
+)
+REMOVE_DELIMITERS_PATTERN = re.compile(REMOVE_DELIMITERS_REGEX)
+EXTRA_SPACES_PATTERN = re.compile(r'\s{2,}')
+EPISODE_PATTERN = re.compile(EPISODE_REGEX)
+MKV_EPISODE_PATTERN = re.compile(r'\s(\d{1,3})\.mkv')
+SEASON_PATTERN = re.compile(SEASON_REGEX)
+SHORT_SEASON_PATTERN = re.compile(r'S([0-9]{1,2})')
+SPECIAL_CHARS_PATTERN = re.compile(SPECIAL_CHARS_REGEX)
+# some animes use ! and : to distinguish between seasons (e.g. nisekoi and nisekoi:),
+# so these become multiples of "_" instead of being removed
+RESERVED_CHARACTERS_TABLE = str.maketrans(RESERVED_CHARACTERS_REMAP)
+
+
+@dataclass(frozen=True, slots=True)
+class ReleaseTitle:
+    """
+    Everything we extract from a torrent title, e.g.
+    "[SubsPlease] Sousou no Frieren - 01 (1080p) [A1B2C3D4].mkv".
+    key is the title without quality/sequence/etc., used to detect duplicated releases.
+    """
+    title: str
+    provider: str
+    quality: str
+    sequence: str
+    season: str
+    episode: str
+    key: str
+
+
+def extract_provider(text: str) -> str:
+    # provider is (probably) at the start
+    provider = ""
+    if text.find("[") == 0:
+        possible_provider = text.split("]")[0] + "]"
+        matched = SEQUENCE_PATTERN.search(possible_provider)
+        if not matched:
+            # then we know it is the provider
+            provider = possible_provider
+
+    if text.find("(") == 0:
+        # regex not needed here since torrent sequence do not appear inside ()
+        provider = text.split(")")[0] + ")"
+
+    return provider
+
+
+def extract_quality_and_sequence(text: str) -> tuple[str, str]:
+    quality, sequence = "", ""
+    for match in QUALITY_SEQUENCE_PATTERN.finditer(text):
+        if not quality and match.group("quality"):
+            quality = match.group("quality")
+        elif not sequence and match.group("sequence"):
+            sequence = match.group("sequence")
+        if quality and sequence:
+            break
+
+    return quality, sequence
+
+
+def remove_text_inside_delimiters(input_string: str) -> str:
+    # remove text inside de parenthesis or brackets
+    cleaned_string = REMOVE_DELIMITERS_PATTERN.sub('', input_string)
+    # clean extra spaces
+    return EXTRA_SPACES_PATTERN.sub(' ', cleaned_string)
+
+
+def extract_episode(input_string: str) -> str:
+    # this method for episode seems to work fine for most cases
+    if not input_string:
+        return ""
+
+    text = remove_text_inside_delimiters(input_string)
+    # match any sequence of 2 to 4 numbers followed by space
+    number = ""
+    for match in EPISODE_PATTERN.finditer(text):
+        if text[match.start() - 1] in NOT_ALLOWED_CHARACTERS:
+            # the number is probably not an episode number
+            continue
+        number = match.group()
+        break
+
+    if not number:
+        # let's try another case (match string like [XY]Z.mkv, XYZ being digits)
+        match = MKV_EPISODE_PATTERN.search(input_string)
+        if match:
+            number = match.group(1)
+
+    # should not happen, but just to make sure
+    if "." in number:
+        # .5 episodes, ignore
+        number = ""
+
+    return number
+
+
+def extract_season(input_string: str, provider: str) -> str:
+    if not input_string:
+        return ""
+    # try most common first. If not found, try more specifics
+    # first we try "SXYE", where X, Y are 0-9. Ex: "S01E10" should match
+    match = SEASON_PATTERN.search(input_string)
+    if match:
+        return match.group(1)
+
+    # try same logic, but without need to have "E" after number
+    # "S3 bla bla" should match now
+    match = SHORT_SEASON_PATTERN.search(input_string)
+    if match:
+        return match.group(1)
+
+    # try specifics for famous providers
+    match provider:
+        case "[Erai-raws]":
+            # try searching for word season
+            res = input_string.lower().split(" ")
+            if "season" in res:
+                return res[res.index("season") + 1]
+        case _:
+            # can expand
+            return ""
+    # no luck
+    return ""
+
+
+def build_title_key(
+    title: str, quality: str, sequence: str, batch_provider: str
+) -> str:
+    # base cleaning (remove quality and torrent sequence)
+    title = title.replace(quality, "").replace(sequence, "")
+    # hevc changes nothing subtitle-wise
+    title = title.replace("[HEVC]", "").replace(" HEVC", "")
+
+    # try specific filter for current batch provider
+    match batch_provider:
+        case "[Erai-raws]":
+            # needs more testing, may remove too much
+            title = title.split("[Multiple Subtitle]")[0]
+        case _:
+            pass
+    return title
+
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def parse_release_title(title: str, batch_provider: str = "") -> ReleaseTitle:
+    """
+    Parses a torrent title once (cached by title), extracting provider, quality,
+    torrent sequence (CRC), season and episode number.
+
+    Parameters:
+    - title (str): Torrent title, as shown on the series page.
+    - batch_provider (str, optional): Provider selected for the anime. Used for the
+        provider specific rules (season and dedup key).
+
+    Returns:
+    - ReleaseTitle: The parsed record.
+    """
+    quality, sequence = extract_quality_and_sequence(title)
+
+    return ReleaseTitle(
+        title=title,
+        provider=extract_provider(title),
+        quality=quality,
+        sequence=sequence,
+        season=extract_season(title, batch_provider),
+        episode=extract_episode(title),
+        key=build_title_key(title, quality, sequence, batch_provider),
+    )
+
+
+def parse_release_titles(
+    titles: Iterable[str], batch_provider: str = ""
+) -> list[ReleaseTitle]:
+    """
+    Batch version of parse_release_title, for a whole provider listing.
+    """
+    return [parse_release_title(title, batch_provider) for title in titles]
+
+
+def remove_special_characters(input_string: str) -> str:
+    return SPECIAL_CHARS_PATTERN.sub('', input_string).translate(RESERVED_CHARACTERS_TABLE)
+
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def normalize_title(title: str) -> str:
+    """
+    Folder/table name form of a title, e.g. "Sousou no Frieren" -> "sousou_no_frieren".
+    Also used on the anime filters, which are matched against these names.
+    """
+    return remove_special_characters(title).replace(" ", "_").lower()
+
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def normalize_title_key(title: str) -> str:
+    """
+    Key (folder and table name) generated for a title. Two titles may get the same
+    key, the registry of the crawled animes (see TitleKeys) resolves that.
+    """
+    title_key = normalize_title(title)
+    if title_key[:1].isdigit():
+        # table names cannot start with digits
+        title_key = "_" + title_key
+    return title_key
@@ -0,0 +1,81 @@
+"""
+Integrity check of the downloaded subtitles (python cli.py verify). Only needs
+the storage modules, so it runs without the crawler or prefect.
+"""
+import logging
+import os
+from typing import Dict, List
+
+from .archive import SubtitleArchive
+from .storage import BlobStore, hash_file, read_episode_index, write_episode_index
+
+# setup logger (handlers are configured by the entry point, see cli.py)
+logger = logging.getLogger(__name__)
+
+
+def verify_subtitles(filter_anime: str = "") -> Dict[str, List[str]]:
+    """
+    Checks the downloaded files against the hashes saved when they were stored
+    (per anime _index.json, or the packed archive index), with no network access.
+    Corrupted files are removed (and dropped from the indexes), so the next
+    download_subtitles call fetches them again.
+
+    Returns:
+    - Dict[str, List[str]]: Corrupted or missing episode files, by anime.
+    """
+    store = BlobStore()
+    result = {}
+    animes = [anime for anime in os.listdir('data') if not anime.startswith('_')]
+
+    for anime in animes:
+        if filter_anime and filter_anime not in anime:
+            continue
+
+        bad = []
+        if SubtitleArchive.exists(anime):
+            with SubtitleArchive(anime) as archive:
+                bad = archive.verify()
+                for name in bad:
+                    archive.remove(name)
+
+        episode_index = read_episode_index(anime)
+        for key, entry in list(episode_index.items()):
+            raw_path = f'data/{anime}/raw/{key}.xz'
+            if not os.path.exists(os.path.dirname(raw_path)):
+                # packed, already checked above
+                if key + '.xz' in bad:
+                    episode_index.pop(key)
+                continue
+
+            checks = [(raw_path, entry.get("raw"), '.xz')]
+            processed_path = f'data/{anime}/processed/{key}.ass'
+            if entry.get("processed") and os.path.exists(processed_path):
+                checks.append((processed_path, entry["processed"], '.ass'))
+
+            for path, digest, suffix in checks:
+                if os.path.exists(path) and digest and hash_file(path) == digest:
+                    continue
+
+                logger.warning(f"{path} is missing or corrupted.")
+                bad.append(os.path.basename(path))
+                for file in [path, store.path(digest or '', suffix)]:
+                    # blobs are hard links, so they may be corrupted as well
+                    if os.path.exists(file) and hash_file(file) != digest:
+                        os.remove(file)
+
+                if suffix == '.xz':
+                    # download (and extract) it again
+                    episode_index.pop(key)
+                    if os.path.exists(processed_path):
+                        os.remove(processed_path)
+                    break
+                entry.pop("processed")
+
+        write_episode_index(anime, episode_index)
+        if bad:
+            result[anime] = bad
+            logger.warning(f"{len(bad)} corrupted files for anime {anime}.")
+        else:
+            logger.info(f"Every file of anime {anime} is fine.")
+
+    return result
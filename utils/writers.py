@@ -1,19 +1,49 @@
+import csv
+import io
+import json
 import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
 from typing import Any, Literal, Optional
 
 import pandas as pd
 import psycopg2.extras
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from prefect import get_run_logger
 
-from .constants import FORMAT
-from .queries import query_create_table
-
-# setup logger
+from .constants import (
+    SEARCH_TABLE,
+    STATS_TABLE,
+    SEARCH_TS_CONFIG,
+    SQLITE_BATCH_SIZE,
+)
+from .helpers import collapse_songs, format_timedelta
+from .metrics import METRICS
+from .profiling import profiled
+from .stats import create_stats_table, episode_stats
+from .queries import (
+    query_copy_json_reference,
+    query_create_json_reference,
+    query_create_json_reference_sqlite,
+    query_create_search_table,
+    query_create_search_table_sqlite,
+    query_create_table,
+    query_create_table_sqlite,
+    query_upsert_stats,
+)
+
+# setup logger (handlers are configured by the entry point, see cli.py)
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    format=FORMAT,
-    level=logging.INFO,
-    handlers=[logging.StreamHandler()])
+
+SEARCH_COLUMNS = ["mal_id", "episode", "name", "quote", "start_time", "end_time"]
+
+
+def _clear_songs(df: pd.DataFrame) -> pd.DataFrame:
+    # lyrics were already collapsed when the quotes were built (with the styles),
+    # this catches what is left from name and repetition alone
+    return collapse_songs(df)
 
 
 def write_data(
@@ -29,14 +59,7 @@ def write_data(
         return 0
 
     if clear_songs:
-        # TODO: this could use some work (maybe change to isin (op, opening, etc.))
-        songs = df[(df["name"] == "ED") | (df["name"] == "OP")]
-        if len(songs) > 0:
-            # drop every row with op or ed
-            df = df.drop(songs.index)
-            # now just concat the unique texts from cleaned ops and eds
-            songs = songs.drop_duplicates(subset=["name", "quote"])
-            df = pd.concat([df, songs])
+        df = _clear_songs(df)
 
     logger.info(f"Preparing to write {len(df)} rows into dataframe...")
 
@@ -64,17 +87,45 @@ def _create_table(
     cursor.close()
 
 
-def _truncate_table(
-    con,
+def _index_quotes_postgres(
+    cur,
+    df: pd.DataFrame,
     schema: str,
     table_name: str,
+    if_exists: Literal["replace", "append"],
 ) -> None:
-    cursor = con.cursor()
-    query = "TRUNCATE TABLE %s.%s;" % (schema, table_name)
+    # quote_tsv is a generated column, postgres keeps it (and the gin index) updated
+    cur.execute(
+        query_create_search_table % {"schema": schema, "config": SEARCH_TS_CONFIG}
+    )
+    if if_exists == "replace":
+        cur.execute(
+            f"DELETE FROM {schema}.{SEARCH_TABLE} WHERE table_name = %s;",
+            (table_name,),
+        )
 
-    cursor.execute(query)
-    con.commit()
-    cursor.close()
+    columns = ",".join(["table_name"] + SEARCH_COLUMNS)
+    values = "VALUES({})".format(",".join(["%s" for _ in range(len(SEARCH_COLUMNS) + 1)]))
+    insert_stmt = f"INSERT INTO {schema}.{SEARCH_TABLE} ({columns}) {values}"
+    rows = [(table_name, *row) for row in df[SEARCH_COLUMNS].values]
+    psycopg2.extras.execute_batch(cur, insert_stmt, rows)
+
+
+def _update_stats_postgres(
+    cur,
+    df: pd.DataFrame,
+    schema: str,
+    table_name: str,
+    if_exists: Literal["replace", "append"],
+) -> None:
+    if if_exists == "replace":
+        cur.execute(
+            f"DELETE FROM {schema}.{STATS_TABLE} WHERE table_name = %s;", (table_name,)
+        )
+
+    # execute_values fills %(values)s, with a page per statement
+    query = query_upsert_stats % {"schema": schema, "values": "%s"}
+    psycopg2.extras.execute_values(cur, query, episode_stats(df, table_name))
 
 
 def write_postgres(
@@ -84,8 +135,15 @@ def write_postgres(
     table_name: str,
     if_exists: Literal["replace", "append"] = "replace",
     clear_songs: bool = True,
-    cleanup: bool = True
+    cleanup: bool = True,
+    index_quotes: bool = False,
+    update_stats: bool = True,
 ) -> None:
+    """
+    Writes df to schema.table_name. The truncate (if_exists="replace"), the rows,
+    their search rows (index_quotes) and per episode stats (update_stats) are
+    written in a single transaction, so a failed write leaves the table as it was.
+    """
     logger = get_run_logger()
     # empty df
     if df.empty:
@@ -93,45 +151,247 @@ def write_postgres(
         return 0
 
     if clear_songs:
-        # TODO: this could use some work (maybe change to isin (op, opening, etc.))
-        songs = df[df["name"].isin(
-            ["ED", "ed", "Ending", "OP", "op", "Opening"]
-        )]
-        if len(songs) > 0:
-            # drop every row with op or ed
-            df = df.drop(songs.index)
-            # now just concat the unique texts from cleaned ops and eds
-            songs = songs.drop_duplicates(subset=["name", "quote"])
-            df = pd.concat([df, songs])
+        df = _clear_songs(df)
 
     logger.info(f"Preparing to write {len(df)} rows into dataframe...")
 
     # need to create table if it not exists
     _create_table(con, schema, table_name)
+    if update_stats:
+        create_stats_table(con, schema)
 
-    # give user option to clear table before insertion
-    if if_exists == "replace":
-        logger.info(f"Truncating table {schema}.{table_name}...")
-        _truncate_table(con, schema, table_name)
+    df_columns = [col.lower() for col in df.columns]
+    columns = ",".join(df_columns)
+
+    # create VALUES('%s', '%s",...) one '%s' per column
+    values = "VALUES({})".format(",".join(["%s" for _ in df_columns]))
+
+    # create INSERT INTO table (columns) VALUES('%s',...)
+    insert_stmt = f"INSERT INTO {schema}.{table_name} ({columns}) {values}"
 
+    cur = con.cursor()
     try:
-        df_columns = [col.lower() for col in df.columns]
-        columns = ",".join(df_columns)
+        with METRICS.timer("write_seconds", sink="postgres"):
+            # connections are in autocommit (see postgres_connector), so the
+            # transaction is explicit, as in write_sqlite
+            cur.execute("BEGIN;")
+
+            # give user option to clear table before insertion
+            if if_exists == "replace":
+                logger.info(f"Truncating table {schema}.{table_name}...")
+                cur.execute(f"TRUNCATE TABLE {schema}.{table_name};")
+
+            # insert in batches
+            psycopg2.extras.execute_batch(cur, insert_stmt, df.values)
+
+            if index_quotes:
+                logger.info(f"Updating search index for {schema}.{table_name}...")
+                _index_quotes_postgres(cur, df, schema, table_name, if_exists)
 
-        # create VALUES('%s', '%s",...) one '%s' per column
-        values = "VALUES({})".format(",".join(["%s" for _ in df_columns]))
+            # stats never outlive their quotes (see has_stats)
+            if update_stats:
+                _update_stats_postgres(cur, df, schema, table_name, if_exists)
 
-        # create INSERT INTO table (columns) VALUES('%s',...)
-        insert_stmt = f"INSERT INTO {schema}.{table_name} ({columns}) {values}"
+            cur.execute("COMMIT;")
 
+        METRICS.inc("rows_written_total", len(df), sink="postgres")
+
+    except Exception as e:
+        logger.error(str(e))
+        if con.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            cur.execute("ROLLBACK;")
+        raise
+
+    finally:
+        cur.close()
+        if cleanup:
+            con.close()
+
+    return
+
+
+def create_json_reference(con: Any, schema: str = "raw_quotes") -> None:
+    """
+    Creates (or migrates, see query_create_json_reference) json_reference and
+    its v_json_info view, on either sink.
+    """
+    if isinstance(con, sqlite3.Connection):
+        con.executescript(query_create_json_reference_sqlite % {"schema": schema})
+        return
+
+    cur = con.cursor()
+    cur.execute(query_create_json_reference % {"schema": schema})
+    con.commit()
+    cur.close()
+
+
+def write_json_reference(
+    entries: list[dict[str, Any]],
+    con: Any,
+    schema: str = "raw_quotes",
+    reference_date: Optional[datetime] = None,
+    cleanup: bool = True,
+) -> None:
+    """
+    Appends entries ({"name": ..., "info": ...}) to json_reference as jsonb, in a
+    single COPY (postgres only, sqlite goes through write_sqlite).
+    mal_id, ep_amount and completed are extracted by postgres (generated columns).
+    """
+    logger = get_run_logger()
+    reference_date = reference_date or datetime.today()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for entry in entries:
+        writer.writerow([json.dumps(entry), reference_date.isoformat(sep=" ")])
+    buffer.seek(0)
+
+    try:
+        if not entries:
+            logger.info("Nothing to be done, no entries.")
+            return
+
+        create_json_reference(con, schema)
         cur = con.cursor()
-        # insert in batches
-        psycopg2.extras.execute_batch(cur, insert_stmt, df.values)
-        con.commit()
+        with METRICS.timer("write_seconds", sink="postgres"):
+            cur.copy_expert(query_copy_json_reference % {"schema": schema}, buffer)
+            con.commit()
         cur.close()
+        METRICS.inc("rows_written_total", len(entries), sink="postgres")
+
+    except Exception as e:
+        logger.error(str(e))
+        con.rollback()
+        raise
+
+    finally:
+        if cleanup:
+            con.close()
+
+
+def _to_sqlite_rows(df: pd.DataFrame) -> list[tuple]:
+    # sqlite only understands python primitives
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_timedelta64_dtype(df[col]):
+            df[col] = df[col].map(format_timedelta)
+        elif pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].astype(str)
+
+    return list(df.itertuples(index=False, name=None))
+
+
+def _index_quotes_sqlite(
+    con,
+    df: pd.DataFrame,
+    schema: str,
+    table_name: str,
+    if_exists: Literal["replace", "append"],
+    batch_size: int = SQLITE_BATCH_SIZE,
+) -> None:
+    con.execute(query_create_search_table_sqlite % {"schema": schema})
+    if if_exists == "replace":
+        con.execute(
+            f"DELETE FROM {schema}.{SEARCH_TABLE} WHERE table_name = ?;",
+            (table_name,),
+        )
+
+    columns = ",".join(["table_name"] + SEARCH_COLUMNS)
+    values = "VALUES({})".format(",".join(["?" for _ in range(len(SEARCH_COLUMNS) + 1)]))
+    insert_stmt = f"INSERT INTO {schema}.{SEARCH_TABLE} ({columns}) {values}"
+    rows = [(table_name, *row) for row in _to_sqlite_rows(df[SEARCH_COLUMNS])]
+    for start in range(0, len(rows), batch_size):
+        con.executemany(insert_stmt, rows[start:start + batch_size])
+
+
+def _update_stats_sqlite(
+    con,
+    df: pd.DataFrame,
+    schema: str,
+    table_name: str,
+    if_exists: Literal["replace", "append"],
+) -> None:
+    if if_exists == "replace":
+        con.execute(
+            f"DELETE FROM {schema}.{STATS_TABLE} WHERE table_name = ?;", (table_name,)
+        )
+
+    values = "({})".format(",".join(["?" for _ in range(7)]))
+    query = query_upsert_stats % {"schema": schema, "values": values}
+    con.executemany(query, episode_stats(df, table_name))
+
+
+def write_sqlite(
+    df: pd.DataFrame,
+    con: Any,
+    schema: str,
+    table_name: str,
+    if_exists: Literal["replace", "append"] = "replace",
+    clear_songs: bool = True,
+    cleanup: bool = True,
+    index_quotes: bool = False,
+    batch_size: int = SQLITE_BATCH_SIZE,
+    update_stats: bool = True,
+) -> None:
+    """
+    Same semantics as write_postgres, but for a connection returned by
+    sqlite_connector (with the schema attached). Rows are inserted with executemany
+    in batches of batch_size, all inside a single transaction, so a "replace"
+    is atomic: readers see either the old or the new data. With update_stats, the
+    per episode stats (see utils/stats.py) are updated in the same transaction.
+    """
+    logger = get_run_logger()
+    # empty df
+    if df.empty:
+        logger.info("Nothing to be done, empty dataframe.")
+        return 0
+
+    if clear_songs:
+        df = _clear_songs(df)
+
+    logger.info(f"Preparing to write {len(df)} rows into dataframe...")
+
+    # need to create table if it not exists
+    if table_name == "json_reference":
+        create_json_reference(con, schema)
+    else:
+        con.execute(query_create_table_sqlite % (schema, table_name))
+    if update_stats:
+        create_stats_table(con, schema)
+
+    df_columns = [col.lower() for col in df.columns]
+    columns = ",".join(df_columns)
+    values = "VALUES({})".format(",".join(["?" for _ in df_columns]))
+    insert_stmt = f"INSERT INTO {schema}.{table_name} ({columns}) {values}"
+    rows = _to_sqlite_rows(df)
+
+    try:
+        start = time.perf_counter()
+        con.execute("BEGIN;")
+
+        # give user option to clear table before insertion
+        if if_exists == "replace":
+            logger.info(f"Truncating table {schema}.{table_name}...")
+            con.execute(f"DELETE FROM {schema}.{table_name};")
+
+        # insert in batches
+        for start in range(0, len(rows), batch_size):
+            con.executemany(insert_stmt, rows[start:start + batch_size])
+
+        if index_quotes:
+            logger.info(f"Updating search index for {schema}.{table_name}...")
+            _index_quotes_sqlite(con, df, schema, table_name, if_exists, batch_size)
+
+        if update_stats:
+            _update_stats_sqlite(con, df, schema, table_name, if_exists)
+
+        con.execute("COMMIT;")
+        METRICS.observe("write_seconds", time.perf_counter() - start, sink="sqlite")
+        METRICS.inc("rows_written_total", len(df), sink="sqlite")
 
     except Exception as e:
         logger.error(str(e))
+        if con.in_transaction:
+            con.execute("ROLLBACK;")
         raise
 
     finally:
@@ -141,6 +401,7 @@ def write_postgres(
     return
 
 
+@profiled()
 def merge_quotes(
     conn,
     schema: str,
@@ -168,6 +429,7 @@ def merge_quotes(
         query = f'SELECT * FROM {schema}.{table_name};'
         df = pd.read_sql(query, conn)
 
+    start = time.perf_counter()
     new_df = []
 
     for idx, row in df.iterrows():
@@ -209,4 +471,8 @@ def merge_quotes(
     )
     new_df = new_df.astype({'mal_id': 'int32', 'episode': 'int32'})
 
+    METRICS.observe("merge_seconds", time.perf_counter() - start)
+    METRICS.inc("rows_merged_total", len(df))
+    METRICS.inc("rows_after_merge_total", len(new_df))
+
     return new_df